@@ -1,16 +1,41 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
-import gspread
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
 from datetime import datetime, timedelta
 from PIL import Image
 from pyzbar.pyzbar import decode 
-import io 
 import time
 from googleapiclient.errors import HttpError
 import json
+from mkp_sheets import PRIORITY_INTERACTIVE
+from mkp_backend import open_sheets, open_drive, using_fake_backend, FAKE_CREDENTIALS
+from mkp_offline import drive_breaker, sheets_breaker, get_outbox, get_upload_spool
+from mkp_catalog import sheet_cache
+from mkp_columns import ColumnMap
+from mkp_users import get_user_index, check_password
+from mkp_photo import add_to_gallery
+from mkp_models import PackSession, RiderBatch, OrderItem, verify_rider_scan, RIDER_ADDED, RIDER_DUPLICATE, RIDER_NO_HISTORY
+from mkp_scanlog import scan_started, scan_finished, record_scan, set_scan_app
+from mkp_jobs import Workspace, ITEM_SCHEMA, ITEM_INDEX, ITEM_COLUMNS, ITEM_COLUMN_RULES
+from mkp_wedge import WedgeBuffer, focus_script, WEDGE_DEFAULT
+from mkp_metrics import timed, record, increment, set_user, start_exporter
+from mkp_profile import should_profile, run_profiled
+from streamlit.errors import StreamlitAPIException
+
+# --- PROFILER (MKP_PROFILE=1: รันทั้งสคริปต์ซ้ำภายใต้ cProfile แล้วเก็บรอบที่ช้าที่สุดไว้วิเคราะห์) ---
+def profile_run_info():
+    if not st.session_state.get('current_user_name'): return {'mode': 'login'}
+    mode = st.session_state.get('work_mode') or "📦 แผนกแพ็คสินค้า"
+    if mode == "📦 แผนกแพ็คสินค้า": return {'mode': f"pack_{st.session_state.get('picking_phase') or 'scan'}"}
+    return {'mode': 'rider' if mode == "🚚 Scan ปิดตู้" else mode}   # แอปนี้มีแค่ 2 โหมด (แพ็ค / ปิดตู้)
+
+if should_profile(): run_profiled(__file__, profile_run_info(), st.session_state); st.stop()
+
+# เวลาประมวลผลทั้งสคริปต์ต่อรอบ (เทียบกับ fragment ที่ rerun เฉพาะส่วนสแกน)
+run_started = time.perf_counter()
+start_exporter()   # ไฟล์ metrics.json + Prometheus endpoint (MKP_METRICS_PORT) เริ่มครั้งเดียวต่อ process
+set_scan_app('tracking')   # replay_scans.py ตัดสินผลตามแอปที่บันทึก
 
 # --- IMPORT LIBRARY กล้อง ---
 try:
@@ -39,6 +64,14 @@ st.markdown(
         color: #666666;
         cursor: not-allowed;
     }
+    /* ข้อความแจ้งผล (flash) หายเองฝั่ง browser ไม่ต้องรอ time.sleep บน server */
+    .mkp-flash {
+        position: fixed; top: 35%; left: 50%; transform: translate(-50%, -50%); z-index: 10000;
+        padding: 20px 40px; border-radius: 12px; background: rgba(255, 255, 255, 0.95);
+        box-shadow: 0 4px 24px rgba(0, 0, 0, 0.25); text-align: center; pointer-events: none;
+        animation: mkp-flash-fade 2s ease-in forwards;
+    }
+    @keyframes mkp-flash-fade { 0%, 70% { opacity: 1; } 100% { opacity: 0; visibility: hidden; } }
     </style>
     """,
     unsafe_allow_html=True
@@ -50,6 +83,7 @@ SHEET_ID = '1tZfX9I6Ntbo-Jf2_rcqBc2QYUrCCCSAx8K4YBkly92c'
 LOG_SHEET_NAME = 'Logs'
 RIDER_SHEET_NAME = 'Rider_Logs'
 USER_SHEET_NAME = 'User'
+SHEET_COLUMNS = ColumnMap(ITEM_COLUMN_RULES)   # Tab อื่น: แค่ตั้งชื่อ Barcode + ตัด ".0" (Tab สินค้าใช้ ITEM_COLUMNS จาก mkp_jobs)
 
 # --- SOUND HELPER ---
 def play_sound(status='success'):
@@ -64,8 +98,25 @@ def play_sound(status='success'):
         </audio>
         """, unsafe_allow_html=True)
 
+# --- FLASH MESSAGE (แจ้งผลในรอบถัดไปแทน time.sleep: rerun ได้ทันที ข้อความหายเองฝั่ง browser) ---
+FLASH_SECONDS = 2
+
+def flash(msg, icon="✅", sound=None, big=False, note="", color="#28a745"):
+    st.session_state.flash = {'msg': msg, 'icon': icon, 'sound': sound, 'big': big, 'note': note, 'color': color}
+
+def show_flash():
+    f = st.session_state.get('flash')
+    if not f: return
+    st.session_state.flash = None; st.session_state.flash_seq = st.session_state.get('flash_seq', 0) + 1
+    if f['sound']: play_sound(f['sound'])
+    if not f['big']: st.toast(f['msg'], icon=f['icon']); return
+    # data-seq เปลี่ยนทุกครั้ง browser จึงสร้าง element ใหม่และเริ่ม animation ใหม่
+    st.markdown(f"""<div class="mkp-flash" data-seq="{st.session_state.flash_seq}" style="animation-duration: {FLASH_SECONDS}s;"><div style="font-size: 80px;">{f['icon']}</div><h2 style="color: {f['color']}; font-size: 24px !important;">{f['msg']}</h2>{f['note']}</div>""", unsafe_allow_html=True)
+
 # --- AUTHENTICATION ---
 def get_credentials():
+    # MKP_BACKEND=fake ไม่ต้องมี secrets
+    if using_fake_backend(): return FAKE_CREDENTIALS
     try:
         if "oauth" in st.secrets:
             info = st.secrets["oauth"]
@@ -91,64 +142,57 @@ def get_credentials():
 def authenticate_drive():
     try:
         creds = get_credentials()
-        if creds: return build('drive', 'v3', credentials=creds)
+        if creds: return open_drive(creds)
         return None
     except Exception as e:
         st.error(f"Error Drive: {e}")
         return None
 
 # --- GOOGLE SERVICES ---
-@st.cache_data(ttl=600)
-def load_sheet_data(sheet_name=0): 
-    try:
-        creds = get_credentials()
-        if not creds: return pd.DataFrame()
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
-        if isinstance(sheet_name, int): worksheet = sh.get_worksheet(sheet_name)
-        else: worksheet = sh.worksheet(sheet_name)
-        rows = worksheet.get_all_values()
-        if len(rows) > 1:
-            headers = rows[0]; data = rows[1:]
-            df = pd.DataFrame(data, columns=headers)
-            df.columns = df.columns.str.strip()
-            for col in df.columns:
-                if 'barcode' in col.lower() or 'id' in col.lower(): 
-                    df[col] = df[col].astype(str).str.replace(r'\.0$', '', regex=True)
-            if 'Barcode' not in df.columns:
-                for col in df.columns:
-                    if col.lower() == 'barcode':
-                        df.rename(columns={col: 'Barcode'}, inplace=True); break
-            return df
-        return pd.DataFrame()
-    except Exception as e:
-        return pd.DataFrame()
-
-# Load Rider History for Duplicate Check
-@st.cache_data(ttl=30)
-def load_rider_history():
-    try:
-        creds = get_credentials()
-        if not creds: return []
-        gc = gspread.authorize(creds)
-        sh = gc.open_by_key(SHEET_ID)
+def authorize_sheets_client():
+    creds = get_credentials()
+    if not creds: return None
+    return open_sheets(creds)
+
+# Sheet Log / Folder รูป: โหลดประวัติ Rider + ยืนยันงานด้วยโค้ดชุดเดียวกับแอปอื่นและ tools/loadtest.py (mkp_jobs)
+# 1 ตัวต่อ process (ไม่สร้างใหม่ทุก rerun): ใช้ Log writer และ cache ประวัติ Rider ร่วมกันทุก session
+@st.cache_resource
+def get_workspace():
+    return Workspace(
+        SHEET_ID, MAIN_FOLDER_ID, authorize_sheets_client, authenticate_drive,
+        log_tab=LOG_SHEET_NAME, rider_tab=RIDER_SHEET_NAME,
+        pack_photo_name="{order}_PACKED_{ts}_Img{n}.jpg", last_pack_link_only=True
+    )
+
+workspace = get_workspace()
+
+def fetch_sheet_data(sheet_name=0, priority=PRIORITY_INTERACTIVE, columns=None, column_map=SHEET_COLUMNS):
+    return workspace.fetch_frame(SHEET_ID, sheet_name, column_map, columns, priority)
+
+def fetch_item_data(priority=PRIORITY_INTERACTIVE):
+    return fetch_sheet_data(0, priority, columns=list(ITEM_SCHEMA), column_map=ITEM_COLUMNS)
+
+def load_sheet_data(sheet_name=0, index=None, schema=None, loader=None):
+    with timed(f"load_sheet_data:{sheet_name}"):
+        # cache แยกต่อ Tab (ไม่ cache ค่า error) Google ล่ม: ใช้ข้อมูลชุดล่าสุดที่โหลดได้ตรวจสอบไปก่อน
+        if loader is None: loader = lambda priority: fetch_sheet_data(sheet_name, priority)
         try:
-            worksheet = sh.worksheet(RIDER_SHEET_NAME)
-            records = worksheet.get_all_records()
-            if records:
-                df = pd.DataFrame(records)
-                target_col = None
-                for col in df.columns:
-                    if "order" in col.lower() and "id" in col.lower():
-                        target_col = col
-                        break
-                if target_col:
-                    return df[target_col].astype(str).str.strip().str.upper().tolist()
-        except:
-            pass 
-        return []
-    except:
-        return []
+            return workspace.load_frame(SHEET_ID, sheet_name, loader, index=index, schema=schema)
+        except Exception:
+            return pd.DataFrame()
+
+def warm_sheet_caches():
+    # โหลด User / สินค้า (Tab แรก) ไว้ล่วงหน้าตั้งแต่ process เริ่ม แล้ว refresh เบื้องหลังก่อนหมดอายุ
+    sheet_cache.warm(SHEET_ID, USER_SHEET_NAME, lambda priority: fetch_sheet_data(USER_SHEET_NAME, priority))
+    sheet_cache.warm(SHEET_ID, 0, fetch_item_data, index=ITEM_INDEX, schema=ITEM_SCHEMA)
+    workspace.warm_rider_history()
+
+# --- BARCODE DECODE ---
+@timed("decode")
+def decode_image(file_obj):
+    res = decode(Image.open(file_obj))
+    if not res: increment("decode_miss")
+    return res
 
 # --- TIME HELPER ---
 def get_thai_time(): return (datetime.utcnow() + timedelta(hours=7)).strftime("%Y-%m-%d %H:%M:%S")
@@ -156,102 +200,43 @@ def get_thai_date_str(): return (datetime.utcnow() + timedelta(hours=7)).strftim
 def get_thai_time_suffix(): return (datetime.utcnow() + timedelta(hours=7)).strftime("%H-%M")
 def get_thai_ts_filename(): return (datetime.utcnow() + timedelta(hours=7)).strftime("%Y%m%d_%H%M%S")
 
-def save_log_to_sheet(picker_name, order_id, barcode, prod_name, location, pick_qty, user_col, file_id):
-    try:
-        creds = get_credentials(); gc = gspread.authorize(creds); sh = gc.open_by_key(SHEET_ID)
-        try: worksheet = sh.worksheet(LOG_SHEET_NAME)
-        except: worksheet = sh.add_worksheet(title=LOG_SHEET_NAME, rows="1000", cols="20"); worksheet.append_row(["Timestamp", "Picker Name", "Order ID", "Barcode", "Product Name", "Location", "Pick Qty", "User", "Image Link (Col I)"])
-        timestamp = get_thai_time(); image_link = f"https://drive.google.com/open?id={file_id}"
-        worksheet.append_row([timestamp, picker_name, order_id, barcode, prod_name, location, pick_qty, user_col, image_link])
-    except Exception as e: st.warning(f"⚠️ บันทึก Log ไม่สำเร็จ: {e}")
-
-# --- RIDER LOG (UPDATED: Support Multiple Images) ---
-def save_rider_log(picker_name, order_id, file_ids_list, folder_name, license_plate="-"):
+# --- PHOTO GALLERY ---
+def add_photo_to_gallery(gallery_key, camera_file, quality):
+    # ตรวจความคมชัด/ความสว่าง + ตัดรูปที่ถ่ายซ้ำ ด้วยขั้นตอนเดียวกับแอปอื่น (mkp_photo.add_to_gallery)
+    added, level, issues, dup = add_to_gallery(st.session_state[gallery_key], camera_file, quality)
+    if level == 'reject': return False, f"⛔ {issues} กรุณาถ่ายใหม่"
+    if dup:
+        dup_kind = 'เหมือนกันทุกจุด' if dup[1] == 'exact' else 'เกือบเหมือน'
+        return False, f"⚠️ รูปซ้ำกับรูปที่ {dup[0] + 1} ({dup_kind}) ไม่ได้เพิ่ม"
+    if level == 'warn': return True, f"⚠️ {issues}"
+    return True, ""
+
+# --- UPLOAD JOBS (อัปโหลดรูป + เขียน Log ผ่าน mkp_jobs; Drive ล่ม: เก็บงานเข้าคิว แล้วอัปโหลดให้อัตโนมัติเมื่อกลับมาออนไลน์) ---
+def submit_upload_job(job, images):
+    # คืนค่า True = อัปโหลดเสร็จแล้ว, False = เก็บเข้าคิว offline
     try:
-        creds = get_credentials(); gc = gspread.authorize(creds); sh = gc.open_by_key(SHEET_ID)
-        try: 
-            worksheet = sh.worksheet(RIDER_SHEET_NAME)
-        except: 
-            worksheet = sh.add_worksheet(title=RIDER_SHEET_NAME, rows="1000", cols="10")
-            worksheet.append_row(["Timestamp", "User Name", "Order ID", "License Plate", "Folder Name", "Rider Image Link"])
-        
-        timestamp = get_thai_time()
-        
-        # [NEW] Handle List of IDs -> Multiple Links
-        links = []
-        if isinstance(file_ids_list, list):
-            for fid in file_ids_list:
-                links.append(f"https://drive.google.com/open?id={fid}")
-            image_link_str = "\n".join(links) # Join with new line
-        else:
-            image_link_str = f"https://drive.google.com/open?id={file_ids_list}"
-
-        worksheet.append_row([timestamp, picker_name, order_id, license_plate, folder_name, image_link_str])
-        load_rider_history.clear() 
-    except Exception as e: st.warning(f"⚠️ บันทึก Rider Log ไม่สำเร็จ: {e}")
-
-# --- FOLDER STRUCTURE (PACKING) ---
-def get_target_folder_structure(service, order_id, main_parent_id):
-    now = datetime.utcnow() + timedelta(hours=7)
-    year_str = now.strftime("%Y")
-    month_str = now.strftime("%m")
-    date_str = now.strftime("%d-%m-%Y")
-
-    def _get_or_create(parent_id, name):
-        q = f"name = '{name}' and '{parent_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        res = service.files().list(q=q, fields="files(id)").execute()
-        files = res.get('files', [])
-        if files: return files[0]['id']
-        meta = {'name': name, 'parents': [parent_id], 'mimeType': 'application/vnd.google-apps.folder'}
-        folder = service.files().create(body=meta, fields='id').execute()
-        return folder.get('id')
-
-    year_id = _get_or_create(main_parent_id, year_str)
-    month_id = _get_or_create(year_id, month_str)
-    date_id = _get_or_create(month_id, date_str)
-
-    time_suffix = now.strftime("%H-%M")
-    order_folder_name = f"{order_id}_{time_suffix}"
-    meta_order = {'name': order_folder_name, 'parents': [date_id], 'mimeType': 'application/vnd.google-apps.folder'}
-    order_folder = service.files().create(body=meta_order, fields='id').execute()
-    return order_folder.get('id')
-
-# --- FOLDER STRUCTURE (RIDER) ---
-def get_rider_daily_folder(service, main_parent_id):
-    now = datetime.utcnow() + timedelta(hours=7)
-    year_str = now.strftime("%Y")
-    month_str = now.strftime("%m")
-    date_str = now.strftime("%d-%m-%Y")
-    folder_name = f"Rider_{date_str}"
-
-    def _get_or_create(parent_id, name):
-        q = f"name = '{name}' and '{parent_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        res = service.files().list(q=q, fields="files(id)").execute()
-        files = res.get('files', [])
-        if files: return files[0]['id']
-        meta = {'name': name, 'parents': [parent_id], 'mimeType': 'application/vnd.google-apps.folder'}
-        folder = service.files().create(body=meta, fields='id').execute()
-        return folder.get('id')
-    
-    year_id = _get_or_create(main_parent_id, year_str)
-    month_id = _get_or_create(year_id, month_str)
-    final_id = _get_or_create(month_id, folder_name)
-    return final_id, folder_name
-
-def upload_photo(service, file_obj, filename, folder_id):
-    try:
-        file_metadata = {'name': filename, 'parents': [folder_id]}
-        if isinstance(file_obj, bytes): media_body = io.BytesIO(file_obj)
-        else: media_body = file_obj 
-        media = MediaIoBaseUpload(media_body, mimetype='image/jpeg', chunksize=1024*1024, resumable=True)
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-        return file.get('id')
+        uploaded, errors, waiting = workspace.submit_job(job, images)
     except HttpError as error:
         error_reason = json.loads(error.content.decode('utf-8'))
         st.error(f"Google Drive Error: {error_reason}")
-        raise error
-    except Exception as e:
-        raise e
+        raise
+    # แถว Log ที่ไม่สำเร็จถูกเก็บเข้าคิวแล้ว
+    label = "Rider Log" if job['kind'] == 'rider' else "Log"
+    if errors:
+        st.warning(f"⚠️ บันทึก {label} ไม่สำเร็จ (เก็บเข้าคิว ส่งใหม่อัตโนมัติ): {errors[0]}")
+    elif waiting:
+        st.warning(f"⏳ บันทึก {label} ยังไม่เสร็จ ระบบจะบันทึกต่อให้อัตโนมัติ")
+    return uploaded
+
+def render_offline_badge():
+    outbox_n = len(get_outbox()); spool_n = len(get_upload_spool())
+    down = [b.name for b in (sheets_breaker, drive_breaker) if b.is_open]
+    if down:
+        st.markdown(f"""<div style="background:#dc3545;color:white;padding:6px 10px;border-radius:6px;font-weight:bold;">📴 OFFLINE: {', '.join(down)} — ใช้ข้อมูลล่าสุดตรวจสอบ งานจะส่งอัตโนมัติเมื่อกลับมาออนไลน์ (รอส่ง Log {outbox_n} แถว / รูป {spool_n} งาน)</div>""", unsafe_allow_html=True)
+    elif outbox_n or spool_n:
+        st.caption(f"⏳ กำลังส่งงานค้าง: Log {outbox_n} แถว / รูป {spool_n} งาน")
+    if workspace.rider_history_missing:
+        st.markdown("""<div style="background:#dc3545;color:white;padding:6px 10px;border-radius:6px;font-weight:bold;margin-top:4px;">⛔ โหลดประวัติ Rider ไม่ได้ — ตรวจ Order ซ้ำไม่ได้ ระงับการเพิ่ม Order เข้าตู้จนกว่าจะโหลดได้</div>""", unsafe_allow_html=True)
 
 # --- SAFE RESET SYSTEM ---
 def trigger_reset():
@@ -264,7 +249,7 @@ def check_and_execute_reset():
         if 'loc_man' in st.session_state: st.session_state.loc_man = ""
         
         st.session_state.order_val = ""
-        st.session_state.current_order_items = []
+        st.session_state.pack_session = PackSession()
         st.session_state.photo_gallery = [] 
         
         # [NEW] Clear Rider Photo Gallery
@@ -286,7 +271,9 @@ def check_and_execute_reset():
         st.session_state.processing_pack = False
         st.session_state.processing_rider = False
         
-        st.session_state.rider_scanned_orders = []
+        st.session_state.rider_batch = RiderBatch()
+        st.session_state.scan_input = None   # การสแกนที่ค้าง (scan log) ไม่นับต่อหลัง reset
+        st.session_state.wedge_buffer.clear()
         st.session_state.rider_input_reset_key += 1 
 
 def logout_user():
@@ -311,7 +298,10 @@ def init_session_state():
     
     if 'processing_pack' not in st.session_state: st.session_state.processing_pack = False
     if 'processing_rider' not in st.session_state: st.session_state.processing_rider = False
-    if 'rider_scanned_orders' not in st.session_state: st.session_state.rider_scanned_orders = []
+    if 'rider_batch' not in st.session_state: st.session_state.rider_batch = RiderBatch()
+    if 'pack_session' not in st.session_state: st.session_state.pack_session = PackSession()
+    if 'wedge_buffer' not in st.session_state: st.session_state.wedge_buffer = WedgeBuffer()
+    if 'wedge_mode' not in st.session_state: st.session_state.wedge_mode = WEDGE_DEFAULT
     
     # [NEW] Rider Photo Gallery List
     if 'rider_photo_gallery' not in st.session_state: st.session_state.rider_photo_gallery = []
@@ -320,24 +310,266 @@ def init_session_state():
     if 'scan_status_msg' not in st.session_state: st.session_state.scan_status_msg = None
 
     keys = ['current_user_name', 'current_user_id', 'order_val', 'prod_val', 'loc_val', 'prod_display_name', 
-            'photo_gallery', 'cam_counter', 'pick_qty', 'rider_photo', 'current_order_items', 'picking_phase', 'temp_login_user',
+            'photo_gallery', 'cam_counter', 'pick_qty', 'rider_photo', 'picking_phase', 'temp_login_user',
             'target_rider_folder_id', 'target_rider_folder_name', 'rider_lp_val']
     for k in keys:
         if k not in st.session_state:
             if k == 'pick_qty': st.session_state[k] = 1
             elif k == 'cam_counter': st.session_state[k] = 0
             elif k == 'photo_gallery': st.session_state[k] = []
-            elif k == 'current_order_items': st.session_state[k] = []
             elif k == 'picking_phase': st.session_state[k] = 'scan'
             else: st.session_state[k] = None if k in ['temp_login_user', 'target_rider_folder_id'] else ""
 
 init_session_state()
 check_and_execute_reset()
+set_user(st.session_state.current_user_id)   # metrics แยกตามพนักงาน/เครื่อง
+warm_sheet_caches()
+workspace.resume_queues()
+render_offline_badge()
+show_flash()
+
+# --- SCAN FRAGMENTS (สแกนแล้ว rerun เฉพาะส่วนสแกน ไม่ต้องรันทั้งสคริปต์) ---
+def rerun_scan(full=False):
+    # st.rerun(scope="fragment") ใช้ได้เฉพาะตอน fragment rerun เอง ตอนรันทั้งสคริปต์ให้ rerun ทั้งหน้าแทน
+    if not full:
+        try: st.rerun(scope="fragment")
+        except StreamlitAPIException: pass
+    st.rerun()
+
+# --- KEYBOARD WEDGE (เครื่องสแกน USB/Bluetooth: Enter = ส่งเอง, รหัสที่สแกนรัวเข้ามาระหว่าง rerun ประมวลผลรวมในรอบเดียว) ---
+def wedge_submit(key):
+    # on_change ทำงานก่อนรันรอบใหม่: เก็บรหัสเข้า buffer แล้วล้างช่องรอสแกนถัดไป
+    st.session_state.wedge_buffer.push(st.session_state[key])
+    st.session_state[key] = ""
+
+def wedge_input(label, key):
+    st.text_input(label, key=key, on_change=wedge_submit, args=(key,), placeholder="สแกนต่อเนื่องได้เลย ไม่ต้องแตะจอ")
+    # Streamlit รุ่นใหม่ใช้ st.iframe แทน components.html (รุ่นเก่ายังไม่มี st.iframe)
+    (getattr(st, 'iframe', None) or components.html)(focus_script(label), height=1)
+
+def wedge_item_scans(df_items, pending):
+    added, missing = [], []
+    for code, received in pending:
+        match = df_items.lookup('Barcode', code)
+        if match.empty:
+            record_scan(st.session_state, 'pack_item', code, 'not_found', 'wedge', time.time() - received)
+            missing.append(code)
+            continue
+        row = match.iloc[0]
+        try: full_name = f"{str(row['Brand'])} {str(row['Variant'])}"
+        except: full_name = "Error Name"
+        target_loc_str = f"{str(row.get('Zone','')).strip()}-{str(row.get('Location','')).strip()}"
+        st.session_state.pack_session.add(OrderItem(code, full_name, target_loc_str), unique=False)
+        record_scan(st.session_state, 'pack_item', code, 'added', 'wedge', time.time() - received)
+        added.append(full_name)
+
+    if missing:
+        play_sound('error')
+        st.error(f"❌ ไม่พบ Barcode: {', '.join(missing)}")
+    elif added:
+        play_sound('success')
+    if added: st.success(f"✅ เพิ่ม {', '.join(added)} แล้ว!")
+
+def wedge_rider_scans(pending):
+    added, problems = [], []
+    for code, received in pending:
+        order_id = code.upper()
+        outcome = verify_rider_scan(st.session_state.rider_batch, order_id, workspace.load_rider_history)
+        record_scan(st.session_state, 'rider', order_id, outcome, 'wedge', time.time() - received)
+        if outcome == RIDER_ADDED: added.append(order_id)
+        elif outcome == RIDER_DUPLICATE: problems.append(f"⚠️ {order_id} มีในตะกร้าแล้ว!")
+        elif outcome == RIDER_NO_HISTORY: problems.append(f"⛔ {order_id} โหลดประวัติ Rider ไม่ได้ ยังเพิ่มไม่ได้")
+        else: problems.append(f"⛔ {order_id} เคยบันทึกไปแล้ว!")
+
+    msg = "  \n".join(([f"✅ เพิ่ม: {', '.join(added)}"] if added else []) + problems)
+    return {'type': 'error' if problems else 'success', 'msg': msg}
+
+@st.fragment
+@timed("pack_scan")
+def pack_scan_fragment():
+    set_user(st.session_state.current_user_id)
+    df_items = load_sheet_data(0, index=ITEM_INDEX, schema=ITEM_SCHEMA, loader=fetch_item_data)
+    st.markdown("#### 1. Scan Tracking")
+    if not st.session_state.order_val and st.session_state.wedge_mode:
+        # รหัสแรกใน buffer = Tracking ที่เหลือคือ Barcode ที่สแกนตามมา ประมวลผลต่อในขั้นที่ 2
+        wedge_input("สแกน Tracking", "pack_order_wedge")
+        pending = st.session_state.wedge_buffer.pop()
+        if pending:
+            st.session_state.order_val = pending[0].upper()
+            record_scan(st.session_state, 'pack_order', st.session_state.order_val, 'accepted', 'wedge', time.time() - pending[1])
+            rerun_scan()
+    elif not st.session_state.order_val:
+        col1, col2 = st.columns([3, 1])
+        manual_order = col1.text_input("พิมพ์ Tracking ID", key="pack_order_man").strip().upper()
+        if manual_order:
+            st.session_state.order_val = manual_order
+            record_scan(st.session_state, 'pack_order', manual_order, 'accepted', 'manual')
+            rerun_scan()
+        scan_order = back_camera_input("แตะเพื่อสแกน Tracking", key=f"pack_cam_{st.session_state.cam_counter}")
+        if scan_order:
+            scan_started(st.session_state, 'camera')
+            res = decode_image(scan_order)
+            if res:
+                st.session_state.order_val = res[0].data.decode("utf-8").upper()
+                scan_finished(st.session_state, 'pack_order', st.session_state.order_val, 'accepted')
+                rerun_scan()
+            else:
+                scan_finished(st.session_state, 'pack_order', "", 'decode_miss')
+    else:
+        c1, c2 = st.columns([3, 1])
+        with c1: st.success(f"📦 Tracking: **{st.session_state.order_val}**")
+        with c2: 
+            if st.button("เปลี่ยน Tracking"): trigger_reset(); st.rerun()
+
+    if st.session_state.order_val:
+        st.markdown("---"); st.markdown("#### 2. เพิ่มรายการสินค้า (Scan & Add)")
+        if not st.session_state.prod_val and st.session_state.wedge_mode:
+            wedge_input("สแกน Barcode", "pack_prod_wedge")
+            # ข้อมูลสินค้ายังโหลดไม่เสร็จ: เก็บรหัสไว้ใน buffer ก่อน
+            if df_items.empty: st.warning("⚠️ Loading Data...")
+            else:
+                pending = st.session_state.wedge_buffer.drain()
+                if pending: wedge_item_scans(df_items, pending)
+        elif not st.session_state.prod_val:
+            col1, col2 = st.columns([3, 1])
+            manual_prod = col1.text_input("พิมพ์ Barcode", key="pack_prod_man").strip()
+            if manual_prod: st.session_state.prod_val = manual_prod; scan_started(st.session_state, 'manual'); rerun_scan()
+            scan_prod = back_camera_input("แตะเพื่อสแกนสินค้า", key=f"prod_cam_{st.session_state.cam_counter}")
+            if scan_prod:
+                scan_started(st.session_state, 'camera')
+                res_p = decode_image(scan_prod)
+                if res_p: st.session_state.prod_val = res_p[0].data.decode("utf-8"); rerun_scan()
+                else: scan_finished(st.session_state, 'pack_item', "", 'decode_miss')
+        else:
+            target_loc_str = "Unknown"
+            prod_found = False
+
+            if not df_items.empty:
+                match = df_items.lookup('Barcode', st.session_state.prod_val)
+                if not match.empty:
+                    prod_found = True
+                    row = match.iloc[0]
+                    try: brand = str(row['Brand']); variant = str(row['Variant']); full_name = f"{brand} {variant}"
+                    except: full_name = "Error Name"
+
+                    st.session_state.prod_display_name = full_name
+                    target_loc_str = f"{str(row.get('Zone','')).strip()}-{str(row.get('Location','')).strip()}"
+                else:
+                    scan_finished(st.session_state, 'pack_item', st.session_state.prod_val, 'not_found')
+                    st.error(f"❌ ไม่พบ Barcode: {st.session_state.prod_val}")
+            else:
+                st.warning("⚠️ Loading Data...")
+
+            if prod_found:
+                # สแกนซ้ำได้ (1 สแกน = 1 ชิ้น)
+                st.session_state.pack_session.add(OrderItem(st.session_state.prod_val, st.session_state.prod_display_name, target_loc_str), unique=False)
+                scan_finished(st.session_state, 'pack_item', st.session_state.prod_val, 'added')
+                st.toast(f"✅ เพิ่ม {full_name} แล้ว!", icon="🛒")
+                st.session_state.prod_val = ""
+                st.session_state.cam_counter += 1
+                rerun_scan()
+
+            if not prod_found:
+                 if st.button("❌ สแกนใหม่"): 
+                    st.session_state.prod_val = ""; st.session_state.cam_counter += 1; rerun_scan()
+
+        if st.session_state.pack_session:
+            st.markdown("---")
+            st.markdown(f"### 🛒 ตะกร้าสินค้า ({len(st.session_state.pack_session)} รายการ)")
+            st.dataframe(st.session_state.pack_session.frame(), use_container_width=True)
+            if st.button("✅ ยืนยันรายการครบแล้ว (ไปถ่ายรูป)", type="primary", use_container_width=True):
+                go_to_pack_phase(); st.rerun()
+
+@st.fragment
+@timed("rider_scan")
+def rider_scan_fragment():
+    set_user(st.session_state.current_user_id)
+    # STATUS MESSAGE
+    if st.session_state.scan_status_msg:
+        if st.session_state.scan_status_msg['type'] == 'error':
+            st.error(st.session_state.scan_status_msg['msg'])
+            play_sound('error')
+        else:
+            st.success(st.session_state.scan_status_msg['msg'])
+            play_sound('success')
+        st.session_state.scan_status_msg = None
+
+
+    # 1. ส่วนสแกน Tracking
+    st.markdown("#### 1. Scan Tracking")
+
+    if st.session_state.wedge_mode:
+        wedge_input("สแกน Tracking", "rider_ord_wedge")
+        pending = st.session_state.wedge_buffer.drain()
+        if pending:
+            was_empty = not st.session_state.rider_batch
+            st.session_state.scan_status_msg = wedge_rider_scans(pending)
+            # Order แรกต้อง rerun ทั้งหน้าเพื่อแสดงส่วนถ่ายรูป
+            rerun_scan(full=was_empty and bool(st.session_state.rider_batch))
+        man_rider_ord = ""
+        manual_submit = False
+        scan_rider_ord = None
+    else:
+        col_r1, col_r2 = st.columns([3, 1])
+        dynamic_key = f"rider_ord_man_{st.session_state.rider_input_reset_key}"
+        man_rider_ord = col_r1.text_input("พิมพ์ Tracking ID", key=dynamic_key).strip().upper()
+
+        with col_r2:
+            st.write("") 
+            st.write("")
+            manual_submit = st.button("ตกลง", use_container_width=True)
+
+        scan_rider_ord = back_camera_input("แตะเพื่อสแกน Tracking", key=f"rider_cam_ord_{st.session_state.cam_counter}")
+
+    current_rider_order = ""
+    if manual_submit and man_rider_ord:
+         current_rider_order = man_rider_ord
+         scan_started(st.session_state, 'manual')
+    elif scan_rider_ord:
+        scan_started(st.session_state, 'camera')
+        res = decode_image(scan_rider_ord)
+        if res: current_rider_order = res[0].data.decode("utf-8").upper()
+        else: scan_finished(st.session_state, 'rider', "", 'decode_miss')
+
+    if current_rider_order:
+        outcome = verify_rider_scan(st.session_state.rider_batch, current_rider_order, workspace.load_rider_history)
+        scan_finished(st.session_state, 'rider', current_rider_order, outcome)
+        st.session_state.rider_input_reset_key += 1
+        st.session_state.cam_counter += 1
+        if outcome == RIDER_DUPLICATE:
+            st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⚠️ {current_rider_order} มีในตะกร้าแล้ว!"}
+            rerun_scan()
+        elif outcome == RIDER_NO_HISTORY:
+            st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⛔ {current_rider_order} โหลดประวัติ Rider ไม่ได้ ยังเพิ่มไม่ได้"}
+            rerun_scan()
+        elif outcome != RIDER_ADDED:
+            st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⛔ {current_rider_order} เคยบันทึกไปแล้ว!"}
+            rerun_scan()
+        else:
+            st.session_state.scan_status_msg = {'type': 'success', 'msg': f"✅ เพิ่ม: {current_rider_order}"}
+            # Order แรกต้อง rerun ทั้งหน้าเพื่อแสดงส่วนถ่ายรูป
+            rerun_scan(full=len(st.session_state.rider_batch) == 1)
+
+    # รายการ Tracking ที่สแกนแล้ว
+    if st.session_state.rider_batch:
+        st.markdown(f"##### 📋 รายการที่สแกนแล้ว ({len(st.session_state.rider_batch)})")
+
+        for idx, order_id in enumerate(st.session_state.rider_batch):
+            c1, c2, c3 = st.columns([1, 4, 1])
+            c1.write(f"{idx+1}.")
+            c2.write(f"**{order_id}**")
+            if c3.button("ลบ", key=f"del_r_{idx}"):
+                st.session_state.rider_batch.remove_at(idx)
+                rerun_scan(full=not st.session_state.rider_batch)
+
+        if st.button("🗑️ ล้างทั้งหมด", type="secondary"):
+            st.session_state.rider_batch = RiderBatch()
+            st.rerun()
 
 # --- LOGIN ---
 if not st.session_state.current_user_name:
     st.title("🔐 Login พนักงาน")
-    df_users = load_sheet_data(USER_SHEET_NAME, ORDER_CHECK_SHEET_ID)
+    df_users = load_sheet_data(USER_SHEET_NAME)
     
     if st.session_state.temp_login_user is None:
         st.info("กรุณาสแกนรหัสพนักงาน")
@@ -349,14 +581,15 @@ if not st.session_state.current_user_name:
         user_input_val = None
         if manual_user: user_input_val = manual_user
         elif scan_user:
-            res_u = decode(Image.open(scan_user))
+            res_u = decode_image(scan_user)
             if res_u: user_input_val = res_u[0].data.decode("utf-8")
         
         if user_input_val:
-            if not df_users.empty and len(df_users.columns) >= 3:
-                match = df_users[df_users.iloc[:, 0].astype(str) == str(user_input_val)]
-                if not match.empty:
-                    st.session_state.temp_login_user = {'id': str(user_input_val), 'pass': str(match.iloc[0, 1]).strip(), 'name': match.iloc[0, 2]}
+            users = get_user_index(df_users)
+            if len(users):
+                user = users.get(user_input_val)
+                if user is not None:
+                    st.session_state.temp_login_user = {'id': user.id, 'verifier': user.verifier, 'name': user.name}
                     st.rerun()
                 else: st.error(f"❌ ไม่พบรหัสพนักงาน: {user_input_val}")
             else: st.warning("⚠️ โหลดข้อมูลพนักงานไม่ได้")
@@ -367,12 +600,12 @@ if not st.session_state.current_user_name:
         c1, c2 = st.columns([1, 1])
         with c1:
             if st.button("✅ ยืนยัน Login", type="primary", use_container_width=True):
-                if password_input == user_info['pass']:
+                if check_password(user_info['verifier'], password_input):
                     st.session_state.current_user_id = user_info['id']
                     st.session_state.current_user_name = user_info['name']
                     st.session_state.temp_login_user = None
-                    st.toast(f"ยินดีต้อนรับคุณ {user_info['name']} 👋", icon="✅")
-                    time.sleep(1); st.rerun()
+                    flash(f"ยินดีต้อนรับคุณ {user_info['name']} 👋")
+                    st.rerun()
                 else: st.error("❌ รหัสผ่านไม่ถูกต้อง")
         with c2:
             if st.button("⬅️ เปลี่ยน User", use_container_width=True):
@@ -381,87 +614,21 @@ else:
     # --- LOGGED IN ---
     with st.sidebar:
         st.write(f"👤 **{st.session_state.current_user_name}**")
-        mode = st.radio("เลือกโหมดทำงาน:", ["📦 แผนกแพ็คสินค้า", "🚚 Scan ปิดตู้"])
+        mode = st.radio("เลือกโหมดทำงาน:", ["📦 แผนกแพ็คสินค้า", "🚚 Scan ปิดตู้"], key="work_mode")
+        st.toggle("⌨️ ใช้เครื่องสแกน (USB/Bluetooth)", key="wedge_mode", help="สแกนเข้าช่องสแกนโดยตรง ไม่ใช้กล้อง")
         st.divider()
         if st.button("Logout", type="secondary"): logout_user()
 
     # ================= MODE 1: PACKING =================
     if mode == "📦 แผนกแพ็คสินค้า":
         st.title("📦 ระบบเบิก-แพ็คสินค้า")
-        df_items = load_sheet_data(0)
-
         if st.session_state.picking_phase == 'scan':
-            st.markdown("#### 1. Scan Tracking")
-            if not st.session_state.order_val:
-                col1, col2 = st.columns([3, 1])
-                manual_order = col1.text_input("พิมพ์ Tracking ID", key="pack_order_man").strip().upper()
-                if manual_order: st.session_state.order_val = manual_order; st.rerun()
-                scan_order = back_camera_input("แตะเพื่อสแกน Tracking", key=f"pack_cam_{st.session_state.cam_counter}")
-                if scan_order:
-                    res = decode(Image.open(scan_order))
-                    if res: st.session_state.order_val = res[0].data.decode("utf-8").upper(); st.rerun()
-            else:
-                c1, c2 = st.columns([3, 1])
-                with c1: st.success(f"📦 Tracking: **{st.session_state.order_val}**")
-                with c2: 
-                    if st.button("เปลี่ยน Tracking"): trigger_reset(); st.rerun()
-
-            if st.session_state.order_val:
-                st.markdown("---"); st.markdown("#### 2. เพิ่มรายการสินค้า (Scan & Add)")
-                if not st.session_state.prod_val:
-                    col1, col2 = st.columns([3, 1])
-                    manual_prod = col1.text_input("พิมพ์ Barcode", key="pack_prod_man").strip()
-                    if manual_prod: st.session_state.prod_val = manual_prod; st.rerun()
-                    scan_prod = back_camera_input("แตะเพื่อสแกนสินค้า", key=f"prod_cam_{st.session_state.cam_counter}")
-                    if scan_prod:
-                        res_p = decode(Image.open(scan_prod))
-                        if res_p: st.session_state.prod_val = res_p[0].data.decode("utf-8"); st.rerun()
-                else:
-                    target_loc_str = "Unknown"
-                    prod_found = False
-                    
-                    if not df_items.empty:
-                        match = df_items[df_items['Barcode'] == st.session_state.prod_val]
-                        if not match.empty:
-                            prod_found = True
-                            row = match.iloc[0]
-                            try: brand = str(row.iloc[3]); variant = str(row.iloc[5]); full_name = f"{brand} {variant}"
-                            except: full_name = "Error Name"
-                            
-                            st.session_state.prod_display_name = full_name
-                            target_loc_str = f"{str(row.get('Zone','')).strip()}-{str(row.get('Location','')).strip()}"
-                        else:
-                            st.error(f"❌ ไม่พบ Barcode: {st.session_state.prod_val}")
-                    else:
-                        st.warning("⚠️ Loading Data...")
-                    
-                    if prod_found:
-                        new_item = {
-                            "Barcode": st.session_state.prod_val,
-                            "Product Name": st.session_state.prod_display_name,
-                            "Location": target_loc_str, 
-                            "Qty": 1
-                        }
-                        st.session_state.current_order_items.append(new_item)
-                        st.toast(f"✅ เพิ่ม {full_name} แล้ว!", icon="🛒")
-                        st.session_state.prod_val = ""
-                        st.session_state.cam_counter += 1
-                        st.rerun()
-                    
-                    if not prod_found:
-                         if st.button("❌ สแกนใหม่"): 
-                            st.session_state.prod_val = ""; st.session_state.cam_counter += 1; st.rerun()
-
-                if st.session_state.current_order_items:
-                    st.markdown("---")
-                    st.markdown(f"### 🛒 ตะกร้าสินค้า ({len(st.session_state.current_order_items)} รายการ)")
-                    st.dataframe(pd.DataFrame(st.session_state.current_order_items), use_container_width=True)
-                    st.button("✅ ยืนยันรายการครบแล้ว (ไปถ่ายรูป)", type="primary", use_container_width=True, on_click=go_to_pack_phase)
+            pack_scan_fragment()
 
         elif st.session_state.picking_phase == 'pack':
             st.success(f"📦 Tracking: **{st.session_state.order_val}** (ยืนยันแล้ว)")
             st.info("รายการสินค้าที่จะแพ็ค:")
-            st.dataframe(pd.DataFrame(st.session_state.current_order_items), use_container_width=True)
+            st.dataframe(st.session_state.pack_session.frame(), use_container_width=True)
             st.markdown("#### 3. ถ่ายรูปปิดกล่อง (รวมทุกชิ้น)")
             
             if st.session_state.photo_gallery:
@@ -474,10 +641,8 @@ else:
             if len(st.session_state.photo_gallery) < 5:
                 pack_img = back_camera_input("ถ่ายรูปสินค้ากองรวม (กล้องหลัง)", key=f"pack_cam_fin_{st.session_state.cam_counter}")
                 if pack_img:
-                    img_pil = Image.open(pack_img)
-                    if img_pil.mode in ("RGBA", "P"): img_pil = img_pil.convert("RGB")
-                    buf = io.BytesIO(); img_pil.save(buf, format='JPEG', quality=120, optimize=True)
-                    st.session_state.photo_gallery.append(buf.getvalue())
+                    added, msg = add_photo_to_gallery('photo_gallery', pack_img, 120)
+                    if msg: st.toast(msg, icon="⚠️")
                     st.session_state.cam_counter += 1; st.rerun()
             
             col_b1, col_b2 = st.columns([1, 1])
@@ -493,46 +658,24 @@ else:
                     
                     if st.session_state.processing_pack:
                         with st.spinner("🚀 กำลังเชื่อมต่อ Google Drive..."):
-                            srv = authenticate_drive()
-                            if srv:
-                                fid = get_target_folder_structure(srv, st.session_state.order_val, MAIN_FOLDER_ID)
-                                ts = get_thai_ts_filename()
-                                total_imgs = len(st.session_state.photo_gallery)
-                                final_image_link_id = "" 
-
-                                for i, b in enumerate(st.session_state.photo_gallery):
-                                    current_seq = i + 1 
-                                    fn = f"{st.session_state.order_val}_PACKED_{ts}_Img{current_seq}.jpg"
-                                    uid = upload_photo(srv, b, fn, fid)
-                                    if current_seq == total_imgs:
-                                        final_image_link_id = uid
+                            # Drive ล่ม: เก็บรูป + ข้อมูล Log เข้าคิว แล้วอัปโหลดให้อัตโนมัติ
+                            job = {
+                                'kind': 'pack',
+                                'order_val': st.session_state.order_val,
+                                'ts': get_thai_ts_filename(),
+                                'timestamp': get_thai_time(),
+                                'user_name': st.session_state.current_user_name,
+                                'user_id': st.session_state.current_user_id,
+                                'items': st.session_state.pack_session.records()
+                            }
+                            confirm_started = time.time()
+                            uploaded = submit_upload_job(job, st.session_state.photo_gallery)
+                            record_scan(st.session_state, 'pack_confirm', job['order_val'], 'uploaded' if uploaded else 'queued', duration=time.time() - confirm_started, items=len(job['items']), photos=len(st.session_state.photo_gallery))
+                            offline_note = '' if uploaded else '<p>📴 Offline: รูปจะอัปโหลดอัตโนมัติเมื่อระบบกลับมา</p>'
                                 
-                                if not final_image_link_id: final_image_link_id = "-"
-
-                                for item in st.session_state.current_order_items:
-                                    save_log_to_sheet(
-                                        st.session_state.current_user_name, 
-                                        st.session_state.order_val, 
-                                        item['Barcode'], 
-                                        item['Product Name'], 
-                                        item['Location'], 
-                                        item['Qty'], 
-                                        st.session_state.current_user_id, 
-                                        final_image_link_id
-                                    )
-                                    
-                                st.markdown(
-                                    """
-                                    <div style="text-align: center;">
-                                        <div style="font-size: 100px;">✅</div>
-                                        <h2 style="color: #28a745; margin-top: -20px;">บันทึกสำเร็จ!</h2>
-                                    </div>
-                                    """, 
-                                    unsafe_allow_html=True
-                                )
-                                time.sleep(1.5)
-                                trigger_reset()
-                                st.rerun()
+                            flash("บันทึกสำเร็จ!", big=True, note=offline_note)
+                            trigger_reset()
+                            st.rerun()
 
     # ================= MODE 2: RIDER (MULTI-Tracking) =================
     elif mode == "🚚 Scan ปิดตู้":
@@ -543,76 +686,9 @@ else:
         st.markdown("#### 0. ระบุทะเบียนรถ (Optional)")
         rider_lp = st.text_input("🚛 ทะเบียนรถ", key="rider_lp_input", placeholder="กรอกทะเบียนรถที่มารับสินค้า...").strip()
 
-        # STATUS MESSAGE
-        if st.session_state.scan_status_msg:
-            if st.session_state.scan_status_msg['type'] == 'error':
-                st.error(st.session_state.scan_status_msg['msg'])
-                play_sound('error')
-            else:
-                st.success(st.session_state.scan_status_msg['msg'])
-                play_sound('success')
-            st.session_state.scan_status_msg = None
-
-
-        # 1. ส่วนสแกน Tracking
-        st.markdown("#### 1. Scan Tracking")
-        
-        col_r1, col_r2 = st.columns([3, 1])
-        dynamic_key = f"rider_ord_man_{st.session_state.rider_input_reset_key}"
-        man_rider_ord = col_r1.text_input("พิมพ์ Tracking ID", key=dynamic_key).strip().upper()
-        
-        with col_r2:
-            st.write("") 
-            st.write("")
-            manual_submit = st.button("ตกลง", use_container_width=True)
-
-        scan_rider_ord = back_camera_input("แตะเพื่อสแกน Tracking", key=f"rider_cam_ord_{st.session_state.cam_counter}")
-        
-        current_rider_order = ""
-        if manual_submit and man_rider_ord:
-             current_rider_order = man_rider_ord
-        elif scan_rider_ord:
-            res = decode(Image.open(scan_rider_ord))
-            if res: current_rider_order = res[0].data.decode("utf-8").upper()
-
-        if current_rider_order:
-            existing_ids = [o['id'] for o in st.session_state.rider_scanned_orders]
-            
-            if current_rider_order in existing_ids:
-                st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⚠️ {current_rider_order} มีในตะกร้าแล้ว!"}
-                st.session_state.rider_input_reset_key += 1
-                st.session_state.cam_counter += 1
-                st.rerun()
-            else:
-                history_list = load_rider_history()
-                if current_rider_order in history_list:
-                    st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⛔ {current_rider_order} เคยบันทึกไปแล้ว!"}
-                    st.session_state.rider_input_reset_key += 1
-                    st.session_state.cam_counter += 1
-                    st.rerun()
-                else:
-                    st.session_state.rider_scanned_orders.append({'id': current_rider_order})
-                    st.session_state.scan_status_msg = {'type': 'success', 'msg': f"✅ เพิ่ม: {current_rider_order}"}
-                    st.session_state.rider_input_reset_key += 1
-                    st.session_state.cam_counter += 1
-                    st.rerun()
+        rider_scan_fragment()
 
-        # รายการ Tracking ที่สแกนแล้ว
-        if st.session_state.rider_scanned_orders:
-            st.markdown(f"##### 📋 รายการที่สแกนแล้ว ({len(st.session_state.rider_scanned_orders)})")
-            
-            for idx, order in enumerate(st.session_state.rider_scanned_orders):
-                c1, c2, c3 = st.columns([1, 4, 1])
-                c1.write(f"{idx+1}.")
-                c2.write(f"**{order['id']}**")
-                if c3.button("ลบ", key=f"del_r_{idx}"):
-                    st.session_state.rider_scanned_orders.pop(idx)
-                    st.rerun()
-            
-            if st.button("🗑️ ล้างทั้งหมด", type="secondary"):
-                st.session_state.rider_scanned_orders = []
-                st.rerun()
-            
+        if st.session_state.rider_batch:
             st.markdown("---")
 
             # 2. ถ่ายรูปส่งมอบ (Multi-Image Gallery)
@@ -632,13 +708,9 @@ else:
             if len(st.session_state.rider_photo_gallery) < 3:
                 rider_img_input = back_camera_input("ถ่ายรูปเพิ่ม (กล้องหลัง)", key=f"rider_cam_act_{st.session_state.cam_counter}")
                 if rider_img_input:
-                    # Convert to RGB & Bytes
-                    img_pil = Image.open(rider_img_input)
-                    if img_pil.mode in ("RGBA", "P"): img_pil = img_pil.convert("RGB")
-                    buf = io.BytesIO()
-                    img_pil.save(buf, format='JPEG', quality=120, optimize=True)
-                    
-                    st.session_state.rider_photo_gallery.append(buf.getvalue())
+                    # Convert to RGB & Bytes (ตัดรูปซ้ำ)
+                    added, msg = add_photo_to_gallery('rider_photo_gallery', rider_img_input, 120)
+                    if msg: st.toast(msg, icon="⚠️")
                     st.session_state.cam_counter += 1
                     st.rerun()
             
@@ -646,51 +718,31 @@ else:
             if len(st.session_state.rider_photo_gallery) > 0:
                 st.write("")
                 if not st.session_state.processing_rider:
-                    st.button(f"🚀 ยืนยันบันทึก ({len(st.session_state.rider_scanned_orders)} Orders)", type="primary", use_container_width=True, on_click=click_confirm_rider)
+                    st.button(f"🚀 ยืนยันบันทึก ({len(st.session_state.rider_batch)} Orders)", type="primary", use_container_width=True, on_click=click_confirm_rider)
                 else:
                     st.info("⏳ กำลังบันทึกข้อมูล... กรุณารอสักครู่")
                 
                 # Processing
                 if st.session_state.processing_rider:
                     with st.spinner("🚀 กำลังอัปโหลดรูปภาพ..."):
-                        srv = authenticate_drive()
-                        ts = get_thai_ts_filename()
                         rider_lp_val = rider_lp if rider_lp else "NoPlate"
-                        lp_clean = rider_lp_val.replace(" ", "_")
-                        
-                        # Get Daily Folder
-                        daily_fid, daily_fname = get_rider_daily_folder(srv, MAIN_FOLDER_ID)
-                        
-                        uploaded_ids = []
-
-                        # Loop Upload Images
-                        for i, img_bytes in enumerate(st.session_state.rider_photo_gallery):
-                            # Name: Plate_DateTime_1.jpg
-                            fn = f"{lp_clean}_{ts}_{i+1}.jpg"
-                            uid = upload_photo(srv, img_bytes, fn, daily_fid)
-                            uploaded_ids.append(uid)
-                        
-                        # Loop Save Logs (Using List of UIDs)
-                        for order in st.session_state.rider_scanned_orders:
-                            target_ord_id = order['id']
-                            save_rider_log(
-                                st.session_state.current_user_name, 
-                                target_ord_id, 
-                                uploaded_ids, # Pass List
-                                daily_fname, 
-                                rider_lp_val
-                            )
+                        job = {
+                            'kind': 'rider',
+                            'ts': get_thai_ts_filename(),
+                            'timestamp': get_thai_time(),
+                            'user_name': st.session_state.current_user_name,
+                            'license_plate': rider_lp_val,
+                            'lp_clean': rider_lp_val.replace(" ", "_"),
+                            'orders': st.session_state.rider_batch.ids()
+                        }
+                        confirm_started = time.time()
+                        uploaded = submit_upload_job(job, st.session_state.rider_photo_gallery)
+                        record_scan(st.session_state, 'rider_confirm', job['license_plate'], 'uploaded' if uploaded else 'queued', duration=time.time() - confirm_started, orders=job['orders'], photos=len(st.session_state.rider_photo_gallery))
+                        offline_note = '' if uploaded else '<p>📴 Offline: รูปจะอัปโหลดอัตโนมัติเมื่อระบบกลับมา</p>'
                         
-                        st.markdown(
-                            """
-                            <div style="text-align: center;">
-                                <div style="font-size: 100px;">✅</div>
-                                <h2 style="color: #28a745; margin-top: -20px;">บันทึกครบถ้วน!</h2>
-                            </div>
-                            """, 
-                            unsafe_allow_html=True
-                        )
-                        time.sleep(2)
+                        flash("บันทึกครบถ้วน!", big=True, note=offline_note)
                         trigger_reset(); st.rerun()
         else:
             st.info("👈 Scan Tracking อย่างน้อย 1 รายการ")
+
+record("script_run", time.perf_counter() - run_started)
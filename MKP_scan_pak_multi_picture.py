@@ -1,8 +1,8 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import gspread
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
 from datetime import datetime, timedelta
 from PIL import Image
@@ -12,6 +12,35 @@ import time
 from googleapiclient.errors import HttpError
 import json
 import base64
+from mkp_sheets import sheets_call, PRIORITY_INTERACTIVE
+from mkp_backend import open_sheets, open_drive, using_fake_backend, FAKE_CREDENTIALS
+from mkp_offline import drive_call, drive_breaker, sheets_breaker, get_outbox, get_upload_spool
+from mkp_catalog import sheet_cache, with_row_appended, without_row
+from mkp_users import get_user_index, check_password, normalize_user_id, FIRST_DATA_ROW
+from mkp_photo import add_to_gallery
+from mkp_models import PackSession, RiderBatch, verify_scan, verify_rider_scan, SCAN_ADDED, SCAN_WRONG, RIDER_ADDED, RIDER_UNKNOWN, RIDER_DUPLICATE, RIDER_SAVED, RIDER_NO_HISTORY
+from mkp_scanlog import scan_started, scan_finished, record_scan, set_scan_app
+from mkp_jobs import Workspace, ORDER_DATA_SCHEMA, ORDER_DATA_INDEX, SHEET_COLUMNS
+from mkp_wedge import WedgeBuffer, focus_script, WEDGE_DEFAULT
+from mkp_metrics import timed, record, increment, set_user, start_exporter
+from mkp_ops import ops_snapshot, touch_session
+from mkp_profile import should_profile, run_profiled
+from streamlit.errors import StreamlitAPIException
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# --- PROFILER (MKP_PROFILE=1: รันทั้งสคริปต์ซ้ำภายใต้ cProfile แล้วเก็บรอบที่ช้าที่สุดไว้วิเคราะห์) ---
+def profile_run_info():
+    if not st.session_state.get('current_user_name'): return {'mode': 'login'}
+    mode = st.session_state.get('work_mode') or "📦 แผนกแพ็คสินค้า"
+    if mode == "📦 แผนกแพ็คสินค้า": return {'mode': f"pack_{st.session_state.get('picking_phase') or 'scan'}"}
+    return {'mode': {"🚚 Scan ปิดตู้": 'rider', "👥 จัดการพนักงาน": 'users', "📈 Performance ระบบ": 'performance'}.get(mode, mode)}
+
+if should_profile(): run_profiled(__file__, profile_run_info(), st.session_state); st.stop()
+
+# เวลาประมวลผลทั้งสคริปต์ต่อรอบ (เทียบกับ fragment ที่ rerun เฉพาะส่วนสแกน)
+run_started = time.perf_counter()
+start_exporter()   # ไฟล์ metrics.json + Prometheus endpoint (MKP_METRICS_PORT) เริ่มครั้งเดียวต่อ process
+set_scan_app('multi_picture')   # replay_scans.py ตัดสินผลตามแอปที่บันทึก
 import tempfile # [NEW] สำหรับจัดการไฟล์ชั่วคราว
 import os      # [NEW] สำหรับจัดการไฟล์
 
@@ -53,6 +82,14 @@ st.markdown(
         border: 1px dashed #ccc;
         border-radius: 5px;
     }
+    /* ข้อความแจ้งผล (flash) หายเองฝั่ง browser ไม่ต้องรอ time.sleep บน server */
+    .mkp-flash {
+        position: fixed; top: 35%; left: 50%; transform: translate(-50%, -50%); z-index: 10000;
+        padding: 20px 40px; border-radius: 12px; background: rgba(255, 255, 255, 0.95);
+        box-shadow: 0 4px 24px rgba(0, 0, 0, 0.25); text-align: center; pointer-events: none;
+        animation: mkp-flash-fade 2s ease-in forwards;
+    }
+    @keyframes mkp-flash-fade { 0%, 70% { opacity: 1; } 100% { opacity: 0; visibility: hidden; } }
     </style>
     """,
     unsafe_allow_html=True
@@ -66,6 +103,7 @@ ORDER_DATA_SHEET_NAME = 'Order_Data'
 LOG_SHEET_NAME = 'Logs'
 RIDER_SHEET_NAME = 'Rider_Logs'
 USER_SHEET_NAME = 'User'
+PERF_REFRESH_SECONDS = 5         # หน้า Performance (admin) อัปเดตตัวเองทุกกี่วินาที
 
 # --- SOUND HELPER ---
 def play_sound(status='success'):
@@ -85,8 +123,25 @@ def play_sound(status='success'):
         sound_url = backup_urls.get(status, backup_urls['scan'])
         st.markdown(f"""<audio autoplay><source src="{sound_url}" type="audio/mp3"></audio>""", unsafe_allow_html=True)
 
+# --- FLASH MESSAGE (แจ้งผลในรอบถัดไปแทน time.sleep: rerun ได้ทันที ข้อความหายเองฝั่ง browser) ---
+FLASH_SECONDS = 2
+
+def flash(msg, icon="✅", sound=None, big=False, note="", color="#28a745"):
+    st.session_state.flash = {'msg': msg, 'icon': icon, 'sound': sound, 'big': big, 'note': note, 'color': color}
+
+def show_flash():
+    f = st.session_state.get('flash')
+    if not f: return
+    st.session_state.flash = None; st.session_state.flash_seq = st.session_state.get('flash_seq', 0) + 1
+    if f['sound']: play_sound(f['sound'])
+    if not f['big']: st.toast(f['msg'], icon=f['icon']); return
+    # data-seq เปลี่ยนทุกครั้ง browser จึงสร้าง element ใหม่และเริ่ม animation ใหม่
+    st.markdown(f"""<div class="mkp-flash" data-seq="{st.session_state.flash_seq}" style="animation-duration: {FLASH_SECONDS}s;"><div style="font-size: 80px;">{f['icon']}</div><h2 style="color: {f['color']}; font-size: 24px !important;">{f['msg']}</h2>{f['note']}</div>""", unsafe_allow_html=True)
+
 # --- AUTHENTICATION ---
 def get_credentials():
+    # MKP_BACKEND=fake ไม่ต้องมี secrets
+    if using_fake_backend(): return FAKE_CREDENTIALS
     try:
         if "oauth" in st.secrets:
             info = st.secrets["oauth"]
@@ -101,151 +156,80 @@ def get_credentials():
 def authenticate_drive():
     try:
         creds = get_credentials()
-        if creds: return build('drive', 'v3', credentials=creds)
+        if creds: return open_drive(creds)
         return None
     except Exception as e:
         st.error(f"Error Drive: {e}"); return None
 
 # --- GOOGLE SERVICES ---
-@st.cache_data(ttl=600)
-def load_sheet_data(sheet_name, spreadsheet_key): 
-    try:
-        creds = get_credentials()
-        if not creds: return pd.DataFrame()
-        gc = gspread.authorize(creds)
-        try: sh = gc.open_by_key(spreadsheet_key)
-        except Exception as e: st.error(f"❌ เปิดไฟล์ Google Sheet ไม่ได้: {e}"); return pd.DataFrame()
-        try:
-            if isinstance(sheet_name, int): worksheet = sh.get_worksheet(sheet_name)
-            else: worksheet = sh.worksheet(sheet_name)
-        except Exception as e: st.error(f"❌ ไม่พบ Tab '{sheet_name}': {e}"); return pd.DataFrame()
-        
-        rows = worksheet.get_all_values()
-        if len(rows) > 1:
-            headers = rows[0]; data = rows[1:]
-            seen = {}; unique_headers = []
-            for col in headers:
-                clean_col = col.strip()
-                if not clean_col: clean_col = "Untitled" 
-                if clean_col in seen: seen[clean_col] += 1; unique_headers.append(f"{clean_col}_{seen[clean_col]}")
-                else: seen[clean_col] = 0; unique_headers.append(clean_col)
-            df = pd.DataFrame(data, columns=unique_headers)
-            for col in df.columns:
-                col_lower = col.lower()
-                if 'tracking' in col_lower or ('order' in col_lower and 'id' in col_lower): df.rename(columns={col: 'Tracking'}, inplace=True)
-                elif 'barcode' in col_lower: df.rename(columns={col: 'Barcode'}, inplace=True); df['Barcode'] = df['Barcode'].astype(str).str.replace(r'\.0$', '', regex=True)
-                elif col == 'Name' or 'product name' in col_lower: df.rename(columns={col: 'Product Name'}, inplace=True)
-                elif 'qty' in col_lower or 'quantity' in col_lower: df.rename(columns={col: 'Qty'}, inplace=True)
-            return df
-        return pd.DataFrame()
-    except Exception as e: st.error(f"❌ Load Error Other: {e}"); return pd.DataFrame()
-
-@st.cache_data(ttl=30)
-def load_rider_history():
-    try:
-        creds = get_credentials(); gc = gspread.authorize(creds); sh = gc.open_by_key(LOG_SHEET_ID) 
-        try:
-            worksheet = sh.worksheet(RIDER_SHEET_NAME); records = worksheet.get_all_records()
-            if records:
-                df = pd.DataFrame(records); target_col = None
-                for col in df.columns:
-                    if "order" in col.lower() and "id" in col.lower(): target_col = col; break
-                if target_col: return df[target_col].astype(str).str.strip().str.upper().tolist()
-        except: pass 
-        return []
-    except: return []
+def authorize_sheets_client():
+    creds = get_credentials()
+    return open_sheets(creds) if creds else None
+
+# Sheet Log / Folder รูป: โหลดประวัติ Rider + ยืนยันงานด้วยโค้ดชุดเดียวกับแอปอื่นและ tools/loadtest.py (mkp_jobs)
+# 1 ตัวต่อ process (ไม่สร้างใหม่ทุก rerun): ใช้ Log writer และ cache ประวัติ Rider ร่วมกันทุก session
+@st.cache_resource
+def get_workspace():
+    return Workspace(LOG_SHEET_ID, MAIN_FOLDER_ID, authorize_sheets_client, authenticate_drive, log_tab=LOG_SHEET_NAME, rider_tab=RIDER_SHEET_NAME,
+                     chunksize=5*1024*1024)
+
+workspace = get_workspace()
+
+def fetch_sheet_data(sheet_name, spreadsheet_key, priority=PRIORITY_INTERACTIVE, columns=None):
+    return workspace.fetch_frame(spreadsheet_key, sheet_name, SHEET_COLUMNS, columns, priority)
+
+def load_sheet_data(sheet_name, spreadsheet_key, index=None, schema=None):
+    with timed(f"load_sheet_data:{sheet_name}"):
+        # cache แยกต่อ Tab (ไม่ cache ค่า error) Google ล่ม/ช้า: ใช้ข้อมูลชุดล่าสุดที่โหลดสำเร็จแทน
+        try: return workspace.load_frame(spreadsheet_key, sheet_name, lambda priority: fetch_sheet_data(sheet_name, spreadsheet_key, priority, columns=list(schema or ())), index=index, schema=schema)
+        except gspread.exceptions.WorksheetNotFound as e: st.error(f"❌ ไม่พบ Tab '{sheet_name}': {e}"); return pd.DataFrame()
+        except Exception as e: st.error(f"❌ โหลด Sheet '{sheet_name}' ไม่ได้: {e}"); return pd.DataFrame()
+
+def warm_sheet_caches():
+    # โหลด User / Order_Data ไว้ล่วงหน้าตั้งแต่ process เริ่ม แล้ว refresh เบื้องหลังก่อนหมดอายุ
+    for tab, index, schema in ((USER_SHEET_NAME, None, None), (ORDER_DATA_SHEET_NAME, ORDER_DATA_INDEX, ORDER_DATA_SCHEMA)):
+        sheet_cache.warm(ORDER_CHECK_SHEET_ID, tab, lambda priority, tab=tab, schema=schema: fetch_sheet_data(tab, ORDER_CHECK_SHEET_ID, priority, columns=list(schema or ())), index=index, schema=schema)
+    workspace.warm_rider_history()
 
 # --- MANAGE USERS ---
 def add_new_user_to_sheet(user_id, password, name, role):
     try:
-        creds = get_credentials(); gc = gspread.authorize(creds); sh = gc.open_by_key(ORDER_CHECK_SHEET_ID); ws = sh.worksheet(USER_SHEET_NAME)
-        existing_ids = ws.col_values(1)
-        clean_existing = [str(x).strip().lower() for x in existing_ids if str(x).strip() != '']
-        clean_new_id = str(user_id).strip().lower()
-        if clean_new_id in clean_existing: return False, f"❌ ID '{user_id}' มีอยู่ในระบบแล้ว"
-        ws.append_row([str(user_id).strip(), str(password).strip(), str(name).strip(), str(role)])
-        load_sheet_data.clear(); return True, f"✅ เพิ่มพนักงาน {name} ({role}) เรียบร้อย"
+        # เช็ค ID ซ้ำจาก index ใน cache ไม่ต้องดึงคอลัมน์ ID ทั้งหมดจาก Sheet
+        if user_id in get_user_index(load_sheet_data(USER_SHEET_NAME, ORDER_CHECK_SHEET_ID)): return False, f"❌ ID '{user_id}' มีอยู่ในระบบแล้ว"
+        creds = get_credentials(); gc = open_sheets(creds); sh = sheets_call(gc.open_by_key, ORDER_CHECK_SHEET_ID); ws = sheets_call(sh.worksheet, USER_SHEET_NAME)
+        new_row = [str(user_id).strip(), str(password).strip(), str(name).strip(), str(role)]
+        sheets_call(ws.append_row, new_row)
+        # แก้เฉพาะตาราง User ใน cache ไม่ล้าง Order_Data ที่ใหญ่
+        sheet_cache.update(ORDER_CHECK_SHEET_ID, USER_SHEET_NAME, lambda df: with_row_appended(df, new_row)); return True, f"✅ เพิ่มพนักงาน {name} ({role}) เรียบร้อย"
     except Exception as e: return False, f"Error: {e}"
 
 def delete_user_from_sheet(user_id):
     try:
-        creds = get_credentials(); gc = gspread.authorize(creds); sh = gc.open_by_key(ORDER_CHECK_SHEET_ID); ws = sh.worksheet(USER_SHEET_NAME)
-        try:
-            cell = ws.find(str(user_id))
-            if cell: ws.delete_rows(cell.row); load_sheet_data.clear(); return True, f"✅ ลบ ID {user_id} เรียบร้อย"
-            else: return False, f"❌ ไม่พบ ID {user_id}"
-        except: return False, f"❌ ไม่พบ ID {user_id}"
+        user = get_user_index(load_sheet_data(USER_SHEET_NAME, ORDER_CHECK_SHEET_ID)).get(user_id)
+        if user is None: return False, f"❌ ไม่พบ ID {user_id}"
+        creds = get_credentials(); gc = open_sheets(creds); sh = sheets_call(gc.open_by_key, ORDER_CHECK_SHEET_ID); ws = sheets_call(sh.worksheet, USER_SHEET_NAME)
+        # ลบตามเลขแถวใน index แต่เช็คก่อนว่าแถวนั้นยังเป็น ID เดิม (มีคนแก้ Sheet ตรงๆ แถวอาจเลื่อน) ถ้าไม่ตรงให้โหลดใหม่แล้วลองอีกครั้ง
+        current_id = sheets_call(ws.acell, f"A{user.row}").value
+        if normalize_user_id(current_id or "") != normalize_user_id(user.id):
+            sheet_cache.invalidate(ORDER_CHECK_SHEET_ID, USER_SHEET_NAME); return False, f"❌ ข้อมูลพนักงานใน Sheet เปลี่ยนไป กรุณาลองลบ ID {user_id} อีกครั้ง"
+        sheets_call(ws.delete_rows, user.row)
+        sheet_cache.update(ORDER_CHECK_SHEET_ID, USER_SHEET_NAME, lambda df: without_row(df, user.row - FIRST_DATA_ROW)); return True, f"✅ ลบ ID {user_id} เรียบร้อย"
     except Exception as e: return False, f"Error: {e}"
 
+# --- BARCODE DECODE ---
+@timed("decode")
+def decode_image(file_obj):
+    res = decode(Image.open(file_obj))
+    if not res: increment("decode_miss")
+    return res
+
 # --- TIME HELPER ---
 def get_thai_time(): return (datetime.utcnow() + timedelta(hours=7)).strftime("%Y-%m-%d %H:%M:%S")
 def get_thai_date_str(): return (datetime.utcnow() + timedelta(hours=7)).strftime("%d-%m-%Y")
 def get_thai_ts_filename(): return (datetime.utcnow() + timedelta(hours=7)).strftime("%Y%m%d_%H%M%S")
 
-# --- SAVE LOGS (UPDATED FOR MULTI-PHOTOS) ---
-def save_log_to_sheet(picker_name, order_id, barcode, prod_name, location, pick_qty, user_col, file_id_or_list):
-    try:
-        creds = get_credentials(); gc = gspread.authorize(creds)
-        sh = gc.open_by_key(LOG_SHEET_ID) 
-        try: worksheet = sh.worksheet(LOG_SHEET_NAME)
-        except: worksheet = sh.add_worksheet(title=LOG_SHEET_NAME, rows="1000", cols="20"); worksheet.append_row(["Timestamp", "Picker Name", "Order ID", "Barcode", "Product Name", "Location", "Pick Qty", "User", "Image Link (Col I)"])
-        
-        timestamp = get_thai_time()
-        
-        # [UPDATED] รองรับทั้ง ID เดียว และ List ของ ID
-        if isinstance(file_id_or_list, list):
-            # กรณีเป็น List ให้สร้าง Link หลายบรรทัด
-            links = [f"https://drive.google.com/open?id={fid}" for fid in file_id_or_list]
-            image_link = "\n".join(links)
-        else:
-            # กรณีเป็น ID เดียว
-            image_link = f"https://drive.google.com/open?id={file_id_or_list}"
-            
-        worksheet.append_row([timestamp, picker_name, order_id, barcode, prod_name, location, pick_qty, user_col, image_link])
-        
-    except Exception as e: st.warning(f"⚠️ บันทึก Log ไม่สำเร็จ: {e}")
-
-def save_rider_log(picker_name, order_id, file_ids_list, folder_name, license_plate="-"):
-    try:
-        creds = get_credentials(); gc = gspread.authorize(creds); sh = gc.open_by_key(LOG_SHEET_ID) 
-        try: worksheet = sh.worksheet(RIDER_SHEET_NAME)
-        except: worksheet = sh.add_worksheet(title=RIDER_SHEET_NAME, rows="1000", cols="10"); worksheet.append_row(["Timestamp", "User Name", "Order ID", "License Plate", "Folder Name", "Rider Image Link"])
-        timestamp = get_thai_time()
-        links = []; image_link_str = ""
-        if isinstance(file_ids_list, list):
-            for fid in file_ids_list: links.append(f"https://drive.google.com/open?id={fid}")
-            image_link_str = "\n".join(links) 
-        else: image_link_str = f"https://drive.google.com/open?id={file_ids_list}"
-        worksheet.append_row([timestamp, picker_name, order_id, license_plate, folder_name, image_link_str])
-        load_rider_history.clear() 
-    except Exception as e: st.warning(f"⚠️ บันทึก Rider Log ไม่สำเร็จ: {e}")
-
-# --- FOLDER STRUCTURE ---
-def get_target_folder_structure(service, order_id, main_parent_id):
-    now = datetime.utcnow() + timedelta(hours=7); year_str = now.strftime("%Y"); month_str = now.strftime("%m"); date_str = now.strftime("%d-%m-%Y")
-    def _get_or_create(parent_id, name):
-        q = f"name = '{name}' and '{parent_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        res = service.files().list(q=q, fields="files(id)").execute(); files = res.get('files', [])
-        if files: return files[0]['id']
-        meta = {'name': name, 'parents': [parent_id], 'mimeType': 'application/vnd.google-apps.folder'}
-        folder = service.files().create(body=meta, fields='id').execute(); return folder.get('id')
-    year_id = _get_or_create(main_parent_id, year_str); month_id = _get_or_create(year_id, month_str); date_id = _get_or_create(month_id, date_str)
-    order_folder_name = f"{order_id}_{now.strftime('%H-%M')}"
-    meta_order = {'name': order_folder_name, 'parents': [date_id], 'mimeType': 'application/vnd.google-apps.folder'}
-    order_folder = service.files().create(body=meta_order, fields='id').execute(); return order_folder.get('id')
-
-def get_rider_daily_folder(service, main_parent_id):
-    now = datetime.utcnow() + timedelta(hours=7); year_str = now.strftime("%Y"); month_str = now.strftime("%m"); folder_name = f"Rider_{now.strftime('%d-%m-%Y')}"
-    def _get_or_create(parent_id, name):
-        q = f"name = '{name}' and '{parent_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        res = service.files().list(q=q, fields="files(id)").execute(); files = res.get('files', [])
-        if files: return files[0]['id']
-        meta = {'name': name, 'parents': [parent_id], 'mimeType': 'application/vnd.google-apps.folder'}
-        folder = service.files().create(body=meta, fields='id').execute(); return folder.get('id')
-    year_id = _get_or_create(main_parent_id, year_str); month_id = _get_or_create(year_id, month_str); final_id = _get_or_create(month_id, folder_name)
-    return final_id, folder_name
-
 # --- [NEW] PROCESS VIDEO QUALITY ---
+@timed("video_encode")
 def process_video_quality(uploaded_file, quality_setting):
     """
     Quality Settings:
@@ -320,14 +304,39 @@ def upload_file_to_drive(service, file_obj, filename, folder_id, mime_type='imag
         else:
              media = MediaIoBaseUpload(file_obj, mimetype=mime_type, chunksize=5*1024*1024, resumable=True)
              
-        file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
+        file = drive_call(service.files().create(body=file_metadata, media_body=media, fields='id'))
         return file.get('id')
     except HttpError as error:
         st.error(f"Drive Error: {json.loads(error.content.decode('utf-8'))}"); raise error
     except Exception as e: raise e
 
-def upload_photo(service, file_obj, filename, folder_id):
-    return upload_file_to_drive(service, io.BytesIO(file_obj), filename, folder_id, 'image/jpeg')
+# --- PHOTO GALLERY ---
+def add_photo_to_gallery(gallery_key, camera_file, quality):
+    added, level, issues, dup = add_to_gallery(st.session_state[gallery_key], camera_file, quality)
+    if level == 'reject': return False, f"⛔ {issues} กรุณาถ่ายใหม่"
+    if dup: return False, f"⚠️ รูปซ้ำกับรูปที่ {dup[0] + 1} ({'เหมือนกันทุกจุด' if dup[1] == 'exact' else 'เกือบเหมือน'}) ไม่ได้เพิ่ม"
+    return True, (f"⚠️ {issues}" if level == 'warn' else "")
+
+# --- UPLOAD JOBS (อัปโหลดรูป + เขียน Log ผ่าน mkp_jobs; Drive ล่ม: เก็บงานเข้าคิว แล้วอัปโหลดให้อัตโนมัติเมื่อกลับมาออนไลน์) ---
+def submit_upload_job(job, images):
+    # คืนค่า True = อัปโหลดเสร็จแล้ว, False = เก็บเข้าคิว offline
+    try: uploaded, errors, waiting = workspace.submit_job(job, images)
+    except HttpError as error: st.error(f"Drive Error: {json.loads(error.content.decode('utf-8'))}"); raise
+    # แถว Log ที่ไม่สำเร็จถูกเก็บเข้าคิวแล้ว
+    label = "Rider Log" if job['kind'] == 'rider' else "Log"
+    if errors: st.warning(f"⚠️ บันทึก {label} ไม่สำเร็จ (เก็บเข้าคิว ส่งใหม่อัตโนมัติ): {errors[0]}")
+    elif waiting: st.warning(f"⏳ บันทึก {label} ยังไม่เสร็จ ระบบจะบันทึกต่อให้อัตโนมัติ")
+    return uploaded
+
+def render_offline_badge():
+    outbox_n = len(get_outbox()); spool_n = len(get_upload_spool())
+    down = [b.name for b in (sheets_breaker, drive_breaker) if b.is_open]
+    if down:
+        st.markdown(f"""<div style="background:#dc3545;color:white;padding:6px 10px;border-radius:6px;font-weight:bold;">📴 OFFLINE: {', '.join(down)} — ใช้ข้อมูลล่าสุดตรวจสอบ งานจะส่งอัตโนมัติเมื่อกลับมาออนไลน์ (รอส่ง Log {outbox_n} แถว / รูป {spool_n} งาน)</div>""", unsafe_allow_html=True)
+    elif outbox_n or spool_n:
+        st.caption(f"⏳ กำลังส่งงานค้าง: Log {outbox_n} แถว / รูป {spool_n} งาน")
+    if workspace.rider_history_missing:
+        st.markdown("""<div style="background:#dc3545;color:white;padding:6px 10px;border-radius:6px;font-weight:bold;margin-top:4px;">⛔ โหลดประวัติ Rider ไม่ได้ — ตรวจ Order ซ้ำไม่ได้ ระงับการเพิ่ม Order เข้าตู้จนกว่าจะโหลดได้</div>""", unsafe_allow_html=True)
 
 # --- SAFE RESET SYSTEM ---
 def trigger_reset(): st.session_state.need_reset = True
@@ -335,13 +344,15 @@ def check_and_execute_reset():
     if st.session_state.get('need_reset'):
         keys = ['pack_order_man','pack_prod_man','loc_man','order_val','prod_val','loc_val','prod_display_name']
         for k in keys: st.session_state[k] = ""
-        st.session_state.current_order_items = []; st.session_state.expected_items = [] 
+        st.session_state.pack_session = PackSession()
         st.session_state.photo_gallery = []; st.session_state.rider_photo_gallery = []
         st.session_state.video_file = None; st.session_state.rider_photo = None
         st.session_state.picking_phase = 'scan'; st.session_state.temp_login_user = None
         st.session_state.pick_qty = 1; st.session_state.cam_counter += 1; st.session_state.need_reset = False
         st.session_state.processing_pack = False; st.session_state.processing_rider = False
-        st.session_state.rider_scanned_orders = []; st.session_state.rider_input_reset_key += 1 
+        st.session_state.rider_batch = RiderBatch(); st.session_state.rider_input_reset_key += 1 
+        st.session_state.scan_input = None   # การสแกนที่ค้าง (scan log) ไม่นับต่อหลัง reset
+        st.session_state.wedge_buffer.clear()
 
 def logout_user():
     st.session_state.current_user_name = ""; st.session_state.current_user_id = ""; st.session_state.current_user_role = ""
@@ -358,9 +369,11 @@ def init_session_state():
     if 'need_reset' not in st.session_state: st.session_state.need_reset = False
     if 'processing_pack' not in st.session_state: st.session_state.processing_pack = False
     if 'processing_rider' not in st.session_state: st.session_state.processing_rider = False
-    if 'rider_scanned_orders' not in st.session_state: st.session_state.rider_scanned_orders = []
+    if 'rider_batch' not in st.session_state: st.session_state.rider_batch = RiderBatch()
     if 'rider_photo_gallery' not in st.session_state: st.session_state.rider_photo_gallery = []
-    if 'expected_items' not in st.session_state: st.session_state.expected_items = []
+    if 'pack_session' not in st.session_state: st.session_state.pack_session = PackSession()
+    if 'wedge_buffer' not in st.session_state: st.session_state.wedge_buffer = WedgeBuffer()
+    if 'wedge_mode' not in st.session_state: st.session_state.wedge_mode = WEDGE_DEFAULT
     if 'rider_input_reset_key' not in st.session_state: st.session_state.rider_input_reset_key = 0
     if 'scan_status_msg' not in st.session_state: st.session_state.scan_status_msg = None
     if 'add_user_id' not in st.session_state: st.session_state.add_user_id = ""
@@ -373,19 +386,217 @@ def init_session_state():
     if 'video_quality' not in st.session_state: st.session_state.video_quality = 'Original (Max)'
 
     keys = ['current_user_name', 'current_user_id', 'order_val', 'prod_val', 'loc_val', 'prod_display_name', 
-            'photo_gallery', 'cam_counter', 'pick_qty', 'rider_photo', 'current_order_items', 'picking_phase', 'temp_login_user',
+            'photo_gallery', 'cam_counter', 'pick_qty', 'rider_photo', 'picking_phase', 'temp_login_user',
             'target_rider_folder_id', 'target_rider_folder_name', 'rider_lp_val']
     for k in keys:
         if k not in st.session_state:
             if k == 'pick_qty': st.session_state[k] = 1
             elif k == 'cam_counter': st.session_state[k] = 0
             elif k == 'photo_gallery': st.session_state[k] = []
-            elif k == 'current_order_items': st.session_state[k] = []
             elif k == 'picking_phase': st.session_state[k] = 'scan'
             else: st.session_state[k] = None
 
 init_session_state()
 check_and_execute_reset()
+set_user(st.session_state.current_user_id)   # metrics แยกตามพนักงาน/เครื่อง
+touch_session(getattr(get_script_run_ctx(), 'session_id', None), st.session_state.current_user_id, st.session_state.to_dict)
+warm_sheet_caches()
+workspace.resume_queues()
+render_offline_badge()
+show_flash()
+
+# --- SCAN FRAGMENTS (สแกนแล้ว rerun เฉพาะส่วนสแกน ไม่ต้องรันทั้งสคริปต์) ---
+def rerun_scan(full=False):
+    # st.rerun(scope="fragment") ใช้ได้เฉพาะตอน fragment rerun เอง ตอนรันทั้งสคริปต์ให้ rerun ทั้งหน้าแทน
+    if not full:
+        try: st.rerun(scope="fragment")
+        except StreamlitAPIException: pass
+    st.rerun()
+
+# --- KEYBOARD WEDGE (เครื่องสแกน USB/Bluetooth: Enter = ส่งเอง, รหัสที่สแกนรัวเข้ามาระหว่าง rerun ประมวลผลรวมในรอบเดียว) ---
+RIDER_SCAN_MESSAGES = {RIDER_UNKNOWN: "⛔ ไม่พบ Tracking", RIDER_DUPLICATE: "⚠️ ซ้ำ", RIDER_SAVED: "⛔ เคยบันทึกแล้ว", RIDER_NO_HISTORY: "⛔ โหลดประวัติ Rider ไม่ได้ ยังเพิ่มไม่ได้"}
+
+def wedge_submit(key):
+    # on_change ทำงานก่อนรันรอบใหม่: เก็บรหัสเข้า buffer แล้วล้างช่องรอสแกนถัดไป
+    st.session_state.wedge_buffer.push(st.session_state[key]); st.session_state[key] = ""
+
+def wedge_input(label, key):
+    st.text_input(label, key=key, on_change=wedge_submit, args=(key,), placeholder="สแกนต่อเนื่องได้เลย ไม่ต้องแตะจอ")
+    # Streamlit รุ่นใหม่ใช้ st.iframe แทน components.html (รุ่นเก่ายังไม่มี st.iframe)
+    (getattr(st, 'iframe', None) or components.html)(focus_script(label), height=1)
+
+def wedge_pack_scans(session, pending):
+    added, duplicate, wrong = [], 0, []
+    for code, received in pending:
+        outcome, found_item = verify_scan(session, code); record_scan(st.session_state, 'pack_product', code, outcome, 'wedge', time.time() - received)
+        if outcome == SCAN_ADDED: added.append(found_item.name)
+        elif outcome == SCAN_WRONG: wrong.append(code)
+        else: duplicate += 1
+    if wrong: play_sound('error'); st.error(f"⛔ สินค้าผิด! Barcode {', '.join(wrong)} ไม่อยู่ใน Order นี้")
+    elif added: play_sound('success')
+    if added: st.success(f"✅ ถูกต้อง! เพิ่ม {', '.join(added)}")
+    if duplicate: st.info(f"⚠️ สแกนซ้ำ {duplicate} รายการ (สแกนไปแล้ว)")
+
+def wedge_rider_scans(pending, known, ready=True):
+    if not ready:
+        for code, received in pending: record_scan(st.session_state, 'rider', code.upper(), 'load_error', 'wedge', time.time() - received)
+        return {'type': 'error', 'msg': f"⚠️ โหลดข้อมูล Error"}
+    added, problems = [], []
+    for code, received in pending:
+        order_id = code.upper(); outcome = verify_rider_scan(st.session_state.rider_batch, order_id, workspace.load_rider_history, known=known)
+        record_scan(st.session_state, 'rider', order_id, outcome, 'wedge', time.time() - received)
+        if outcome == RIDER_ADDED: added.append(order_id)
+        else: problems.append(f"{RIDER_SCAN_MESSAGES[outcome]}: {order_id}")
+    msg = "  \n".join(([f"✅ เพิ่ม: {', '.join(added)}"] if added else []) + problems)
+    return {'type': 'error' if problems else 'success', 'msg': msg}
+
+@st.fragment
+@timed("pack_scan")
+def pack_scan_fragment():
+    set_user(st.session_state.current_user_id)
+    df_order_data = load_sheet_data(ORDER_DATA_SHEET_NAME, ORDER_CHECK_SHEET_ID, index=ORDER_DATA_INDEX, schema=ORDER_DATA_SCHEMA)
+    session = st.session_state.pack_session
+    st.markdown("#### 1. Scan Tracking (ตรวจสอบ Order Data)")
+    if not st.session_state.order_val and st.session_state.wedge_mode:
+        # รหัสแรกใน buffer = Tracking ที่เหลือคือ Barcode ที่สแกนตามมา ประมวลผลต่อหลังโหลด Order
+        wedge_input("สแกน Tracking", "pack_order_wedge"); pending = st.session_state.wedge_buffer.pop()
+        if pending: st.session_state.order_val = pending[0].upper(); scan_started(st.session_state, 'wedge', pending[1]); rerun_scan()
+    elif not st.session_state.order_val:
+        col1, col2 = st.columns([3, 1])
+        manual_order = col1.text_input("พิมพ์ Tracking ID", key="pack_order_man").strip().upper()
+        if manual_order: st.session_state.order_val = manual_order; scan_started(st.session_state, 'manual'); rerun_scan()
+        scan_order = back_camera_input("แตะเพื่อสแกน Tracking", key=f"pack_cam_{st.session_state.cam_counter}")
+        if scan_order:
+            scan_started(st.session_state, 'camera'); res = decode_image(scan_order)
+            if res: st.session_state.order_val = res[0].data.decode("utf-8").upper(); rerun_scan()
+            else: scan_finished(st.session_state, 'pack_tracking', "", 'decode_miss')
+    else:
+        c1, c2 = st.columns([3, 1])
+        with c1: st.success(f"📦 Tracking: **{st.session_state.order_val}**")
+        with c2: 
+            if st.button("เปลี่ยน Tracking"): trigger_reset(); st.rerun()
+
+    if st.session_state.order_val:
+        if df_order_data.empty: st.error(f"❌ ไม่พบข้อมูลใน Sheet {ORDER_DATA_SHEET_NAME}")
+        else:
+            if not session.expected:
+                try:
+                    matches = df_order_data.lookup('Tracking', st.session_state.order_val)
+                    if matches.empty: scan_finished(st.session_state, 'pack_tracking', st.session_state.order_val, 'not_found'); flash("ไม่พบ Tracking ในระบบ!", icon="⛔", sound='error', big=True, color="#dc3545"); trigger_reset(); st.rerun()
+                    else: session.set_expected(matches.to_dict('records')); scan_finished(st.session_state, 'pack_tracking', st.session_state.order_val, 'found', items=len(session.expected))
+                except KeyError: st.error("❌ Sheet Order_Data Column Error")
+
+        if session.expected:
+            st.info(f"📋 รายการสินค้าที่ต้องแพ็ค ({len(session.expected)} รายการ):")
+            st.dataframe(session.expected_frame(['Barcode', 'Product Name']), use_container_width=True)
+
+            st.markdown("---")
+            st.markdown("#### 2. ตรวจสอบสินค้า (Scan & Verify)")
+
+            if not st.session_state.prod_val and st.session_state.wedge_mode:
+                # ตรวจทุกรหัสใน buffer แล้วแสดงผลรวมในรอบนี้เลย (รายการด้านล่าง render หลังจากนี้ ไม่ต้อง rerun)
+                wedge_input("สแกน Barcode", "pack_prod_wedge"); pending = st.session_state.wedge_buffer.drain()
+                if pending: wedge_pack_scans(session, pending)
+            elif not st.session_state.prod_val:
+                col1, col2 = st.columns([3, 1])
+                manual_prod = col1.text_input("พิมพ์ Barcode", key="pack_prod_man").strip()
+                if manual_prod: st.session_state.prod_val = manual_prod; scan_started(st.session_state, 'manual'); rerun_scan()
+                scan_prod = back_camera_input("แตะเพื่อสแกนสินค้า", key=f"prod_cam_{st.session_state.cam_counter}")
+                if scan_prod:
+                    scan_started(st.session_state, 'camera'); res_p = decode_image(scan_prod)
+                    if res_p: st.session_state.prod_val = res_p[0].data.decode("utf-8"); rerun_scan()
+                    else: scan_finished(st.session_state, 'pack_product', "", 'decode_miss')
+            else:
+                scanned_barcode = st.session_state.prod_val
+                outcome, found_item = verify_scan(session, scanned_barcode); scan_finished(st.session_state, 'pack_product', scanned_barcode, outcome)
+                if outcome != SCAN_WRONG:
+                    if outcome == SCAN_ADDED: play_sound('success'); st.toast(f"✅ ถูกต้อง! เพิ่ม {found_item.name}", icon="🛒")
+                    else: st.toast(f"⚠️ สินค้านี้สแกนไปแล้ว", icon="ℹ️")
+                    st.session_state.prod_val = ""; st.session_state.cam_counter += 1; rerun_scan()
+                else:
+                    play_sound('error'); st.error(f"⛔ สินค้าผิด! Barcode {scanned_barcode} ไม่อยู่ใน Order นี้")
+                    if st.button("❌ สแกนใหม่"): st.session_state.prod_val = ""; st.session_state.cam_counter += 1; rerun_scan()
+
+        if session:
+            st.markdown("---")
+            st.markdown(f"### 🛒 สินค้าที่แพ็คแล้ว ({len(session)} ชิ้น)")
+            st.dataframe(session.frame(['Barcode', 'Product Name']), use_container_width=True)
+            if st.button("✅ ยืนยันรายการครบแล้ว (ไปถ่ายวีดีโอ)", type="primary", use_container_width=True): go_to_pack_phase(); st.rerun()
+
+@st.fragment
+@timed("rider_scan")
+def rider_scan_fragment():
+    set_user(st.session_state.current_user_id)
+    df_order_data_rider = load_sheet_data(ORDER_DATA_SHEET_NAME, ORDER_CHECK_SHEET_ID, index=ORDER_DATA_INDEX, schema=ORDER_DATA_SCHEMA)
+    if st.session_state.scan_status_msg:
+        if st.session_state.scan_status_msg['type'] == 'error': st.error(st.session_state.scan_status_msg['msg']); play_sound('error')
+        else: st.success(st.session_state.scan_status_msg['msg']); play_sound('success' if not st.session_state.scan_status_msg['msg'].startswith("✅ เพิ่ม") else 'scan')
+        st.session_state.scan_status_msg = None
+
+    st.markdown("#### 1. Scan Tracking")
+    if st.session_state.wedge_mode:
+        wedge_input("สแกน Tracking", "rider_ord_wedge"); pending = st.session_state.wedge_buffer.drain()
+        if pending:
+            was_empty = not st.session_state.rider_batch; order_data_ready = not df_order_data_rider.empty and 'Tracking' in df_order_data_rider.columns
+            st.session_state.scan_status_msg = wedge_rider_scans(pending, lambda order_id: df_order_data_rider.contains('Tracking', order_id), order_data_ready)
+            rerun_scan(full=was_empty and bool(st.session_state.rider_batch))
+        man_rider_ord = ""; manual_submit = False; scan_rider_ord = None
+    else:
+        col_r1, col_r2 = st.columns([3, 1])
+        dynamic_key = f"rider_ord_man_{st.session_state.rider_input_reset_key}"
+        man_rider_ord = col_r1.text_input("พิมพ์ Tracking ID", key=dynamic_key).strip().upper()
+        with col_r2: st.write(""); st.write(""); manual_submit = st.button("ตกลง", use_container_width=True)
+        scan_rider_ord = back_camera_input("แตะเพื่อสแกน Tracking", key=f"rider_cam_ord_{st.session_state.cam_counter}")
+    current_rider_order = ""
+    if manual_submit and man_rider_ord: current_rider_order = man_rider_ord; scan_started(st.session_state, 'manual')
+    elif scan_rider_ord:
+        scan_started(st.session_state, 'camera'); res = decode_image(scan_rider_ord)
+        if res: current_rider_order = res[0].data.decode("utf-8").upper()
+        else: scan_finished(st.session_state, 'rider', "", 'decode_miss')
+
+    if current_rider_order:
+        order_data_ready = not df_order_data_rider.empty and 'Tracking' in df_order_data_rider.columns
+        if not order_data_ready: scan_finished(st.session_state, 'rider', current_rider_order, 'load_error'); st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⚠️ โหลดข้อมูล Error"}; st.session_state.rider_input_reset_key += 1; rerun_scan()
+        outcome = verify_rider_scan(st.session_state.rider_batch, current_rider_order, workspace.load_rider_history, known=lambda order_id: df_order_data_rider.contains('Tracking', order_id))
+        scan_finished(st.session_state, 'rider', current_rider_order, outcome); st.session_state.rider_input_reset_key += 1; st.session_state.cam_counter += 1
+        if outcome != RIDER_ADDED: st.session_state.scan_status_msg = {'type': 'error', 'msg': RIDER_SCAN_MESSAGES[outcome]}; rerun_scan()
+        else: st.session_state.scan_status_msg = {'type': 'success', 'msg': f"✅ เพิ่ม: {current_rider_order}"}; rerun_scan(full=len(st.session_state.rider_batch) == 1)
+
+    # เพิ่ม Order แรก / ลบจนหมด ต้อง rerun ทั้งหน้าเพื่อแสดง/ซ่อนส่วนถ่ายรูปด้านล่าง
+    if st.session_state.rider_batch:
+        st.markdown(f"##### 📋 รายการที่สแกนแล้ว ({len(st.session_state.rider_batch)})")
+        for idx, order_id in enumerate(st.session_state.rider_batch):
+            c1, c2, c3 = st.columns([1, 4, 1])
+            c1.write(f"{idx+1}."); c2.write(f"**{order_id}**")
+            if c3.button("ลบ", key=f"del_r_{idx}"): st.session_state.rider_batch.remove_at(idx); rerun_scan(full=not st.session_state.rider_batch)
+        if st.button("🗑️ ล้างทั้งหมด", type="secondary"): st.session_state.rider_batch = RiderBatch(); st.rerun()
+
+# --- PERFORMANCE DASHBOARD (admin: อัปเดตเองทุก PERF_REFRESH_SECONDS วินาที ไม่ต้องรันทั้งหน้า) ---
+@st.fragment(run_every=PERF_REFRESH_SECONDS)
+def performance_dashboard():
+    snap = ops_snapshot((ORDER_DATA_SHEET_NAME, RIDER_SHEET_NAME, USER_SHEET_NAME))
+    for w in snap['warnings']: st.warning(f"⚠️ {w}")
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Session ที่ใช้งาน", len(snap['sessions'])); c2.metric("หน่วยความจำ Process", f"{snap['process_mb']} MB")
+    c3.metric("ข้อมูลใน Session", f"{snap['session_mb']} MB"); c4.metric("งานอัปโหลดค้าง", snap['queues']['upload_jobs'])
+    st.markdown("##### ☁️ Google API (p50 / p95)")
+    if snap['google']: st.dataframe(pd.DataFrame(snap['google']), use_container_width=True, hide_index=True)
+    else: st.info("ยังไม่มีการเรียก Google API")
+    st.markdown("##### 📦 Cache ข้อมูล Sheet")
+    if snap['cache']: st.dataframe(pd.DataFrame(snap['cache']), use_container_width=True, hide_index=True)
+    else: st.info("ยังไม่มีข้อมูลใน Cache")
+    st.markdown("##### 📮 คิวงาน / สถานะการเชื่อมต่อ")
+    q1, q2, q3 = st.columns(3)
+    q1.metric("งานอัปโหลด (Drive)", snap['queues']['upload_jobs']); q2.metric("แถว Log รอส่งใหม่", snap['queues']['outbox_rows']); q3.metric("แถว Log รอเขียน", snap['queues']['log_writer_pending'])
+    st.dataframe(pd.DataFrame(snap['breakers']), use_container_width=True, hide_index=True)
+    st.markdown("##### 🚦 Quota / Retry (Sheets)")
+    st.dataframe(pd.DataFrame([{**snap['governor'], **{f"log_{k}": v for k, v in snap['log_writer'].items()}}]), use_container_width=True, hide_index=True)
+    st.markdown("##### ⏱️ เวลาประมวลผลแต่ละขั้นตอน")
+    if snap['stages']: st.dataframe(pd.DataFrame(snap['stages']), use_container_width=True, hide_index=True)
+    else: st.info("ยังไม่มีข้อมูล")
+    with st.expander(f"👥 Session ที่ใช้งาน ({len(snap['sessions'])})"):
+        if snap['sessions']: st.dataframe(pd.DataFrame(snap['sessions']), use_container_width=True, hide_index=True)
+        else: st.info("ไม่มี Session")
 
 # --- LOGIN ---
 if not st.session_state.current_user_name:
@@ -400,16 +611,14 @@ if not st.session_state.current_user_name:
         user_input_val = None
         if manual_user: user_input_val = manual_user
         elif scan_user:
-            res_u = decode(Image.open(scan_user)); 
+            res_u = decode_image(scan_user); 
             if res_u: user_input_val = res_u[0].data.decode("utf-8")
         if user_input_val:
-            if not df_users.empty and len(df_users.columns) >= 3:
-                clean_input_id = str(user_input_val).strip().lower()
-                match = df_users[df_users.iloc[:, 0].astype(str).str.strip().str.lower() == clean_input_id]
-                if not match.empty:
-                    user_role = 'staff'; 
-                    if len(match.columns) >= 4 and str(match.iloc[0, 3]).strip().lower() == 'admin': user_role = 'admin'
-                    st.session_state.temp_login_user = {'id': str(match.iloc[0, 0]), 'pass': str(match.iloc[0, 1]).strip(), 'name': match.iloc[0, 2], 'role': user_role}
+            users = get_user_index(df_users)
+            if len(users):
+                user = users.get(user_input_val)
+                if user is not None:
+                    st.session_state.temp_login_user = {'id': user.id, 'verifier': user.verifier, 'name': user.name, 'role': user.role}
                     st.rerun()
                 else: st.error(f"❌ ไม่พบรหัสพนักงาน: {user_input_val}")
             else: st.warning("⚠️ โหลดข้อมูลพนักงานไม่ได้")
@@ -420,9 +629,9 @@ if not st.session_state.current_user_name:
         c1, c2 = st.columns([1, 1])
         with c1:
             if st.button("✅ ยืนยัน Login", type="primary", use_container_width=True):
-                if password_input == user_info['pass']:
+                if check_password(user_info['verifier'], password_input):
                     st.session_state.current_user_id = user_info['id']; st.session_state.current_user_name = user_info['name']; st.session_state.current_user_role = user_info['role'] 
-                    st.session_state.temp_login_user = None; st.toast(f"ยินดีต้อนรับคุณ {user_info['name']} 👋", icon="✅"); time.sleep(1); st.rerun()
+                    st.session_state.temp_login_user = None; flash(f"ยินดีต้อนรับคุณ {user_info['name']} 👋"); st.rerun()
                 else: st.error("❌ รหัสผ่านไม่ถูกต้อง")
         with c2:
             if st.button("⬅️ เปลี่ยน User", use_container_width=True): st.session_state.temp_login_user = None; st.rerun()
@@ -431,92 +640,24 @@ else:
     with st.sidebar:
         st.write(f"👤 **{st.session_state.current_user_name}**"); st.caption(f"Role: {st.session_state.current_user_role}")
         menu_options = ["📦 แผนกแพ็คสินค้า", "🚚 Scan ปิดตู้"]
-        if st.session_state.current_user_role == 'admin': menu_options.append("👥 จัดการพนักงาน")
-        mode = st.radio("เลือกโหมดทำงาน:", menu_options)
+        if st.session_state.current_user_role == 'admin': menu_options += ["👥 จัดการพนักงาน", "📈 Performance ระบบ"]
+        mode = st.radio("เลือกโหมดทำงาน:", menu_options, key="work_mode")
+        st.toggle("⌨️ ใช้เครื่องสแกน (USB/Bluetooth)", key="wedge_mode", help="สแกนเข้าช่องสแกนโดยตรง ไม่ใช้กล้อง")
         st.divider()
         if st.button("Logout", type="secondary"): logout_user()
 
     # ================= MODE 1: PACKING =================
     if mode == "📦 แผนกแพ็คสินค้า":
         st.title("📦 ระบบแพ็คสินค้า")
-        df_order_data = load_sheet_data(ORDER_DATA_SHEET_NAME, ORDER_CHECK_SHEET_ID)
-
-        if st.session_state.picking_phase == 'scan':
-            st.markdown("#### 1. Scan Tracking (ตรวจสอบ Order Data)")
-            if not st.session_state.order_val:
-                col1, col2 = st.columns([3, 1])
-                manual_order = col1.text_input("พิมพ์ Tracking ID", key="pack_order_man").strip().upper()
-                if manual_order: st.session_state.order_val = manual_order; st.rerun()
-                scan_order = back_camera_input("แตะเพื่อสแกน Tracking", key=f"pack_cam_{st.session_state.cam_counter}")
-                if scan_order:
-                    res = decode(Image.open(scan_order))
-                    if res: st.session_state.order_val = res[0].data.decode("utf-8").upper(); st.rerun()
-            else:
-                c1, c2 = st.columns([3, 1])
-                with c1: st.success(f"📦 Tracking: **{st.session_state.order_val}**")
-                with c2: 
-                    if st.button("เปลี่ยน Tracking"): trigger_reset(); st.rerun()
-
-            if st.session_state.order_val:
-                if df_order_data.empty: st.error(f"❌ ไม่พบข้อมูลใน Sheet {ORDER_DATA_SHEET_NAME}")
-                else:
-                    if not st.session_state.expected_items:
-                        try:
-                            matches = df_order_data[df_order_data['Tracking'] == st.session_state.order_val]
-                            matches = matches.drop_duplicates(subset=['Barcode'], keep='first')
-                            if matches.empty: play_sound('error'); st.error(f"⛔ ไม่พบ Tracking ในระบบ!"); time.sleep(2); st.session_state.order_val = ""; st.rerun()
-                            else: st.session_state.expected_items = matches.to_dict('records')
-                        except KeyError: st.error("❌ Sheet Order_Data Column Error")
-
-                if st.session_state.expected_items:
-                    st.info(f"📋 รายการสินค้าที่ต้องแพ็ค ({len(st.session_state.expected_items)} รายการ):")
-                    exp_df = pd.DataFrame(st.session_state.expected_items)
-                    display_cols = ['Barcode', 'Product Name']
-                    valid_display_cols = [c for c in display_cols if c in exp_df.columns]
-                    st.dataframe(exp_df[valid_display_cols], use_container_width=True)
-
-                    st.markdown("---")
-                    st.markdown("#### 2. ตรวจสอบสินค้า (Scan & Verify)")
-                    
-                    if not st.session_state.prod_val:
-                        col1, col2 = st.columns([3, 1])
-                        manual_prod = col1.text_input("พิมพ์ Barcode", key="pack_prod_man").strip()
-                        if manual_prod: st.session_state.prod_val = manual_prod; st.rerun()
-                        scan_prod = back_camera_input("แตะเพื่อสแกนสินค้า", key=f"prod_cam_{st.session_state.cam_counter}")
-                        if scan_prod:
-                            res_p = decode(Image.open(scan_prod)); 
-                            if res_p: st.session_state.prod_val = res_p[0].data.decode("utf-8"); st.rerun()
-                    else:
-                        scanned_barcode = st.session_state.prod_val; found_item = None
-                        for item in st.session_state.expected_items:
-                            if str(item.get('Barcode', '')).strip() == scanned_barcode: found_item = item; break
-                        if found_item:
-                            already_scanned = any(x['Barcode'] == scanned_barcode for x in st.session_state.current_order_items)
-                            if not already_scanned:
-                                new_item = {"Barcode": scanned_barcode, "Product Name": found_item.get('Product Name', 'Unknown'), "Location": found_item.get('Location', '-')}
-                                st.session_state.current_order_items.append(new_item)
-                                play_sound('success'); st.toast(f"✅ ถูกต้อง! เพิ่ม {found_item.get('Product Name', '')}", icon="🛒")
-                            else: st.toast(f"⚠️ สินค้านี้สแกนไปแล้ว", icon="ℹ️")
-                            st.session_state.prod_val = ""; st.session_state.cam_counter += 1; st.rerun()
-                        else:
-                            play_sound('error'); st.error(f"⛔ สินค้าผิด! Barcode {scanned_barcode} ไม่อยู่ใน Order นี้")
-                            time.sleep(1); 
-                            if st.button("❌ สแกนใหม่"): st.session_state.prod_val = ""; st.session_state.cam_counter += 1; st.rerun()
-
-                if st.session_state.current_order_items:
-                    st.markdown("---")
-                    st.markdown(f"### 🛒 สินค้าที่แพ็คแล้ว ({len(st.session_state.current_order_items)} ชิ้น)")
-                    st.dataframe(pd.DataFrame(st.session_state.current_order_items)[['Barcode', 'Product Name']], use_container_width=True)
-                    st.button("✅ ยืนยันรายการครบแล้ว (ไปถ่ายวีดีโอ)", type="primary", use_container_width=True, on_click=go_to_pack_phase)
-
+        if st.session_state.picking_phase == 'scan': pack_scan_fragment()
         elif st.session_state.picking_phase == 'pack':
             st.success(f"📦 Tracking: **{st.session_state.order_val}** (ยืนยันรายการครบถ้วน)")
             st.info("📋 รายการสินค้าที่แพ็ค:")
             
             # โชว์ตารางสรุป
-            display_df = pd.DataFrame(st.session_state.current_order_items)
+            display_df = st.session_state.pack_session.frame(['Barcode', 'Product Name'])
             if not display_df.empty:
-                st.dataframe(display_df[['Barcode', 'Product Name']], use_container_width=True)
+                st.dataframe(display_df, use_container_width=True)
             
             st.markdown("---")
             st.markdown("#### 3. 📸 ถ่ายรูปหลักฐาน (ถ่ายได้หลายรูป)")
@@ -542,13 +683,11 @@ else:
                     pack_img = back_camera_input("ถ่ายรูปเพิ่ม (กล้องหลัง)", key=f"pack_cam_fin_{st.session_state.cam_counter}")
                 
                 if pack_img:
-                    # แปลงไฟล์ภาพและบันทึกลง Session
-                    img_pil = Image.open(pack_img)
-                    if img_pil.mode in ("RGBA", "P"): img_pil = img_pil.convert("RGB")
-                    buf = io.BytesIO(); img_pil.save(buf, format='JPEG', quality=90, optimize=True) # quality 90 ชัดและไฟล์ไม่ใหญ่
-                    st.session_state.photo_gallery.append(buf.getvalue())
+                    # แปลงไฟล์ภาพและบันทึกลง Session (ตัดรูปที่ถ่ายซ้ำออก)
+                    added, msg = add_photo_to_gallery('photo_gallery', pack_img, 90) # quality 90 ชัดและไฟล์ไม่ใหญ่
+                    if added: play_sound('scan') # เสียงชัตเตอร์ (ใช้เสียง scan แทน)
+                    if msg: st.toast(msg, icon="⚠️")
                     st.session_state.cam_counter += 1
-                    play_sound('scan') # เสียงชัตเตอร์ (ใช้เสียง scan แทน)
                     st.rerun()
             else:
                 st.info("✅ ถ่ายครบ 5 รูปแล้ว (ถ้าต้องการถ่ายใหม่ ให้ลบรูปเก่าออกก่อน)")
@@ -573,45 +712,23 @@ else:
                     
                     if st.session_state.processing_pack:
                         with st.spinner("🚀 กำลังอัปโหลดรูปภาพ..."):
-                            srv = authenticate_drive()
-                            if srv:
-                                fid = get_target_folder_structure(srv, st.session_state.order_val, MAIN_FOLDER_ID)
-                                ts = get_thai_ts_filename()
-                                uploaded_ids = []
-                                
-                                # Loop Upload ทุกรูปใน Gallery
-                                for i, img_bytes in enumerate(st.session_state.photo_gallery):
-                                    seq = i + 1
-                                    fn = f"{st.session_state.order_val}_PACKED_{ts}_{seq}.jpg"
-                                    uid = upload_photo(srv, img_bytes, fn, fid)
-                                    uploaded_ids.append(uid)
+                            # Upload ทุกรูปใน Gallery + บันทึก Log (Drive ล่มจะเก็บเข้าคิว offline)
+                            job = {
+                                'kind': 'pack',
+                                'order_val': st.session_state.order_val,
+                                'ts': get_thai_ts_filename(),
+                                'timestamp': get_thai_time(),
+                                'user_name': st.session_state.current_user_name,
+                                'user_id': st.session_state.current_user_id,
+                                'items': st.session_state.pack_session.records()
+                            }
+                            confirm_started = time.time(); uploaded = submit_upload_job(job, st.session_state.photo_gallery)
+                            record_scan(st.session_state, 'pack_confirm', job['order_val'], 'uploaded' if uploaded else 'queued', duration=time.time() - confirm_started, items=len(job['items']), photos=len(st.session_state.photo_gallery))
+                            offline_note = '' if uploaded else '<p>📴 Offline: รูปจะอัปโหลดอัตโนมัติเมื่อระบบกลับมา</p>'
                                 
-                                # บันทึก Log ลง Sheet (ส่ง List ของ ID ไป)
-                                for item in st.session_state.current_order_items:
-                                    save_log_to_sheet(
-                                        st.session_state.current_user_name, 
-                                        st.session_state.order_val, 
-                                        item['Barcode'], 
-                                        item['Product Name'], 
-                                        item['Location'], 
-                                        item.get('Qty', '1'), 
-                                        st.session_state.current_user_id, 
-                                        uploaded_ids # [UPDATED] ส่งเป็น List
-                                    )
-                                    
-                                play_sound('success')
-                                st.markdown(
-                                    """
-                                    <div style="text-align: center;">
-                                        <div style="font-size: 80px;">✅</div>
-                                        <h3 style="color: #28a745; margin-top: -10px;">บันทึกสำเร็จ!</h3>
-                                    </div>
-                                    """, 
-                                    unsafe_allow_html=True
-                                )
-                                time.sleep(1.5)
-                                trigger_reset()
-                                st.rerun()
+                            flash("บันทึกสำเร็จ!", sound='success', big=True, note=offline_note)
+                            trigger_reset()
+                            st.rerun()
                 else:
                     st.warning("⚠️ กรุณาถ่ายรูปอย่างน้อย 1 รูป")
 
@@ -620,47 +737,12 @@ else:
         st.title("🚚 Scan ปิดตู้")
         st.info("1. สแกน Tracking\n2. ถ่ายรูปปิดตู้ \n*รูปจะถูกบันทึกใน Folder วันที่ และ Link จะถูกบันทึกให้ทุก Tracking*")
         
-        df_order_data_rider = load_sheet_data(ORDER_DATA_SHEET_NAME, ORDER_CHECK_SHEET_ID)
         st.markdown("#### 0. ระบุทะเบียนรถ (Optional)")
         rider_lp = st.text_input("🚛 ทะเบียนรถ", key="rider_lp_input", placeholder="กรอกทะเบียนรถที่มารับสินค้า...").strip()
 
-        if st.session_state.scan_status_msg:
-            if st.session_state.scan_status_msg['type'] == 'error': st.error(st.session_state.scan_status_msg['msg']); play_sound('error')
-            else: st.success(st.session_state.scan_status_msg['msg']); play_sound('success' if not st.session_state.scan_status_msg['msg'].startswith("✅ เพิ่ม") else 'scan')
-            st.session_state.scan_status_msg = None
-
-        st.markdown("#### 1. Scan Tracking")
-        col_r1, col_r2 = st.columns([3, 1])
-        dynamic_key = f"rider_ord_man_{st.session_state.rider_input_reset_key}"
-        man_rider_ord = col_r1.text_input("พิมพ์ Tracking ID", key=dynamic_key).strip().upper()
-        with col_r2: st.write(""); st.write(""); manual_submit = st.button("ตกลง", use_container_width=True)
+        rider_scan_fragment()
 
-        scan_rider_ord = back_camera_input("แตะเพื่อสแกน Tracking", key=f"rider_cam_ord_{st.session_state.cam_counter}")
-        current_rider_order = ""
-        if manual_submit and man_rider_ord: current_rider_order = man_rider_ord
-        elif scan_rider_ord:
-            res = decode(Image.open(scan_rider_ord)); 
-            if res: current_rider_order = res[0].data.decode("utf-8").upper()
-
-        if current_rider_order:
-            existing_ids = [o['id'] for o in st.session_state.rider_scanned_orders]
-            valid_trackings = []
-            if not df_order_data_rider.empty and 'Tracking' in df_order_data_rider.columns: valid_trackings = df_order_data_rider['Tracking'].astype(str).str.strip().str.upper().tolist()
-            if not valid_trackings: st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⚠️ โหลดข้อมูล Error"}; st.session_state.rider_input_reset_key += 1; st.rerun()
-            elif current_rider_order not in valid_trackings: st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⛔ ไม่พบ Tracking"}; st.session_state.rider_input_reset_key += 1; st.session_state.cam_counter += 1; st.rerun()
-            elif current_rider_order in existing_ids: st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⚠️ ซ้ำ"}; st.session_state.rider_input_reset_key += 1; st.session_state.cam_counter += 1; st.rerun()
-            else:
-                history_list = load_rider_history()
-                if current_rider_order in history_list: st.session_state.scan_status_msg = {'type': 'error', 'msg': f"⛔ เคยบันทึกแล้ว"}; st.session_state.rider_input_reset_key += 1; st.session_state.cam_counter += 1; st.rerun()
-                else: st.session_state.rider_scanned_orders.append({'id': current_rider_order}); st.session_state.scan_status_msg = {'type': 'success', 'msg': f"✅ เพิ่ม: {current_rider_order}"}; st.session_state.rider_input_reset_key += 1; st.session_state.cam_counter += 1; st.rerun()
-
-        if st.session_state.rider_scanned_orders:
-            st.markdown(f"##### 📋 รายการที่สแกนแล้ว ({len(st.session_state.rider_scanned_orders)})")
-            for idx, order in enumerate(st.session_state.rider_scanned_orders):
-                c1, c2, c3 = st.columns([1, 4, 1])
-                c1.write(f"{idx+1}."); c2.write(f"**{order['id']}**")
-                if c3.button("ลบ", key=f"del_r_{idx}"): st.session_state.rider_scanned_orders.pop(idx); st.rerun()
-            if st.button("🗑️ ล้างทั้งหมด", type="secondary"): st.session_state.rider_scanned_orders = []; st.rerun()
+        if st.session_state.rider_batch:
             st.markdown("---")
             st.markdown("#### 2. ถ่ายรูปปิดตู้ (สูงสุด 3 รูป)")
             if st.session_state.rider_photo_gallery:
@@ -671,22 +753,21 @@ else:
             if len(st.session_state.rider_photo_gallery) < 3:
                 rider_img_input = back_camera_input("ถ่ายรูปเพิ่ม (กล้องหลัง)", key=f"rider_cam_act_{st.session_state.cam_counter}")
                 if rider_img_input:
-                    img_pil = Image.open(rider_img_input); 
-                    if img_pil.mode in ("RGBA", "P"): img_pil = img_pil.convert("RGB")
-                    buf = io.BytesIO(); img_pil.save(buf, format='JPEG', quality=120, optimize=True)
-                    st.session_state.rider_photo_gallery.append(buf.getvalue()); st.session_state.cam_counter += 1; st.rerun()
+                    added, msg = add_photo_to_gallery('rider_photo_gallery', rider_img_input, 120)
+                    if msg: st.toast(msg, icon="⚠️")
+                    st.session_state.cam_counter += 1; st.rerun()
             if len(st.session_state.rider_photo_gallery) > 0:
                 st.write("")
                 if not st.session_state.processing_rider: st.button(f"🚀 ยืนยันบันทึก", type="primary", use_container_width=True, on_click=click_confirm_rider)
                 else: st.info("⏳ กำลังบันทึกข้อมูล...")
                 if st.session_state.processing_rider:
                     with st.spinner("🚀 กำลังอัปโหลด..."):
-                        srv = authenticate_drive(); ts = get_thai_ts_filename(); rider_lp_val = rider_lp if rider_lp else "NoPlate"; lp_clean = rider_lp_val.replace(" ", "_")
-                        daily_fid, daily_fname = get_rider_daily_folder(srv, MAIN_FOLDER_ID); uploaded_ids = []
-                        for i, img_bytes in enumerate(st.session_state.rider_photo_gallery):
-                            fn = f"{lp_clean}_{ts}_{i+1}.jpg"; uid = upload_photo(srv, img_bytes, fn, daily_fid); uploaded_ids.append(uid)
-                        for order in st.session_state.rider_scanned_orders: save_rider_log(st.session_state.current_user_name, order['id'], uploaded_ids, daily_fname, rider_lp_val)
-                        play_sound('success'); st.markdown("""<div style="text-align: center;"><div style="font-size: 100px;">✅</div><h2 style="color: #28a745;">บันทึกครบถ้วน!</h2></div>""", unsafe_allow_html=True); time.sleep(2); trigger_reset(); st.rerun()
+                        rider_lp_val = rider_lp if rider_lp else "NoPlate"
+                        job = {'kind': 'rider', 'ts': get_thai_ts_filename(), 'timestamp': get_thai_time(), 'user_name': st.session_state.current_user_name,
+                               'license_plate': rider_lp_val, 'lp_clean': rider_lp_val.replace(" ", "_"), 'orders': st.session_state.rider_batch.ids()}
+                        confirm_started = time.time(); uploaded = submit_upload_job(job, st.session_state.rider_photo_gallery)
+                        record_scan(st.session_state, 'rider_confirm', job['license_plate'], 'uploaded' if uploaded else 'queued', duration=time.time() - confirm_started, orders=job['orders'], photos=len(st.session_state.rider_photo_gallery))
+                        flash("บันทึกครบถ้วน!", sound='success', big=True, note='' if uploaded else '<p>📴 Offline: รูปจะอัปโหลดอัตโนมัติเมื่อระบบกลับมา</p>'); trigger_reset(); st.rerun()
         else: st.info("👈 Scan Tracking อย่างน้อย 1 รายการ")
             
     # ================= MODE 3: MANAGE USERS (SAME) =================
@@ -716,3 +797,10 @@ else:
                  except: st.error("Error displaying users")
             else: st.info("ไม่มีข้อมูล")
         st.divider(); st.subheader("📋 รายชื่อ"); st.dataframe(df_users_manage, use_container_width=True) if not df_users_manage.empty else st.warning("No Data")
+
+    # ================= MODE 4: PERFORMANCE (ADMIN) =================
+    elif mode == "📈 Performance ระบบ":
+        st.title("📈 Performance ระบบ"); st.caption(f"อัปเดตอัตโนมัติทุก {PERF_REFRESH_SECONDS} วินาที (ข้อมูลของ server นี้ตั้งแต่ process เริ่ม)")
+        performance_dashboard()
+
+record("script_run", time.perf_counter() - run_started)
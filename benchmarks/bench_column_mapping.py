@@ -0,0 +1,89 @@
+"""Header normalization / column mapping บน Sheet จำลอง 100k แถว
+
+    python benchmarks/bench_column_mapping.py [--rows 100000] [--repeat 5]
+
+เทียบวิธีเดิม (loop rename ทีละคอลัมน์ + regex) กับ ColumnMap ทั้งแบบอ่านทั้ง Tab และแบบเลือกคอลัมน์
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mkp_columns import ColumnMap, ColumnRule, strip_float_suffix  # noqa: E402
+
+HEADER = ["Order ID", "Tracking", "Barcode", "Name", "Location", "Qty", "Zone", "Customer", "Address", "Phone", "Note", "Created"]
+COLUMNS = ['Tracking', 'Barcode', 'Product Name', 'Location', 'Qty', 'Zone']
+
+SHEET_COLUMNS = ColumnMap([
+    ColumnRule('Tracking', contains=('tracking', ('order', 'id'))),
+    ColumnRule('Barcode', contains=('barcode',), normalize=strip_float_suffix),
+    ColumnRule('Product Name', contains=('product name',), equals=('Name',)),
+    ColumnRule('Qty', contains=('qty', 'quantity')),
+])
+
+def make_rows(n, seed=0):
+    rnd = random.Random(seed)
+    rows = [HEADER]
+    for i in range(n):
+        rows.append([f"ORD{i:08d}", f"TH{rnd.randrange(10**11):011d}", f"885{rnd.randrange(10**9):09d}.0", f"Product {rnd.randrange(2000)}",
+                     f"A-{rnd.randrange(50):02d}", str(rnd.randrange(1, 5)), rnd.choice("ABCD"), f"Customer {i}", f"{i} Road", f"08{rnd.randrange(10**8):08d}", "", "2024-01-01"])
+    return rows
+
+def legacy_frame(rows):
+    # โค้ดเดิมใน fetch_sheet_data (ก่อนใช้ ColumnMap)
+    headers = rows[0]; data = rows[1:]
+    seen = {}; unique_headers = []
+    for col in headers:
+        clean_col = col.strip()
+        if not clean_col: clean_col = "Untitled"
+        if clean_col in seen: seen[clean_col] += 1; unique_headers.append(f"{clean_col}_{seen[clean_col]}")
+        else: seen[clean_col] = 0; unique_headers.append(clean_col)
+    df = pd.DataFrame(data, columns=unique_headers)
+    for col in df.columns:
+        col_lower = col.lower()
+        if 'tracking' in col_lower or ('order' in col_lower and 'id' in col_lower): df.rename(columns={col: 'Tracking'}, inplace=True)
+        elif 'barcode' in col_lower: df.rename(columns={col: 'Barcode'}, inplace=True); df['Barcode'] = df['Barcode'].astype(str).str.replace(r'\.0$', '', regex=True)
+        elif col == 'Name' or 'product name' in col_lower: df.rename(columns={col: 'Product Name'}, inplace=True)
+        elif 'qty' in col_lower or 'quantity' in col_lower: df.rename(columns={col: 'Qty'}, inplace=True)
+    return df
+
+def mapped_frame(rows):
+    return SHEET_COLUMNS.frame(SHEET_COLUMNS.plan(rows[0]), rows[1:])
+
+def projected_frame(rows, projected):
+    plan = SHEET_COLUMNS.plan(rows[0])
+    return SHEET_COLUMNS.frame(plan, projected, SHEET_COLUMNS.pick(plan, COLUMNS))
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter(); fn()
+        elapsed = time.perf_counter() - started; best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    plan = SHEET_COLUMNS.plan(rows[0]); picked = SHEET_COLUMNS.pick(plan, COLUMNS)
+    projected = [[row[pos] for _, pos in picked] for row in rows[1:]]   # สิ่งที่ batch_get ส่งกลับมา
+
+    df = mapped_frame(rows)
+    assert list(df.columns[:3]) == ['Tracking', 'Tracking_1', 'Barcode'] and not df['Barcode'].str.endswith('.0').any()
+    assert projected_frame(rows, projected)['Tracking'].equals(df['Tracking'])
+
+    print(f"rows={args.rows} columns={len(HEADER)} repeat={args.repeat} (best of)")
+    results = [("legacy loop + rename", legacy_frame, (rows,)), ("ColumnMap full tab", mapped_frame, (rows,)), ("ColumnMap projected", projected_frame, (rows, projected))]
+    for label, fn, fn_args in results:
+        print(f"  {label:<22} {timed(lambda: fn(*fn_args), args.repeat) * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Benchmark จุดที่ทำงานบ่อยของแอป แล้วเขียนผลเป็น JSON ไว้เทียบก่อน deploy
+
+    python benchmarks/bench_hot_paths.py [--rows 10000,100000,1000000] [--repeat 3] [--json bench.json] [--compare baseline.json]
+
+- normalize: Order_Data ที่ได้จาก batch_get -> ColumnMap.frame -> compact_frame -> SharedTable (สิ่งที่ load_sheet_data ทำ)
+- lookup: ค้น Tracking แบบโหมดแพ็ค (lookup) / โหมด Rider (contains) + verify_scan Barcode ใน Order
+- decode: pyzbar อ่าน EAN-13 บนรูปขนาดกล้องมือถือ (ข้ามถ้าไม่ได้ติดตั้ง pyzbar)
+- jpeg: re-encode รูปเข้า gallery (quality 90 โหมดแพ็ค / 120 โหมด Rider เหมือนในแอป)
+- rider_history: เช็ค Order ซ้ำกับประวัติ Rider ที่ยาวขึ้นเรื่อยๆ
+--compare: ช้ากว่า baseline เกิน --tolerance ให้ exit code 1
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mkp_catalog import SharedTable, compact_frame  # noqa: E402
+from mkp_jobs import ORDER_DATA_SCHEMA, ORDER_DATA_INDEX, SHEET_COLUMNS  # noqa: E402
+from mkp_models import PackSession, SavedOrders, verify_scan  # noqa: E402
+
+HEADER = ["Tracking", "Barcode", "Name", "Location", "Qty", "Zone", "Customer", "Address", "Phone", "Note", "Created"]
+PHOTO_SIZES = ((1280, 720), (1920, 1080), (4032, 3024))
+HISTORY_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+LOOKUPS = 200
+
+# --- SYNTHETIC DATA ---
+def make_rows(n, seed=0):
+    # สร้างแบบ vectorized (1M แถวใช้เวลาไม่กี่วินาที) Order ละ 1-4 แถว
+    rng = np.random.default_rng(seed)
+    orders = rng.integers(10**10, 10**11, max(1, n // 2)); trackings = np.char.add("TH", orders.astype(str))[rng.integers(0, max(1, n // 2), n)]
+    barcodes = np.char.add(np.char.add("885", rng.integers(10**8, 10**9, n).astype(str)), ".0")
+    names = np.char.add("Product ", rng.integers(0, 2000, n).astype(str)); locations = np.char.add("A-", rng.integers(0, 50, n).astype(str))
+    qty = rng.integers(1, 5, n).astype(str); zones = np.array(list("ABCD"))[rng.integers(0, 4, n)]
+    columns = [trackings, barcodes, names, locations, qty, zones]
+    return [HEADER] + [list(row) + ["Customer", "Road", "0800000000", "", "2024-01-01"] for row in zip(*(c.tolist() for c in columns))]
+
+def project(rows):
+    # สิ่งที่ read_projected ส่งกลับ: เฉพาะคอลัมน์ใน schema
+    plan = SHEET_COLUMNS.plan(rows[0]); picked = SHEET_COLUMNS.pick(plan, list(ORDER_DATA_SCHEMA))
+    return plan, picked, [[row[pos] for _, pos in picked] for row in rows[1:]]
+
+def ean13(digits12):
+    odd = sum(int(d) for d in digits12[0::2]); even = sum(int(d) for d in digits12[1::2])
+    return digits12 + str((10 - (odd + 3 * even) % 10) % 10)
+
+L_CODES = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+R_CODES = ["".join("1" if b == "0" else "0" for b in code) for code in L_CODES]
+G_CODES = [code[::-1] for code in R_CODES]
+PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+def ean13_modules(code):
+    left = "".join((L_CODES if p == "L" else G_CODES)[int(d)] for p, d in zip(PARITY[int(code[0])], code[1:7]))
+    return "101" + left + "01010" + "".join(R_CODES[int(d)] for d in code[7:]) + "101"
+
+def barcode_photo(code, size, seed):
+    # บาร์โค้ดกว้าง ~40% ของภาพ บนพื้นมี noise (เหมือนถ่ายกล่องพัสดุ) บันทึกเป็น JPEG แบบกล้อง
+    rng = np.random.default_rng(seed); w, h = size
+    img = Image.fromarray(rng.integers(150, 230, (h, w, 3), dtype=np.uint8)); draw = ImageDraw.Draw(img)
+    modules = ean13_modules(code) if code else ""; unit = max(1, int(w * 0.4 / 95)); bar_h = int(h * 0.25)
+    x0 = (w - 95 * unit) // 2; y0 = (h - bar_h) // 2
+    draw.rectangle([x0 - 12 * unit, y0 - 4 * unit, x0 + 107 * unit, y0 + bar_h + 4 * unit], fill=(255, 255, 255))
+    for i, bit in enumerate(modules):
+        if bit == "1": draw.rectangle([x0 + i * unit, y0, x0 + (i + 1) * unit - 1, y0 + bar_h], fill=(0, 0, 0))
+    buf = io.BytesIO(); img.save(buf, format='JPEG', quality=90); return buf.getvalue()
+
+def camera_photo(size, seed):
+    rng = np.random.default_rng(seed); w, h = size
+    blocks = rng.integers(50, 210, (h // 40 + 1, w // 40 + 1, 3), dtype=np.uint8).repeat(40, axis=0).repeat(40, axis=1)[:h, :w]
+    arr = np.clip(blocks.astype(np.int16) + rng.integers(-18, 18, (h, w, 3), dtype=np.int16), 0, 255).astype(np.uint8)
+    buf = io.BytesIO(); Image.fromarray(arr).save(buf, format='JPEG', quality=92); return buf.getvalue()
+
+# --- RUNNER ---
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter(); fn()
+        elapsed = time.perf_counter() - started; best = elapsed if best is None else min(best, elapsed)
+    return best
+
+class Suite:
+    def __init__(self, repeat):
+        self.repeat = repeat; self.results = []
+
+    def run(self, name, fn, ops=1, info=None, **params):
+        """params = ตัวแปรที่ใช้จับคู่กับ baseline, info = ข้อมูลประกอบที่ไม่ใช้เทียบ"""
+        seconds = timed(fn, self.repeat)
+        result = {'name': name, 'params': params, 'seconds': round(seconds, 6), 'ops': ops, 'us_per_op': round(seconds / ops * 1e6, 3), **(info or {})}
+        self.results.append(result)
+        label = name + "".join(f" {k}={v}" for k, v in params.items())
+        print(f"  {label:<48} {seconds * 1000:10.2f} ms" + (f"  ({result['us_per_op']:.2f} us/op)" if ops > 1 else ""))
+        return result
+
+    def skip(self, name, reason):
+        self.results.append({'name': name, 'skipped': reason}); print(f"  {name:<48} skipped: {reason}")
+
+def bench_normalize_and_lookup(suite, n):
+    rows = make_rows(n); plan, picked, projected = project(rows)
+    frame = lambda: SHEET_COLUMNS.frame(plan, projected, picked)
+    df = frame(); compact = compact_frame(df, ORDER_DATA_SCHEMA); table = SharedTable.from_frame(compact, ORDER_DATA_INDEX)
+    suite.run("normalize.column_map", frame, rows=n)
+    suite.run("normalize.compact_frame", lambda: compact_frame(df, ORDER_DATA_SCHEMA), rows=n)
+    suite.run("normalize.shared_table", lambda: SharedTable.from_frame(compact, ORDER_DATA_INDEX), rows=n)
+    del rows, projected
+
+    rng = np.random.default_rng(1); trackings = df['Tracking'].to_numpy()[rng.integers(0, n, LOOKUPS)]
+    misses = [f"TH{v}" for v in rng.integers(10**11, 10**12, LOOKUPS)]
+    suite.run("lookup.pack_tracking", lambda: [table.lookup('Tracking', t) for t in trackings], ops=LOOKUPS, rows=n)
+    suite.run("lookup.rider_contains", lambda: [table.contains('Tracking', t) for t in trackings], ops=LOOKUPS, rows=n)
+    suite.run("lookup.rider_contains_miss", lambda: [table.contains('Tracking', t) for t in misses], ops=LOOKUPS, rows=n)
+
+    orders = [table.lookup('Tracking', t).to_dict('records') for t in trackings]
+    def verify_orders():
+        for records in orders:
+            session = PackSession(); session.set_expected(records)
+            for item in session.expected: verify_scan(session, item.barcode)
+            verify_scan(session, "0000000000000")
+    suite.run("lookup.pack_barcode_verify", verify_orders, ops=len(orders), rows=n)
+
+def bench_decode(suite):
+    try: from pyzbar.pyzbar import decode
+    except ImportError as e: suite.skip("decode.pyzbar", f"pyzbar not available ({e})"); return
+    for size in PHOTO_SIZES:
+        corpus = [barcode_photo(ean13(f"885{i:09d}"), size, i) for i in range(5)]; blank = barcode_photo("", size, 99)
+        hits = sum(1 for img in corpus if decode(Image.open(io.BytesIO(img))))
+        suite.run("decode.pyzbar", lambda: [decode(Image.open(io.BytesIO(img))) for img in corpus], ops=len(corpus), info={'decoded': f"{hits}/{len(corpus)}"}, size=f"{size[0]}x{size[1]}")
+        suite.run("decode.pyzbar_miss", lambda: decode(Image.open(io.BytesIO(blank))), size=f"{size[0]}x{size[1]}")
+
+def bench_jpeg(suite):
+    for size in PHOTO_SIZES:
+        payload = camera_photo(size, 0)
+        for quality in (90, 120):
+            def reencode():
+                img_pil = Image.open(io.BytesIO(payload))
+                if img_pil.mode in ("RGBA", "P"): img_pil = img_pil.convert("RGB")
+                buf = io.BytesIO(); img_pil.save(buf, format='JPEG', quality=quality, optimize=True); return buf.getvalue()
+            suite.run("jpeg.reencode", reencode, size=f"{size[0]}x{size[1]}", quality=quality)
+
+def bench_rider_history(suite):
+    # load_rider_history คืน SavedOrders (frozenset ของประวัติที่ cache ไว้ + set ที่ค้างในคิว) สร้างครั้งเดียวนอกเวลาที่จับ แล้วแอปเช็คด้วย `in`
+    rng = np.random.default_rng(2)
+    for n in HISTORY_SIZES:
+        history = [f"TH{v}" for v in rng.integers(10**10, 10**11, n)]; saved = SavedOrders(frozenset(history), set(history[-5:]))
+        hits = [history[i] for i in rng.integers(0, n, 50)]; misses = [f"XX{i}" for i in range(50)]
+        suite.run("rider_history.check_hit", lambda: [t in saved for t in hits], ops=len(hits), history=n)
+        suite.run("rider_history.check_miss", lambda: [t in saved for t in misses], ops=len(misses), history=n)
+
+# --- COMPARE ---
+def result_key(r):
+    return r['name'] + json.dumps(r.get('params', {}), sort_keys=True)
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f: baseline = {result_key(r): r for r in json.load(f)['results'] if 'seconds' in r}
+    regressions = []
+    for r in results:
+        old = baseline.get(result_key(r))
+        if old is None or 'seconds' not in r or not old['seconds']: continue
+        ratio = r['seconds'] / old['seconds']
+        if ratio > 1 + tolerance: regressions.append((result_key(r), old['seconds'], r['seconds'], ratio))
+    for key, old, new, ratio in regressions: print(f"  REGRESSION {key}: {old * 1000:.2f} ms -> {new * 1000:.2f} ms (x{ratio:.2f})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", default="10000,100000,1000000", help="ขนาด Order_Data (คั่นด้วย ,)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", default="", help="รันเฉพาะกลุ่ม เช่น normalize,jpeg (normalize รวม lookup)")
+    parser.add_argument("--json", help="บันทึกผลเป็น JSON")
+    parser.add_argument("--compare", help="JSON ผลรอบก่อน (baseline)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="ช้าลงได้ไม่เกินกี่เท่า (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    groups = set(filter(None, args.only.split(","))) or {'normalize', 'decode', 'jpeg', 'rider_history'}
+    suite = Suite(args.repeat)
+    print(f"repeat={args.repeat} (best of) python={platform.python_version()} pandas={pd.__version__}")
+    if 'normalize' in groups:
+        for n in (int(v) for v in args.rows.split(",") if v): bench_normalize_and_lookup(suite, n)
+    if 'decode' in groups: bench_decode(suite)
+    if 'jpeg' in groups: bench_jpeg(suite)
+    if 'rider_history' in groups: bench_rider_history(suite)
+
+    report = {'generated_at': time.time(), 'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+              'pandas': pd.__version__, 'numpy': np.__version__, 'repeat': args.repeat, 'results': suite.results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"  -> {args.json}")
+    if args.compare and compare(suite.results, args.compare, args.tolerance): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import csv
+import hashlib
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+# --- CONFIGURATION ---
+# MKP_BACKEND=fake: ใช้ Sheets/Drive จำลองในหน่วยความจำ (ไม่ต่อ Google ไม่ใช้ quota ไม่ต้องมี secrets)
+# ใช้ทดสอบโหลด / benchmark / พัฒนาบนเครื่องที่ไม่มีอินเทอร์เน็ต
+BACKEND = os.environ.get("MKP_BACKEND", "google").strip().lower()
+FAKE_LATENCY_MS = float(os.environ.get("MKP_FAKE_LATENCY_MS", "0"))       # หน่วงทุก request
+FAKE_JITTER_MS = float(os.environ.get("MKP_FAKE_JITTER_MS", "0"))         # สุ่มหน่วงเพิ่ม 0..jitter
+FAKE_ERROR_RATE = float(os.environ.get("MKP_FAKE_ERROR_RATE", "0"))       # โอกาสที่ request จะ error (0-1)
+FAKE_ERROR_STATUS = int(os.environ.get("MKP_FAKE_ERROR_STATUS", "503"))   # HTTP status ของ error ที่สุ่ม
+FAKE_UPLOAD_MS_PER_MB = float(os.environ.get("MKP_FAKE_UPLOAD_MS_PER_MB", "0"))   # เวลาอัปโหลดตามขนาดไฟล์
+# โหลดข้อมูลตั้งต้นจาก <MKP_FAKE_DATA_DIR>/<spreadsheet key>/<ชื่อ Tab>.csv (ลำดับ Tab ตามชื่อไฟล์)
+FAKE_DATA_DIR = os.environ.get("MKP_FAKE_DATA_DIR", "")
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+FAKE_CREDENTIALS = "fake-credentials"
+
+def using_fake_backend():
+    return BACKEND == "fake"
+
+# --- ERRORS (หน้าตาเหมือน error ของ Google ให้ retry / circuit breaker ทำงานเหมือนของจริง) ---
+class FakeAPIError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(f"{status} {message}".strip())
+        self.response = SimpleNamespace(status_code=status)   # แบบ gspread.APIError
+        self.resp = SimpleNamespace(status=status)            # แบบ googleapiclient HttpError
+
+def worksheet_not_found_type():
+    # error ตอนไม่พบ Tab (backend จำลองบนเครื่องที่ไม่มี gspread ใช้ KeyError)
+    try: from gspread.exceptions import WorksheetNotFound
+    except ImportError: return KeyError
+    return WorksheetNotFound
+
+def _worksheet_not_found(title):
+    return worksheet_not_found_type()(title)
+
+class FaultInjector:
+    def __init__(self, latency_ms=FAKE_LATENCY_MS, jitter_ms=FAKE_JITTER_MS, error_rate=FAKE_ERROR_RATE, error_status=FAKE_ERROR_STATUS,
+                 upload_ms_per_mb=FAKE_UPLOAD_MS_PER_MB, seed=None):
+        self._random = random.Random(seed); self._lock = threading.Lock()
+        self.configure(latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate, error_status=error_status, upload_ms_per_mb=upload_ms_per_mb)
+        self.calls = {}
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if name not in ('latency_ms', 'jitter_ms', 'error_rate', 'error_status', 'upload_ms_per_mb'): raise TypeError(name)
+            setattr(self, name, value)
+
+    def before(self, op, nbytes=0):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+            delay = self.latency_ms + self._random.uniform(0, self.jitter_ms) + self.upload_ms_per_mb * nbytes / 1e6
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        if delay > 0: time.sleep(delay / 1000)
+        if fail: raise FakeAPIError(self.error_status, f"injected error on {op}")
+
+# --- FAKE SHEETS ---
+def _column_index(letters):
+    n = 0
+    for ch in letters.upper(): n = n * 26 + ord(ch) - 64
+    return n - 1
+
+def _parse_range(a1):
+    # "B1:B" / "A2:C10" / "C" -> (คอลัมน์แรก, คอลัมน์สุดท้าย, แถวแรก, แถวสุดท้ายหรือ None) แบบ 0-based
+    m = re.fullmatch(r"(?:[^!]+!)?([A-Za-z]+)(\d*)(?::([A-Za-z]+)(\d*))?", a1.strip())
+    if not m: raise FakeAPIError(400, f"bad range {a1}")
+    c1, r1, c2, r2 = m.groups()
+    return _column_index(c1), _column_index(c2 or c1), int(r1 or 1) - 1, (int(r2) if r2 else None)
+
+class FakeWorksheet:
+    def __init__(self, backend, title, rows=None, sheet_id=0):
+        self._backend = backend; self.title = title; self.id = sheet_id
+        self._rows = [[str(v) for v in row] for row in (rows or [])]
+
+    def _call(self, op): self._backend.faults.before(f"sheets.{op}")
+
+    def get_all_values(self):
+        self._call('get_all_values')
+        with self._backend.lock:
+            width = max((len(r) for r in self._rows), default=0)
+            return [r + [""] * (width - len(r)) for r in self._rows]
+
+    def row_values(self, row):
+        self._call('row_values')
+        with self._backend.lock:
+            values = list(self._rows[row - 1]) if 0 < row <= len(self._rows) else []
+        while values and values[-1] == "": values.pop()
+        return values
+
+    def batch_get(self, ranges):
+        self._call('batch_get'); out = []
+        with self._backend.lock:
+            for a1 in ranges:
+                c1, c2, r1, r2 = _parse_range(a1); block = []
+                for row in self._rows[r1:r2]:
+                    values = [row[c] if c < len(row) else "" for c in range(c1, c2 + 1)]
+                    while values and values[-1] == "": values.pop()
+                    block.append(values)
+                while block and not block[-1]: block.pop()
+                out.append(block)
+        return out
+
+    def acell(self, label):
+        self._call('acell'); c, _, r, _ = _parse_range(label)
+        with self._backend.lock:
+            value = self._rows[r][c] if r < len(self._rows) and c < len(self._rows[r]) else ""
+        return SimpleNamespace(value=value or None, row=r + 1, col=c + 1)
+
+    def append_row(self, values, **kwargs):
+        self._call('append_row')
+        with self._backend.lock: self._rows.append([str(v) for v in values])
+
+    def append_rows(self, values, **kwargs):
+        self._call('append_rows')
+        with self._backend.lock: self._rows.extend([str(v) for v in row] for row in values)
+
+    def delete_rows(self, start_index, end_index=None):
+        self._call('delete_rows')
+        with self._backend.lock: del self._rows[start_index - 1:(end_index or start_index)]
+
+    @property
+    def row_count(self):
+        with self._backend.lock: return len(self._rows)
+
+class FakeSpreadsheet:
+    def __init__(self, backend, key):
+        self._backend = backend; self.id = key; self._worksheets = []
+
+    def worksheet(self, title):
+        self._backend.faults.before("sheets.worksheet")
+        with self._backend.lock:
+            for ws in self._worksheets:
+                if ws.title == title: return ws
+        raise _worksheet_not_found(title)
+
+    def get_worksheet(self, index):
+        self._backend.faults.before("sheets.get_worksheet")
+        with self._backend.lock:
+            if 0 <= index < len(self._worksheets): return self._worksheets[index]
+        raise _worksheet_not_found(f"index {index}")   # gspread: WorksheetNotFound เหมือน worksheet()
+
+    def worksheets(self):
+        with self._backend.lock: return list(self._worksheets)
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        self._backend.faults.before("sheets.add_worksheet")
+        with self._backend.lock:
+            if any(ws.title == title for ws in self._worksheets): raise FakeAPIError(400, f"sheet {title} already exists")
+            ws = FakeWorksheet(self._backend, title, sheet_id=len(self._worksheets)); self._worksheets.append(ws)
+            return ws
+
+class FakeSheetsClient:
+    def __init__(self, backend):
+        self._backend = backend; self._spreadsheets = {}
+
+    def open_by_key(self, key):
+        self._backend.faults.before("sheets.open_by_key")
+        with self._backend.lock: return self._spreadsheets.setdefault(key, FakeSpreadsheet(self._backend, key))
+
+# --- FAKE DRIVE ---
+class FakeRequest:
+    """เหมือน googleapiclient HttpRequest: .execute(num_retries=...) / .next_chunk() สำหรับไฟล์ resumable"""
+    def __init__(self, backend, method_id, run, media=None):
+        self._backend = backend; self.methodId = method_id; self._run = run; self._media = media
+        self._uploaded = bytearray(); self._done = False
+
+    def next_chunk(self, num_retries=0):
+        # อัปโหลดทีละ chunk ตาม chunksize ของ MediaIoBaseUpload (หน่วง/error ได้ทุก chunk)
+        size = self._media.size(); chunk = self._media.getbytes(len(self._uploaded), self._media.chunksize())
+        self._backend.faults.before(f"{self.methodId}.chunk", len(chunk)); self._uploaded.extend(chunk)
+        if len(self._uploaded) < (size or 0): return SimpleNamespace(resumable_progress=len(self._uploaded), total_size=size, progress=lambda: len(self._uploaded) / size), None
+        self._done = True
+        return None, self._run(bytes(self._uploaded))
+
+    def execute(self, num_retries=0, **kwargs):
+        if self._media is None:
+            self._backend.faults.before(self.methodId); return self._run(None)
+        self._backend.faults.before(self.methodId)
+        response = None
+        while response is None:
+            _, response = self.next_chunk(num_retries)
+        return response
+
+class FakeFiles:
+    def __init__(self, backend):
+        self._backend = backend
+
+    def list(self, q="", fields=None, **kwargs):
+        def run(_):
+            name = re.search(r"name\s*=\s*'((?:[^'\\]|\\.)*)'", q); parent = re.search(r"'([^']+)'\s+in\s+parents", q)
+            mime = re.search(r"mimeType\s*=\s*'([^']+)'", q); trashed = re.search(r"trashed\s*=\s*(true|false)", q)
+            with self._backend.lock:
+                files = [f for f in self._backend.files.values()
+                         if (not name or f['name'] == name.group(1).replace("\\'", "'")) and (not parent or parent.group(1) in f['parents'])
+                         and (not mime or f['mimeType'] == mime.group(1)) and (not trashed or f['trashed'] == (trashed.group(1) == 'true'))]
+            return {'files': [{'id': f['id'], 'name': f['name']} for f in files]}
+        return FakeRequest(self._backend, "drive.files.list", run)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        body = dict(body or {})
+        def run(content):
+            with self._backend.lock:
+                file_id = f"fake{next(self._backend.ids):08d}"
+                self._backend.files[file_id] = {'id': file_id, 'name': body.get('name', 'Untitled'), 'parents': list(body.get('parents', [])),
+                                               'mimeType': body.get('mimeType') or getattr(media_body, 'mimetype', lambda: 'application/octet-stream')(),
+                                               'trashed': False, 'size': len(content or b""), 'md5': hashlib.md5(content or b"").hexdigest()}
+            return {'id': file_id}
+        return FakeRequest(self._backend, "drive.files.create", run, media_body)
+
+class FakeDriveService:
+    def __init__(self, backend):
+        self._files = FakeFiles(backend)
+
+    def files(self):
+        return self._files
+
+# --- FAKE BACKEND ---
+class FakeBackend:
+    def __init__(self, faults=None, data_dir=FAKE_DATA_DIR):
+        self.lock = threading.RLock(); self.faults = faults or FaultInjector()
+        self.files = {}; self.ids = itertools.count(1)
+        self.sheets = FakeSheetsClient(self); self.drive = FakeDriveService(self)
+        if data_dir: self.load_dir(data_dir)
+
+    def seed(self, spreadsheet_key, tab, rows):
+        """สร้าง/แทนที่ Tab ด้วยข้อมูล rows (แถวแรก = header) ไม่นับเป็น request"""
+        with self.lock:
+            sh = self.sheets._spreadsheets.setdefault(spreadsheet_key, FakeSpreadsheet(self, spreadsheet_key))
+            for ws in sh._worksheets:
+                if ws.title == tab: ws._rows = [[str(v) for v in row] for row in rows]; return ws
+            ws = FakeWorksheet(self, tab, rows, sheet_id=len(sh._worksheets)); sh._worksheets.append(ws)
+            return ws
+
+    def load_dir(self, path):
+        for key in sorted(os.listdir(path)):
+            folder = os.path.join(path, key)
+            if not os.path.isdir(folder): continue
+            for filename in sorted(os.listdir(folder)):
+                if not filename.endswith(".csv"): continue
+                with open(os.path.join(folder, filename), newline="", encoding="utf-8-sig") as f: self.seed(key, filename[:-4], list(csv.reader(f)))
+
+    def rows(self, spreadsheet_key, tab):
+        with self.lock:
+            for ws in self.sheets._spreadsheets.get(spreadsheet_key, FakeSpreadsheet(self, spreadsheet_key))._worksheets:
+                if ws.title == tab: return [list(r) for r in ws._rows]
+        return None
+
+_fake = None
+_fake_lock = threading.Lock()
+
+def get_fake_backend():
+    # ทุก session ใน process เห็นข้อมูลชุดเดียวกัน (เหมือน Google จริง)
+    global _fake
+    with _fake_lock:
+        if _fake is None: _fake = FakeBackend()
+        return _fake
+
+# --- BACKEND SELECTION ---
+def open_sheets(creds):
+    if using_fake_backend(): return get_fake_backend().sheets
+    from mkp_sheets import authorize_sheets
+    return authorize_sheets(creds)
+
+def open_drive(creds):
+    if using_fake_backend(): return get_fake_backend().drive
+    from googleapiclient.discovery import build
+    return build('drive', 'v3', credentials=creds)
@@ -0,0 +1,446 @@
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # Windows: ไม่มี flock ถือว่ารัน process เดียว
+    fcntl = None
+
+from mkp_sheets import PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from mkp_storage import data_path
+
+# --- CONFIGURATION ---
+CATALOG_TTL_SECONDS = 600
+CATALOG_REFRESH_AHEAD = 0.8       # refresh เบื้องหลังเมื่ออายุข้อมูลเกิน 80% ของ TTL
+CATALOG_RETRY_SECONDS = 30        # refresh ไม่สำเร็จ รอกี่วินาทีค่อยลองใหม่
+CATALOG_POLL_SECONDS = 5
+SNAPSHOT_VERSION = 3              # เปลี่ยนเมื่อรูปแบบข้อมูลที่ normalize เปลี่ยน (snapshot เก่าจะถูกข้าม)
+MEMORY_ONLY_TABS = ('User',)      # Tab ที่มีรหัสผ่าน: cache ในหน่วยความจำเท่านั้น ไม่เขียน snapshot ลงดิสก์
+
+# --- COMPACT SCHEMA (เก็บเฉพาะคอลัมน์ที่ใช้ + dtype ที่กินที่น้อย) ---
+# 'category' = ค่าซ้ำเยอะ (Zone, Location, ชื่อสินค้า), 'int' = ตัวเลขล้วน (ถ้ามีค่าอื่นปนจะเก็บเป็น category),
+# 'str' = ค่าเกือบไม่ซ้ำ (Tracking) ใช้ string ที่ intern แล้ว
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+def compact_frame(df, schema):
+    out = {}
+    for col, kind in schema.items():
+        if col not in df.columns: continue
+        values = df[col]
+        if kind == 'int':
+            numbers = pd.to_numeric(values.astype(str).str.strip(), errors='coerce')
+            if numbers.notna().all(): out[col] = pd.to_numeric(numbers, downcast='integer'); continue
+            kind = 'category'
+        if kind == 'category': out[col] = values.astype(str).astype('category')
+        else: out[col] = values.astype(str).map(sys.intern)
+    return pd.DataFrame(out, index=df.index)
+
+# --- SHARED TABLE (ตารางใหญ่ map จากไฟล์ Arrow แบบ read-only ทุก process ใช้หน้า memory ร่วมกัน) ---
+def normalize_keys(values):
+    return pd.Series(values, dtype=object).astype(str).str.strip().str.upper().to_numpy(dtype=object)
+
+def normalize_key(value):
+    return str(value).strip().upper()
+
+def hash_keys(values):
+    return pd.util.hash_array(normalize_keys(values), categorize=False)
+
+class SharedTable:
+    # index: column -> (hash ที่เรียงแล้ว, ตำแหน่งแถว) ค้นด้วย binary search ไม่ต้องแปลงทั้งตารางเป็น pandas
+    def __init__(self, table, indexes):
+        self.table = table; self.indexes = indexes
+
+    @classmethod
+    def from_frame(cls, df, index_columns):
+        indexes = {}
+        for col in index_columns:
+            if col not in df.columns: continue
+            hashes = hash_keys(df[col]); order = np.argsort(hashes, kind='stable')
+            indexes[col] = (hashes[order], order.astype(np.int64))
+        return cls(pa.Table.from_pandas(df, preserve_index=False), indexes)
+
+    @property
+    def columns(self):
+        return pd.Index(self.table.column_names)
+
+    @property
+    def empty(self):
+        return self.table.num_rows == 0 or self.table.num_columns == 0
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def positions(self, column, value):
+        hashes, positions = self.indexes[column]
+        h = pd.util.hash_array(np.array([normalize_key(value)], dtype=object), categorize=False)[0]
+        lo = np.searchsorted(hashes, h, side='left'); hi = np.searchsorted(hashes, h, side='right')
+        return np.sort(positions[lo:hi])
+
+    def matches(self, column, value):
+        """ตำแหน่งแถวที่ column ตรงกับ value จริง (hash ชนกันได้ จึงเทียบค่าซ้ำเฉพาะแถวที่ hash ตรง)"""
+        positions = self.positions(column, value)
+        if not len(positions): return positions
+        key = normalize_key(value); values = self.table.column(column)
+        return np.array([p for p in positions if normalize_key(values[int(p)].as_py()) == key], dtype=np.int64)
+
+    def _rows(self, positions):
+        # คอลัมน์ category (dictionary) แปลงเป็นค่าธรรมดาก่อน to_pandas ไม่ต้องสร้าง dictionary ทั้งชุดใหม่ทุกครั้ง
+        rows = self.table.take(pa.array(positions, type=pa.int64()))
+        columns = [c.cast(c.type.value_type) if pa.types.is_dictionary(c.type) else c for c in rows.columns]
+        return pa.table(columns, names=rows.column_names).to_pandas()
+
+    def lookup(self, column, value):
+        """แถวที่ column ตรงกับ value (ไม่สนตัวพิมพ์เล็ก/ใหญ่และช่องว่าง) คืนเป็น DataFrame เฉพาะแถวที่เจอ"""
+        return self._rows(self.matches(column, value))
+
+    def contains(self, column, value):
+        positions = self.positions(column, value)
+        if not len(positions): return False
+        key = normalize_key(value); values = self.table.column(column)
+        return any(normalize_key(values[int(p)].as_py()) == key for p in positions)
+
+    def to_pandas(self):
+        return self.table.to_pandas()
+
+# --- LEADER LOCK (หลาย process: ให้ process เดียวโหลดจาก Google และเขียน snapshot) ---
+class LeaderLock:
+    def __init__(self, folder="catalog"):
+        self.folder = folder; self._fd = None; self._last_try = 0.0
+
+    def acquire(self):
+        if self._fd is not None or fcntl is None: return True
+        if time.monotonic() - self._last_try < CATALOG_POLL_SECONDS: return False
+        self._last_try = time.monotonic()
+        fd = os.open(data_path(self.folder, "leader.lock"), os.O_RDWR | os.O_CREAT)
+        try: fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd); return False
+        self._fd = fd  # lock ค้างไว้จน process จบ (OS ปล่อยให้เองถ้า process ตาย)
+        return True
+
+# --- SNAPSHOT STORE (เก็บ cache ลงดิสก์ เปิด server ใหม่แล้วใช้ได้ทันที) ---
+# SharedTable เก็บเป็น Arrow IPC + index .npy (map ได้), DataFrame เก็บเป็น Parquet,
+# ค่าอื่น (เช่น list ของ Order ID) เก็บเป็น JSON
+# meta.json เก็บ version + เวลาที่โหลดจาก Google (ใช้คำนวณอายุข้อมูลต่อหลัง restart)
+class SnapshotStore:
+    def __init__(self, folder="catalog"):
+        self.folder = folder
+        self._locks = {}; self._lock = threading.Lock()
+
+    def _base(self, k):
+        name = re.sub(r"[^A-Za-z0-9_-]+", "_", f"{k[0]}__{k[1]}")
+        return data_path(self.folder, name)
+
+    def _write_json(self, path, obj):
+        with open(path + ".tmp", "w", encoding="utf-8") as f: json.dump(obj, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def save(self, k, value, loaded_at):
+        with self._lock: key_lock = self._locks.setdefault(k, threading.Lock())
+        with key_lock:
+            base = self._base(k)
+            meta = {'version': SNAPSHOT_VERSION, 'loaded_at': loaded_at, 'saved_at': time.time(), 'rows': len(value)}
+            if isinstance(value, SharedTable):
+                # ไฟล์ใหม่ทุกรุ่น (generation) process อื่นที่ map รุ่นเก่าอยู่ยังอ่านต่อได้
+                gen = uuid.uuid4().hex[:12]
+                with pa.OSFile(f"{base}.{gen}.arrow", "wb") as sink:
+                    with pa.ipc.new_file(sink, value.table.schema) as writer: writer.write_table(value.table)
+                index = {}
+                for i, (col, (hashes, positions)) in enumerate(value.indexes.items()):
+                    np.save(f"{base}.{gen}.idx{i}.hash.npy", hashes); np.save(f"{base}.{gen}.idx{i}.pos.npy", positions); index[col] = f"idx{i}"
+                meta.update(kind='shared', generation=gen, index=index)
+            elif isinstance(value, pd.DataFrame):
+                value.to_parquet(f"{base}.parquet.tmp", index=False); os.replace(f"{base}.parquet.tmp", f"{base}.parquet")
+                meta.update(kind='frame')
+            else:
+                self._write_json(f"{base}.json", value); meta.update(kind='json')
+            self._write_json(f"{base}.meta.json", meta)
+            if meta['kind'] == 'shared': self._cleanup(base, meta['generation'])
+
+    def _cleanup(self, base, keep_gen):
+        for path in glob.glob(f"{glob.escape(base)}.*.arrow") + glob.glob(f"{glob.escape(base)}.*.npy"):
+            if path[len(base) + 1:].split(".")[0] == keep_gen: continue
+            try: os.remove(path)
+            except OSError: pass  # Windows: ไฟล์ที่ยังถูก map อยู่ลบไม่ได้ รอบหน้าค่อยลบ
+
+    def meta(self, k):
+        try:
+            with open(f"{self._base(k)}.meta.json", encoding="utf-8") as f: meta = json.load(f)
+        except (OSError, ValueError): return None
+        return meta if meta.get('version') == SNAPSHOT_VERSION else None
+
+    def load(self, k):
+        """คืนค่า (value, loaded_at) หรือ None ถ้าไม่มี snapshot / version ไม่ตรง / ไฟล์เสีย"""
+        base = self._base(k); meta = self.meta(k)
+        if meta is None: return None
+        try:
+            if meta['kind'] == 'shared':
+                gen = meta['generation']
+                table = pa.ipc.open_file(pa.memory_map(f"{base}.{gen}.arrow", "r")).read_all()
+                indexes = {col: (np.load(f"{base}.{gen}.{name}.hash.npy", mmap_mode='r'), np.load(f"{base}.{gen}.{name}.pos.npy", mmap_mode='r')) for col, name in meta['index'].items()}
+                value = SharedTable(table, indexes)
+            elif meta['kind'] == 'frame': value = pd.read_parquet(f"{base}.parquet")
+            else:
+                with open(f"{base}.json", encoding="utf-8") as f: value = json.load(f)
+            return value, meta['loaded_at']
+        except (OSError, ValueError, KeyError, pa.ArrowException):
+            return None
+
+    # process ที่ไม่ใช่ leader แก้ข้อมูลแล้ว ขอให้ leader โหลดจาก Google ใหม่
+    def mark_dirty(self, k):
+        with open(f"{self._base(k)}.dirty", "w"): pass
+
+    def take_dirty(self, k):
+        try: os.remove(f"{self._base(k)}.dirty"); return True
+        except OSError: return False
+
+    def discard(self, k):
+        # ลบ snapshot ทุกไฟล์ของ Tab นี้ (รวมไฟล์ที่เขียนไว้ก่อนตั้งเป็น memory-only)
+        for path in glob.glob(f"{glob.escape(self._base(k))}.*"):
+            try: os.remove(path)
+            except OSError: pass
+
+# --- SHEET CACHE (cache ต่อ spreadsheet + tab ล้างเฉพาะ Tab ที่เปลี่ยน) ---
+# loader(priority) โหลดข้อมูลทั้ง Tab: คนแรกที่ยังไม่มีข้อมูลโหลดเองด้วย PRIORITY_INTERACTIVE
+# ที่เหลือได้ข้อมูลชุดเดิมทันที (stale-while-revalidate) แล้ว refresh เบื้องหลังด้วย PRIORITY_BACKGROUND
+# หลาย process: leader โหลดจาก Google + เขียน snapshot, process อื่นแค่ map snapshot รุ่นล่าสุด
+class SheetCache:
+    def __init__(self, ttl=CATALOG_TTL_SECONDS, refresh_ahead=CATALOG_REFRESH_AHEAD, store=None, leader=None, memory_only=()):
+        self.ttl = ttl; self.refresh_ahead = refresh_ahead; self.store = store; self.leader = leader
+        self.memory_only = tuple(memory_only)   # ชื่อ Tab ที่ไม่เขียน/อ่าน snapshot
+        self._ttls = {}
+        self._index_columns = {}  # Tab ที่ระบุ index จะเก็บเป็น SharedTable
+        self._schemas = {}        # Tab ที่ระบุ schema จะตัดคอลัมน์ + ย่อ dtype ก่อนเก็บ
+        self._lock = threading.Lock()
+        self._entries = {}        # (spreadsheet_key, tab) -> (value, loaded_at)
+        self._unsaved = set()     # Tab ที่แก้ใน cache แล้วยังไม่ได้เขียน snapshot (เขียนรวมในรอบ _run)
+        self._versions = {}       # เพิ่มทุกครั้งที่ update/invalidate กัน refresh เก่าทับข้อมูลใหม่
+        self._loaders = {}
+        self._load_locks = {}
+        self._refreshing = set()
+        self._stats = {}
+        self._thread = None
+
+    def _load_lock(self, k):
+        with self._lock: return self._load_locks.setdefault(k, threading.Lock())
+
+    def _stat(self, k):
+        return self._stats.setdefault(k, {'hits': 0, 'misses': 0, 'refreshes': 0, 'failures': 0, 'last_error': "", 'last_attempt': 0.0, 'load_seconds': 0.0, 'restored': False, 'bytes_before': None, 'bytes_after': None})
+
+    def _ttl(self, k):
+        return self._ttls.get(k, self.ttl)
+
+    def _due(self, k, entry):
+        return time.time() - entry[1] >= self._ttl(k) * self.refresh_ahead
+
+    def is_leader(self):
+        return self.leader is None or self.leader.acquire()
+
+    def _following(self):
+        return self.store is not None and not self.is_leader()
+
+    def _snapshots(self, k):
+        return self.store is not None and k[1] not in self.memory_only
+
+    def register(self, spreadsheet_key, tab, loader, ttl=None, index=None, schema=None):
+        k = (spreadsheet_key, tab)
+        if self.store is not None and not self._snapshots(k) and k not in self._loaders: self.store.discard(k)
+        with self._lock:
+            self._loaders[k] = loader
+            if ttl is not None: self._ttls[k] = ttl
+            if index is not None: self._index_columns[k] = tuple(index)
+            if schema is not None: self._schemas[k] = dict(schema)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mkp-sheet-cache", daemon=True); self._thread.start()
+
+    def get(self, spreadsheet_key, tab, loader, ttl=None, index=None, schema=None):
+        k = (spreadsheet_key, tab)
+        self.register(spreadsheet_key, tab, loader, ttl, index, schema)
+        entry = self.peek(spreadsheet_key, tab)
+        if entry is not None:
+            with self._lock: self._stat(k)['hits'] += 1
+            if self._due(k, entry): self._refresh_async(k)
+            return entry[0]
+        with self._lock: self._stat(k)['misses'] += 1
+        # ยังไม่เคยโหลด: หลาย session ขอ Tab เดียวกันพร้อมกัน ให้โหลดจาก Google แค่ครั้งเดียว
+        with self._load_lock(k):
+            entry = self.peek(spreadsheet_key, tab) or self._restore(k)
+            if entry is not None: return entry[0]
+            started = time.monotonic()
+            value = self.put(spreadsheet_key, tab, loader(PRIORITY_INTERACTIVE))
+            with self._lock: self._stat(k)['load_seconds'] = round(time.monotonic() - started, 3)
+            return value
+
+    def warm(self, spreadsheet_key, tab, loader, ttl=None, index=None, schema=None):
+        # ใช้ snapshot บนดิสก์ทันที (ถ้ามี) แล้วโหลดจาก Google เบื้องหลัง ไม่ให้หน้า Login / Scan แรกต้องรอ
+        k = (spreadsheet_key, tab)
+        self.register(spreadsheet_key, tab, loader, ttl, index, schema)
+        if self.peek(spreadsheet_key, tab) is None:
+            with self._load_lock(k): entry = self.peek(spreadsheet_key, tab) or self._restore(k)
+            if entry is None: self._refresh_async(k)
+
+    def _restore(self, k):
+        if not self._snapshots(k): return None
+        entry = self.store.load(k)
+        if entry is None: return None
+        with self._lock:
+            if k in self._entries: return self._entries[k]
+            self._entries[k] = entry; self._stat(k)['restored'] = True
+        # ข้อมูลจากดิสก์อาจเก่ากว่าใน Sheet: ตรวจกับ Google เบื้องหลังทันที
+        if self.is_leader(): self._refresh_async(k)
+        return entry
+
+    def _prepare(self, k, value):
+        schema = self._schemas.get(k)
+        if schema is not None and isinstance(value, pd.DataFrame) and not value.empty:
+            before = frame_bytes(value); value = compact_frame(value, schema)
+            with self._lock: self._stat(k).update(bytes_before=before, bytes_after=frame_bytes(value))
+        index = self._index_columns.get(k)
+        if index is not None and isinstance(value, pd.DataFrame): return SharedTable.from_frame(value, index)
+        return value
+
+    def _persist(self, k, entry):
+        # คืนค่า entry ที่ควรใช้ต่อ (SharedTable จะเปลี่ยนเป็นตัวที่ map จากไฟล์ ไม่ถือสำเนาใน RAM)
+        if not self._snapshots(k) or not self.is_leader(): return entry
+        try:
+            self.store.save(k, entry[0], entry[1])
+            if isinstance(entry[0], SharedTable): return self.store.load(k) or entry
+        except Exception as e:
+            with self._lock: self._stat(k)['last_error'] = f"snapshot: {e}"[:200]
+        return entry
+
+    def _commit(self, k, entry, version=None):
+        stale = lambda: version is not None and self._versions.get(k, 0) != version
+        with self._lock:
+            if stale(): return None
+        entry = self._persist(k, entry)
+        with self._lock:
+            if stale(): return None
+            self._entries[k] = entry
+        return entry
+
+    def put(self, spreadsheet_key, tab, value):
+        k = (spreadsheet_key, tab)
+        return self._commit(k, (self._prepare(k, value), time.time()))[0]
+
+    def peek(self, spreadsheet_key, tab):
+        """คืนค่า (value, loaded_at) ล่าสุดแม้เก่าเกิน TTL แล้ว หรือ None"""
+        with self._lock: return self._entries.get((spreadsheet_key, tab))
+
+    def invalidate(self, spreadsheet_key, tab=None):
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == spreadsheet_key and (tab is None or k[1] == tab)]:
+                del self._entries[k]; self._versions[k] = self._versions.get(k, 0) + 1
+
+    def update(self, spreadsheet_key, tab, fn):
+        # แก้ข้อมูลใน cache ตรงๆ หลังเขียนลง Sheet สำเร็จ (ไม่ต้องโหลดใหม่ทั้ง Tab)
+        k = (spreadsheet_key, tab)
+        with self._lock:
+            entry = self._entries.get(k)
+            if entry is None: return False
+            entry = (fn(entry[0]), entry[1]); self._entries[k] = entry; self._versions[k] = self._versions.get(k, 0) + 1
+        if self._following(): self.store.mark_dirty(k)
+        elif self._snapshots(k):
+            # ยืนยันงานถี่ๆ (เช่นประวัติ Rider) ไม่ต้องเขียนทั้งไฟล์ทุกครั้ง: รวมเขียนครั้งเดียวในรอบ _run ถัดไป
+            with self._lock: self._unsaved.add(k)
+        return True
+
+    def flush(self):
+        with self._lock: keys = list(self._unsaved); self._unsaved.clear()
+        for k in keys:
+            entry = self.peek(*k)
+            if entry is not None: self._persist(k, entry)
+
+    # --- BACKGROUND REFRESH ---
+    def _refresh_async(self, k):
+        with self._lock:
+            stat = self._stat(k)
+            if k in self._refreshing or k not in self._loaders: return
+            if stat['failures'] and time.time() - stat['last_attempt'] < CATALOG_RETRY_SECONDS and k in self._entries: return
+            self._refreshing.add(k); stat['last_attempt'] = time.time()
+        threading.Thread(target=self._refresh, args=(k,), name=f"mkp-refresh-{k[1]}", daemon=True).start()
+
+    def _refresh(self, k):
+        try:
+            if self._following():
+                self._follow(k); return
+            with self._lock: loader = self._loaders[k]; version = self._versions.get(k, 0)
+            started = time.monotonic()
+            value = self._prepare(k, loader(PRIORITY_BACKGROUND))
+            # ระหว่างโหลดมีการแก้ข้อมูลใน cache: ทิ้งผลนี้แล้วให้รอบถัดไปโหลดใหม่
+            if self._commit(k, (value, time.time()), version) is not None:
+                with self._lock:
+                    stat = self._stat(k); stat['refreshes'] += 1; stat['failures'] = 0; stat['last_error'] = ""
+                    stat['load_seconds'] = round(time.monotonic() - started, 3)
+        except Exception as e:
+            with self._lock: stat = self._stat(k); stat['failures'] += 1; stat['last_error'] = str(e)[:200]
+        finally:
+            with self._lock: self._refreshing.discard(k)
+
+    def _follow(self, k):
+        # ใช้ snapshot ที่ leader เขียนไว้ ถ้าใหม่กว่าข้อมูลที่มีอยู่
+        meta = self.store.meta(k); current = self.peek(*k)
+        if meta is None or (current is not None and meta['loaded_at'] <= current[1]): return
+        entry = self.store.load(k)
+        if entry is None: return
+        with self._lock: self._entries[k] = entry; self._stat(k)['refreshes'] += 1
+
+    def _run(self):
+        # refresh ก่อนหมดอายุ แม้ไม่มีใครอ่าน Tab นั้นอยู่
+        while True:
+            time.sleep(CATALOG_POLL_SECONDS)
+            with self._lock: keys = list(self._loaders)
+            following = self._following()
+            if not following: self.flush()
+            for k in keys:
+                if following:
+                    try: self._follow(k)
+                    except Exception: pass
+                    continue
+                entry = self.peek(*k)
+                dirty = self.store is not None and self.store.take_dirty(k)
+                if entry is None or dirty or self._due(k, entry): self._refresh_async(k)
+
+    def stats(self):
+        now = time.time(); out = []; role = 'leader' if self.is_leader() else 'follower'
+        with self._lock:
+            for k in sorted(set(self._loaders) | set(self._entries), key=str):
+                entry = self._entries.get(k); stat = dict(self._stat(k))
+                value = entry[0] if entry else None
+                out.append({
+                    'spreadsheet': k[0], 'tab': k[1], 'role': role,
+                    'age_seconds': round(now - entry[1], 1) if entry else None,
+                    'ttl_seconds': self._ttl(k),
+                    'stale': bool(entry) and now - entry[1] >= self._ttl(k),
+                    'rows': len(value) if hasattr(value, '__len__') else None,
+                    'shared': isinstance(value, SharedTable),
+                    'bytes': value.table.nbytes if isinstance(value, SharedTable) else frame_bytes(value) if isinstance(value, pd.DataFrame) else None,
+                    'refreshing': k in self._refreshing,
+                    'hit_rate': round(stat['hits'] / (stat['hits'] + stat['misses']), 3) if stat['hits'] + stat['misses'] else None,
+                    **stat,
+                })
+        return out
+
+sheet_cache = SheetCache(store=SnapshotStore(), leader=LeaderLock(), memory_only=MEMORY_ONLY_TABS)
+
+# --- IN-PLACE EDITS ---
+def with_row_appended(df, row):
+    # row เรียงตามคอลัมน์ใน Sheet (ชื่อคอลัมน์ใน df อาจถูกเปลี่ยนชื่อไปแล้ว)
+    if not len(df.columns): return df
+    new = pd.DataFrame([list(row)[:len(df.columns)] + [""] * (len(df.columns) - len(row))], columns=df.columns)
+    return pd.concat([df, new], ignore_index=True)
+
+def without_row(df, position):
+    # ตัดแถวตามตำแหน่ง (แถวที่ต่อท้ายเลื่อนขึ้นมาแทนเหมือนใน Sheet หลัง delete_rows)
+    return df.drop(df.index[position]).reset_index(drop=True)
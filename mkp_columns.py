@@ -0,0 +1,92 @@
+import threading
+from collections import namedtuple
+
+import pandas as pd
+
+from mkp_sheets import sheets_call, read_projected, PRIORITY_INTERACTIVE
+
+# --- COLUMN RULES ---
+# target: ชื่อมาตรฐานที่จะตั้งให้ (None = ไม่เปลี่ยนชื่อ แค่ normalize ทุกคอลัมน์ที่ตรง)
+# contains: คำที่ต้องมีในชื่อ (ตัวพิมพ์เล็ก) ใส่ tuple = ต้องมีทุกคำ เช่น ('order', 'id')
+# equals: ชื่อที่ต้องตรงทั้งคำ (ไม่สนตัวพิมพ์)
+# normalize: ฟังก์ชันรับ/คืน Series ใช้ครั้งเดียวต่อคอลัมน์
+ColumnRule = namedtuple("ColumnRule", ["target", "contains", "equals", "normalize"], defaults=((), (), None))
+ColumnPlan = namedtuple("ColumnPlan", ["names", "normalizers", "extra"])
+
+MAX_CACHED_PLANS = 64
+
+def strip_float_suffix(values):
+    # Sheets ส่งตัวเลขมาเป็น "885123.0" -> "885123"
+    return values.astype(str).str.removesuffix('.0')
+
+def rule_matches(rule, lower):
+    if any(lower == name.lower() for name in rule.equals): return True
+    return any(all(word in lower for word in (c if isinstance(c, tuple) else (c,))) for c in rule.contains)
+
+# --- COLUMN MAP ---
+class ColumnMap:
+    def __init__(self, rules=(), positional=None):
+        # positional: {ชื่อ: ตำแหน่ง 0-based} สำหรับคอลัมน์ที่ใช้ตามตำแหน่งไม่ใช่ตามชื่อ
+        self.rules = tuple(r for r in rules if r.target is not None)
+        self.normalize_rules = tuple(r for r in rules if r.target is None and r.normalize is not None)
+        self.positional = dict(positional or {})
+        self._plans = {}; self._lock = threading.Lock()
+
+    def plan(self, header):
+        """คำนวณชื่อคอลัมน์ทั้งหมดในรอบเดียว (cache ต่อ header) คอลัมน์แรกที่ตรง rule ได้ชื่อมาตรฐาน ที่เหลือไม่ชนกัน"""
+        key = tuple(header)
+        with self._lock: plan = self._plans.get(key)
+        if plan is not None: return plan
+        names = [col.strip() or "Untitled" for col in header]
+        normalizers = [[r.normalize for r in self.normalize_rules if rule_matches(r, name.lower())] for name in names]
+        claimed = {}
+        for i, name in enumerate(names):
+            rule = next((r for r in self.rules if rule_matches(r, name.lower())), None)
+            if rule is None or rule.target in claimed: continue
+            claimed[rule.target] = i; names[i] = rule.target
+            if rule.normalize is not None and rule.normalize not in normalizers[i]: normalizers[i].append(rule.normalize)
+        used = set(claimed); counts = {}; claimers = set(claimed.values())
+        for i, base in enumerate(names):
+            if i in claimers: continue
+            name = base
+            while name in used: counts[base] = counts.get(base, 0) + 1; name = f"{base}_{counts[base]}"
+            used.add(name); names[i] = name
+        extra = tuple((name, pos) for name, pos in self.positional.items() if pos < len(names))
+        plan = ColumnPlan(tuple(names), tuple(tuple(n) for n in normalizers), extra)
+        with self._lock:
+            if len(self._plans) >= MAX_CACHED_PLANS: self._plans.clear()
+            self._plans[key] = plan
+        return plan
+
+    def pick(self, plan, columns):
+        # [(ชื่อ, ตำแหน่งใน header)] ของคอลัมน์ที่ต้องการ คอลัมน์ตามตำแหน่งมาก่อนชื่อ
+        extra = dict(plan.extra); picked = []
+        for col in columns:
+            if col in extra: picked.append((col, extra[col]))
+            elif col in plan.names: picked.append((col, plan.names.index(col)))
+        return picked
+
+    def frame(self, plan, rows, picked=None):
+        """picked=None: rows มีครบทุกคอลัมน์ตาม header (get_all_values)"""
+        if picked is None:
+            df = pd.DataFrame(rows, columns=list(plan.names)); positions = list(enumerate(plan.names))
+        else:
+            df = pd.DataFrame(rows, columns=[name for name, _ in picked]); positions = [(pos, name) for name, pos in picked]
+        for pos, name in positions:
+            for fn in plan.normalizers[pos]: df[name] = fn(df[name])
+        if picked is None:
+            for name, pos in plan.extra: df[name] = df.iloc[:, pos]
+        return df
+
+    def read_frame(self, worksheet, cache_key, columns=None, priority=PRIORITY_INTERACTIVE):
+        """อ่าน Tab เป็น DataFrame ที่ตั้งชื่อคอลัมน์แล้ว ระบุ columns = ดึงเฉพาะคอลัมน์นั้นด้วย batch_get ครั้งเดียว"""
+        if columns:
+            plans = []
+            def select(header):
+                plans.append(self.plan(header)); return self.pick(plans[-1], columns)
+            _, rows = read_projected(worksheet, cache_key, select, priority)
+            if not rows: return pd.DataFrame()
+            return self.frame(plans[-1], rows, self.pick(plans[-1], columns))
+        rows = sheets_call(worksheet.get_all_values, priority=priority)
+        if len(rows) < 2: return pd.DataFrame()
+        return self.frame(self.plan(rows[0]), rows[1:])
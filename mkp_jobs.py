@@ -0,0 +1,219 @@
+import io
+from datetime import datetime
+
+from mkp_backend import worksheet_not_found_type, FOLDER_MIME
+from mkp_catalog import sheet_cache
+from mkp_columns import ColumnMap, ColumnRule, strip_float_suffix
+from mkp_metrics import timed
+from mkp_models import SavedOrders
+from mkp_offline import BackendUnavailable, drive_call, drive_breaker, sheets_breaker, is_outage, get_outbox, get_upload_spool, run_in_background, record_background_error
+from mkp_photo import photo_digest, get_upload_index
+from mkp_sheets import sheets_call, get_log_writer, wait_for_writes, PRIORITY_INTERACTIVE, PRIORITY_WRITE
+
+# --- CONFIGURATION ---
+LOG_HEADER = ["Timestamp", "Picker Name", "Order ID", "Barcode", "Product Name", "Location", "Pick Qty", "User", "Image Link (Col I)"]
+RIDER_LOG_HEADER = ["Timestamp", "User Name", "Order ID", "License Plate", "Folder Name", "Rider Image Link"]
+# Order_Data (Sheet ตรวจ Order) ของแอปแพ็ค 2 ตัว ใช้ร่วมกับ tools/ ให้วัด/replay ด้วยกฎเดียวกับแอป
+ORDER_DATA_SCHEMA = {'Tracking': 'str', 'Barcode': 'category', 'Product Name': 'category', 'Location': 'category', 'Qty': 'int', 'Zone': 'category'}   # คอลัมน์ที่แอปใช้จริง
+ORDER_DATA_INDEX = ('Tracking',)   # Order_Data เก็บแบบ map จากไฟล์ ค้นด้วย index แทนการ scan ทั้งตาราง
+# ตั้งชื่อคอลัมน์มาตรฐาน: คอลัมน์แรกที่ตรงกฎได้ชื่อนั้น คอลัมน์ถัดไปที่ตรงกฎเดียวกันคงชื่อเดิม
+SHEET_COLUMNS = ColumnMap([
+    ColumnRule('Tracking', contains=('tracking', ('order', 'id'))),
+    ColumnRule('Barcode', contains=('barcode',), normalize=strip_float_suffix),
+    ColumnRule('Product Name', contains=('product name',), equals=('Name',)),
+    ColumnRule('Qty', contains=('qty', 'quantity')),
+])
+# Tab สินค้า (Tab แรกของ Sheet) ของแอป tracking ค้นด้วย Barcode
+ITEM_SCHEMA = {'Barcode': 'str', 'Brand': 'category', 'Variant': 'category', 'Zone': 'category', 'Location': 'category'}   # คอลัมน์ที่แอปใช้จริง
+ITEM_INDEX = ('Barcode',)
+# ตั้งชื่อคอลัมน์มาตรฐาน + ตัด ".0" ท้ายรหัส (คอลัมน์ที่ชื่อมี barcode / id)
+ITEM_COLUMN_RULES = (
+    ColumnRule('Barcode', equals=('barcode',)),
+    ColumnRule(None, contains=('barcode', 'id'), normalize=strip_float_suffix),
+)
+ITEM_COLUMNS = ColumnMap(ITEM_COLUMN_RULES, positional={'Brand': 3, 'Variant': 5})   # ชื่อสินค้า = คอลัมน์ที่ 4 + 6 ตามตำแหน่ง
+RIDER_LOG_COLUMNS = ColumnMap([ColumnRule('Order ID', contains=(('order', 'id'),))])
+RIDER_HISTORY_TTL_SECONDS = 30   # ประวัติ Rider ใช้เช็ค Order ซ้ำ ต้องสดกว่า Tab อื่น
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+PACK_PHOTO_NAME = "{order}_PACKED_{ts}_{n}.jpg"
+JOB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"   # job['timestamp'] (เวลาไทยตอนกดยืนยัน)
+
+def job_time(job): return datetime.strptime(job['timestamp'], JOB_TIME_FORMAT)
+def normalize_order_id(order_id): return str(order_id).strip().upper()
+def drive_links(file_ids): return "\n".join(f"https://drive.google.com/open?id={fid}" for fid in (file_ids if isinstance(file_ids, list) else [file_ids]))
+
+# --- DRIVE FOLDERS (ปี / เดือน / วันที่ ใต้ Folder หลัก) ---
+def get_or_create_folder(service, parent_id, name):
+    q = f"name = '{name}' and '{parent_id}' in parents and mimeType = '{FOLDER_MIME}' and trashed = false"
+    files = drive_call(service.files().list(q=q, fields="files(id)")).get('files', [])
+    if files: return files[0]['id']
+    return drive_call(service.files().create(body={'name': name, 'parents': [parent_id], 'mimeType': FOLDER_MIME}, fields='id')).get('id')
+
+def month_folder(service, root_id, when):
+    return get_or_create_folder(service, get_or_create_folder(service, root_id, when.strftime("%Y")), when.strftime("%m"))
+
+@timed("drive_folder")
+def pack_folder(service, root_id, order_id, when):
+    # Folder ต่อ Order: <ปี>/<เดือน>/<วัน-เดือน-ปี>/<Order>_<ชั่วโมง-นาที> (when = เวลาที่ยืนยันงาน ส่งซ้ำได้ Folder เดิม)
+    date_id = get_or_create_folder(service, month_folder(service, root_id, when), when.strftime("%d-%m-%Y"))
+    return get_or_create_folder(service, date_id, f"{order_id}_{when.strftime('%H-%M')}")
+
+@timed("drive_folder")
+def rider_folder(service, root_id, when):
+    folder_name = f"Rider_{when.strftime('%d-%m-%Y')}"
+    return get_or_create_folder(service, month_folder(service, root_id, when), folder_name), folder_name
+
+@timed("upload_photo")
+def upload_photo(service, img_bytes, filename, folder_id, chunksize=UPLOAD_CHUNK_BYTES):
+    from googleapiclient.http import MediaIoBaseUpload
+    # รูปเดิมที่เคยขึ้น Folder นี้แล้ว (ส่งซ้ำจากคิว / กดยืนยันซ้ำ) ใช้ File ID เดิม ไม่อัปโหลดซ้ำ
+    digest = photo_digest(img_bytes); existing_id = get_upload_index().get(folder_id, digest)
+    if existing_id: return existing_id
+    media = MediaIoBaseUpload(io.BytesIO(img_bytes), mimetype='image/jpeg', chunksize=chunksize, resumable=True)
+    file_id = drive_call(service.files().create(body={'name': filename, 'parents': [folder_id]}, media_body=media, fields='id')).get('id')
+    get_upload_index().put(folder_id, digest, file_id); return file_id
+
+# --- WORKSPACE (Sheet Log / Folder รูปของแอป 1 ตัว ใช้ร่วมกันทั้ง 3 แอป และ tools/loadtest.py ไม่มีส่วน Streamlit) ---
+class Workspace:
+    def __init__(self, log_sheet_id, main_folder_id, sheets, drive, log_tab='Logs', rider_tab='Rider_Logs',
+                 pack_photo_name=PACK_PHOTO_NAME, last_pack_link_only=False, chunksize=UPLOAD_CHUNK_BYTES):
+        # sheets() / drive() คืน client ที่ login แล้ว (None = ไม่มี credentials)
+        # last_pack_link_only: Log แพ็คเก็บ Link รูปสุดท้ายรูปเดียว (แอป tracking)
+        self.log_sheet_id = log_sheet_id; self.main_folder_id = main_folder_id; self.sheets = sheets; self.drive = drive
+        self.log_tab = log_tab; self.rider_tab = rider_tab
+        self.pack_photo_name = pack_photo_name; self.last_pack_link_only = last_pack_link_only; self.chunksize = chunksize
+        self._history_cache = None   # (list ใน cache, frozenset ของ list นั้น)
+        self.rider_history_missing = False   # โหลดประวัติ Rider ครั้งล่าสุดไม่ได้และไม่มี snapshot (แอปแสดงคู่กับป้าย OFFLINE)
+        self.log_writer = get_log_writer(self.write_rows)   # สร้างครั้งเดียวพร้อม Workspace (แอปเก็บ Workspace ไว้ข้าม rerun)
+
+    def _client(self):
+        gc = self.sheets()
+        if gc is None: raise RuntimeError("ไม่มี credentials สำหรับ Google Sheets")
+        return gc
+
+    # --- LOOKUP ---
+    def fetch_frame(self, spreadsheet_key, sheet_name, column_map, columns=None, priority=PRIORITY_INTERACTIVE):
+        # raise ออกไปตรงๆ เพื่อไม่ให้ cache เก็บ DataFrame ว่างตอน Google ล่ม
+        sh = sheets_call(self._client().open_by_key, spreadsheet_key, priority=priority)
+        if isinstance(sheet_name, int): worksheet = sheets_call(sh.get_worksheet, sheet_name, priority=priority)
+        else: worksheet = sheets_call(sh.worksheet, sheet_name, priority=priority)
+        # ระบุ columns = ดึงเฉพาะคอลัมน์ที่ใช้ (batch_get ครั้งเดียว) แทนการโหลดทั้ง Tab
+        return column_map.read_frame(worksheet, (spreadsheet_key, sheet_name), columns, priority)
+
+    def load_frame(self, spreadsheet_key, sheet_name, loader, index=None, schema=None):
+        # cache แยกต่อ Tab (ไม่ cache ค่า error) Google ล่ม/ช้า: ใช้ข้อมูลชุดล่าสุดที่โหลดสำเร็จแทน ไม่มีเลยค่อย raise
+        try: return sheet_cache.get(spreadsheet_key, sheet_name, loader, index=index, schema=schema)
+        except worksheet_not_found_type(): raise
+        except Exception:
+            snap = sheet_cache.peek(spreadsheet_key, sheet_name)
+            if snap is None: raise
+            return snap[0]
+
+    def fetch_rider_history(self, priority=PRIORITY_INTERACTIVE):
+        sh = sheets_call(self._client().open_by_key, self.log_sheet_id, priority=priority)
+        try: worksheet = sheets_call(sh.worksheet, self.rider_tab, priority=priority)
+        except worksheet_not_found_type(): return []
+        # ใช้แค่คอลัมน์ Order ID ไม่ต้องโหลดทั้ง Tab
+        df = RIDER_LOG_COLUMNS.read_frame(worksheet, (self.log_sheet_id, self.rider_tab), ['Order ID'], priority)
+        return df['Order ID'].astype(str).str.strip().str.upper().tolist() if 'Order ID' in df.columns else []
+
+    def warm_rider_history(self):
+        sheet_cache.warm(self.log_sheet_id, self.rider_tab, self.fetch_rider_history, ttl=RIDER_HISTORY_TTL_SECONDS)
+
+    def pending_rider_orders(self):
+        # Order ที่ยังค้างในคิว offline (ยังไม่ขึ้น Sheet) ต้องนับว่าบันทึกแล้วด้วย (ทุกคิวอยู่ในหน่วยความจำ ไม่อ่าน disk)
+        rows = get_outbox().pending(self.log_sheet_id, self.rider_tab) + self.log_writer.pending(self.log_sheet_id, self.rider_tab)
+        pending = {normalize_order_id(row[2]) for row in rows}
+        for job in get_upload_spool().jobs():
+            if job.get('kind') == 'rider': pending.update(normalize_order_id(o) for o in job['orders'])
+        return pending
+
+    def _history_set(self, history):
+        # frozenset ผูกกับ list ใน cache ตัวนั้น สร้างใหม่เฉพาะตอน cache เปลี่ยน (refresh / update) ไม่ใช่ทุกครั้งที่สแกน
+        cached = self._history_cache
+        if cached is not None and cached[0] is history: return cached[1]
+        orders = frozenset(history); self._history_cache = (history, orders)
+        return orders
+
+    @timed("load_rider_history")
+    def load_rider_history(self):
+        try: history = sheet_cache.get(self.log_sheet_id, self.rider_tab, self.fetch_rider_history, ttl=RIDER_HISTORY_TTL_SECONDS)
+        except Exception:
+            snap = sheet_cache.peek(self.log_sheet_id, self.rider_tab)
+            # ไม่มีประวัติเลย: ห้ามถือว่าทุก Order ใหม่ verify_rider_scan จะไม่ให้เพิ่มเข้าตู้
+            self.rider_history_missing = snap is None
+            if snap is None: return SavedOrders(pending=self.pending_rider_orders(), available=False)
+            history = snap[0]
+        else: self.rider_history_missing = False
+        return SavedOrders(self._history_set(history), self.pending_rider_orders())
+
+    # --- SAVE LOGS ---
+    @timed("append_rows")
+    def write_rows(self, spreadsheet_key, tab, rows, header=None):
+        sh = sheets_call(self._client().open_by_key, spreadsheet_key, priority=PRIORITY_WRITE)
+        try: worksheet = sheets_call(sh.worksheet, tab, priority=PRIORITY_WRITE)
+        except worksheet_not_found_type():
+            worksheet = sheets_call(sh.add_worksheet, title=tab, rows="1000", cols="20", priority=PRIORITY_WRITE)
+            if header: sheets_call(worksheet.append_row, header, priority=PRIORITY_WRITE)
+        sheets_call(worksheet.append_rows, rows, priority=PRIORITY_WRITE)
+
+    def save_pack_log(self, job, item, file_ids):
+        row = [job['timestamp'], job['user_name'], job['order_val'], item['Barcode'], item['Product Name'], item['Location'], item.get('Qty', '1'), job['user_id'], drive_links(file_ids)]
+        return self.log_writer.submit(self.log_sheet_id, self.log_tab, row, LOG_HEADER)
+
+    def save_rider_log(self, job, order_id, file_ids, folder_name):
+        row = [job['timestamp'], job['user_name'], order_id, job['license_plate'], folder_name, drive_links(file_ids)]
+        return self.log_writer.submit(self.log_sheet_id, self.rider_tab, row, RIDER_LOG_HEADER)
+
+    # --- UPLOAD JOBS (Drive ล่ม: เก็บงานเข้าคิว แล้วอัปโหลดให้อัตโนมัติเมื่อกลับมาออนไลน์) ---
+    def job_folder(self, service, job):
+        # Folder ปลายทางตามวันเวลาที่ยืนยันงาน (ไม่ใช่เวลาที่ส่งจากคิว) สร้างแล้วจำ ID ไว้ในงาน ส่งซ้ำ/ค้างครึ่งทาง รูปยังลง Folder เดิม
+        if not job.get('folder_id'):
+            if job['kind'] == 'pack': job['folder_id'], job['folder_name'] = pack_folder(service, self.main_folder_id, job['order_val'], job_time(job)), None
+            else: job['folder_id'], job['folder_name'] = rider_folder(service, self.main_folder_id, job_time(job))
+        return job['folder_id'], job['folder_name']
+
+    def run_job(self, service, job, images):
+        """อัปโหลดรูป + เขียน Log ของงาน 1 ชิ้น คืนค่า (errors, จำนวนแถวที่ยังเขียนไม่เสร็จ) ของ Log"""
+        folder_id, folder_name = self.job_folder(service, job)
+        if job['kind'] == 'pack':
+            file_ids = [upload_photo(service, img, self.pack_photo_name.format(order=job['order_val'], ts=job['ts'], n=i + 1), folder_id, self.chunksize) for i, img in enumerate(images)]
+            if self.last_pack_link_only: file_ids = file_ids[-1:] or ["-"]
+            return wait_for_writes([self.save_pack_log(job, item, file_ids) for item in job['items']])
+        file_ids = [upload_photo(service, img, f"{job['lp_clean']}_{job['ts']}_{i + 1}.jpg", folder_id, self.chunksize) for i, img in enumerate(images)]
+        errors, waiting = wait_for_writes([self.save_rider_log(job, order_id, file_ids, folder_name) for order_id in job['orders']])
+        # เพิ่ม Order ที่เพิ่งบันทึกเข้า cache เลย ไม่ต้องโหลด Rider_Logs ใหม่ทั้ง Tab
+        if not errors and not waiting: sheet_cache.update(self.log_sheet_id, self.rider_tab, lambda h: h + [normalize_order_id(o) for o in job['orders']])
+        return errors, waiting
+
+    def submit_job(self, job, images):
+        """คืนค่า (uploaded, errors, waiting): uploaded=False คือเก็บเข้าคิว offline"""
+        if not drive_breaker.is_open:
+            try:
+                srv = self.drive()
+                if srv:
+                    errors, waiting = self.run_job(srv, job, images); return True, errors, waiting
+            except Exception as e:
+                if not is_outage(e): raise
+        get_upload_spool().add(job, images); return False, [], 0
+
+    def drain_spool(self):
+        spool = get_upload_spool(); srv = self.drive()
+        # ไม่มี credentials / สร้าง service ไม่ได้: ทุกงานไม่ผ่านเหมือนกัน บันทึกครั้งเดียวแล้วรอรอบหน้า
+        if srv is None: record_background_error('upload_spool', BackendUnavailable("Google Drive service ไม่พร้อม (ไม่มี credentials)")); return
+        for job_id in spool.job_ids():
+            job, images = spool.load(job_id); folder_id = job.get('folder_id')
+            try: self.run_job(srv, job, images)
+            except Exception as e:
+                # จำ Folder ที่สร้างแล้วไว้ในงาน รอบหน้าอัปโหลดต่อใน Folder เดิม
+                if job.get('folder_id') != folder_id: spool.update(job_id, job)
+                # งานเสียงานเดียว (เช่น Folder ถูกลบ) ไม่ขวางงานถัดไป แต่ถ้า Drive ล่ม งานถัดไปก็ไม่ผ่าน หยุดรอรอบหน้า
+                record_background_error('upload_spool', e)
+                if is_outage(e): break
+                continue
+            spool.done(job_id)
+
+    def resume_queues(self):
+        outbox = get_outbox(); spool = get_upload_spool()
+        if len(outbox) and not sheets_breaker.is_open: run_in_background('outbox', lambda: outbox.drain(self.write_rows))
+        if len(spool) and not drive_breaker.is_open: run_in_background('upload_spool', self.drain_spool)
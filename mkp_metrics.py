@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mkp_storage import data_path
+
+# --- CONFIGURATION ---
+METRICS_WINDOW = 500   # เก็บเวลาล่าสุดกี่ครั้งต่อ op
+# histogram สะสมทั้ง process แยกตาม op + user (ขอบบนของแต่ละช่อง หน่วยวินาที)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# export: ไฟล์ JSON เขียนทุก METRICS_FLUSH_SECONDS / Prometheus endpoint เปิดเมื่อกำหนด MKP_METRICS_PORT
+METRICS_FILE = os.environ.get("MKP_METRICS_FILE", "")
+METRICS_PORT = int(os.environ.get("MKP_METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("MKP_METRICS_HOST", "127.0.0.1")
+METRICS_FLUSH_SECONDS = 15
+
+_samples = {}
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+_context = threading.local()
+
+# --- USER / STATION ---
+# ตั้งต่อ thread ที่รันสคริปต์ของแต่ละ session (thread เบื้องหลังไม่มี user)
+def set_user(user):
+    _context.user = str(user or "")
+
+def current_user():
+    return getattr(_context, 'user', "")
+
+# --- RECORDING ---
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1); self.total = 0.0; self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1; self.total += seconds; self.count += 1
+
+    def cumulative(self):
+        out = []; running = 0
+        for n in self.counts: running += n; out.append(running)
+        return out
+
+def record(op, seconds, user=None):
+    user = current_user() if user is None else str(user)
+    with _lock:
+        _samples.setdefault(op, deque(maxlen=METRICS_WINDOW)).append(seconds)
+        hist = _histograms.get((op, user))
+        if hist is None: hist = _histograms[(op, user)] = Histogram()
+        hist.observe(seconds)
+
+def increment(name, amount=1, user=None):
+    key = (name, current_user() if user is None else str(user))
+    with _lock: _counters[key] = _counters.get(key, 0) + amount
+
+@contextmanager
+def timed(op):
+    # ใช้ได้ทั้ง with timed("op"): และ @timed("op") (นับรวมรอบที่จบด้วย st.rerun / st.stop ด้วย)
+    started = time.perf_counter()
+    try: yield
+    finally: record(op, time.perf_counter() - started)
+
+# --- SUMMARY ---
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def summary():
+    with _lock: items = [(op, sorted(values)) for op, values in _samples.items()]
+    return [{'op': op, 'count': len(values), 'p50_ms': round(percentile(values, 0.5) * 1000, 1), 'p95_ms': round(percentile(values, 0.95) * 1000, 1), 'max_ms': round(values[-1] * 1000, 1)}
+            for op, values in sorted(items) if values]
+
+def snapshot():
+    with _lock:
+        ops = [{'op': op, 'user': user, 'count': h.count, 'sum': h.total, 'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'], h.cumulative()))}
+               for (op, user), h in sorted(_histograms.items())]
+        counters = [{'name': name, 'user': user, 'value': value} for (name, user), value in sorted(_counters.items())]
+    return {'generated_at': time.time(), 'pid': os.getpid(), 'ops': ops, 'counters': counters}
+
+# --- EXPORT ---
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text():
+    snap = snapshot(); lines = ["# HELP mkp_op_seconds Latency of app operations and Google calls.", "# TYPE mkp_op_seconds histogram"]
+    for item in snap['ops']:
+        labels = f'op="{_label(item["op"])}",user="{_label(item["user"])}"'
+        for le, n in item['buckets'].items(): lines.append(f'mkp_op_seconds_bucket{{{labels},le="{le}"}} {n}')
+        lines.append(f"mkp_op_seconds_sum{{{labels}}} {item['sum']:.6f}"); lines.append(f"mkp_op_seconds_count{{{labels}}} {item['count']}")
+    lines += ["# HELP mkp_events_total Counted app events.", "# TYPE mkp_events_total counter"]
+    for item in snap['counters']: lines.append(f'mkp_events_total{{name="{_label(item["name"])}",user="{_label(item["user"])}"}} {item["value"]}')
+    return "\n".join(lines) + "\n"
+
+def write_metrics_file(path=None):
+    path = path or METRICS_FILE or data_path("metrics.json"); tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(snapshot(), f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return path
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] == '/metrics': body = prometheus_text().encode("utf-8"); ctype = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path.split('?')[0] == '/metrics.json': body = json.dumps(snapshot(), ensure_ascii=False).encode("utf-8"); ctype = "application/json"
+        else: self.send_error(404); return
+        self.send_response(200); self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(len(body))); self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args): pass
+
+_exporter_started = False
+_exporter_lock = threading.Lock()
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try: write_metrics_file()
+        except OSError: pass
+
+def start_exporter(port=None):
+    """เรียกได้ทุกรอบ: เริ่ม thread เขียนไฟล์ + endpoint ครั้งเดียวต่อ process คืนค่า port ที่เปิด (None = ไม่ได้เปิด)"""
+    global _exporter_started
+    port = METRICS_PORT if port is None else port
+    with _exporter_lock:
+        if _exporter_started: return None
+        _exporter_started = True
+    threading.Thread(target=_flush_loop, name="mkp-metrics-file", daemon=True).start()
+    if not port: return None
+    try: server = ThreadingHTTPServer((METRICS_HOST, port), _MetricsHandler)
+    except OSError: return None   # port ถูกใช้แล้ว (เช่นเปิดหลายแอปบนเครื่องเดียว) ใช้ไฟล์แทน
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mkp-metrics-http", daemon=True).start()
+    return server.server_address[1]
@@ -0,0 +1,140 @@
+from dataclasses import dataclass
+
+import pandas as pd
+
+ITEM_COLUMNS = ['Barcode', 'Product Name', 'Location', 'Qty']
+
+SCAN_ADDED = 'added'
+SCAN_DUPLICATE = 'duplicate'
+SCAN_WRONG = 'wrong'
+
+@dataclass(slots=True, frozen=True)
+class OrderItem:
+    barcode: str
+    name: str = 'Unknown'
+    location: str = '-'
+    qty: int = 1
+
+    @classmethod
+    def from_record(cls, record):
+        # record จาก Order_Data (ต้องมีคอลัมน์ Barcode) สแกนทีละชิ้น Qty = 1 เสมอ
+        return cls(str(record['Barcode']).strip(), str(record.get('Product Name', 'Unknown')), str(record.get('Location', '-')))
+
+    def to_record(self):
+        return {'Barcode': self.barcode, 'Product Name': self.name, 'Location': self.location, 'Qty': self.qty}
+
+def items_frame(items):
+    return pd.DataFrame([item.to_record() for item in items], columns=ITEM_COLUMNS)
+
+# --- PACK SESSION (สินค้าที่ต้องแพ็ค + ที่สแกนแล้วของ Tracking ปัจจุบัน) ---
+class PackSession:
+    __slots__ = ('expected', 'items', '_expected_by_barcode', '_scanned', '_frames')
+
+    def __init__(self):
+        self.expected = []; self.items = []
+        self._expected_by_barcode = {}; self._scanned = set(); self._frames = {}
+
+    def set_expected(self, records):
+        # Barcode ซ้ำใน Order ใช้แถวแรก
+        self.expected = []; self._expected_by_barcode = {}
+        for record in records:
+            item = OrderItem.from_record(record)
+            if item.barcode in self._expected_by_barcode: continue
+            self._expected_by_barcode[item.barcode] = item; self.expected.append(item)
+        self._frames.pop('expected', None)
+
+    def expected_item(self, barcode):
+        return self._expected_by_barcode.get(barcode)
+
+    def add(self, item, unique=True):
+        """คืนค่า False ถ้า unique และ Barcode นี้สแกนไปแล้ว"""
+        if unique and item.barcode in self._scanned: return False
+        self.items.append(item); self._scanned.add(item.barcode); self._frames.pop('items', None)
+        return True
+
+    def __contains__(self, barcode):
+        return barcode in self._scanned
+
+    def __len__(self):
+        return len(self.items)
+
+    def _frame(self, name, items, columns):
+        # สร้าง DataFrame ใหม่เฉพาะตอนรายการเปลี่ยน (ไม่ต้องสร้างทุกรอบที่ render)
+        frames = self._frames.setdefault(name, {})
+        key = tuple(columns or ITEM_COLUMNS)
+        if key not in frames: frames[key] = items_frame(items)[list(key)]
+        return frames[key]
+
+    def frame(self, columns=None):
+        return self._frame('items', self.items, columns)
+
+    def expected_frame(self, columns=None):
+        return self._frame('expected', self.expected, columns)
+
+    def records(self):
+        return [item.to_record() for item in self.items]
+
+def verify_scan(session, barcode):
+    """คืนค่า (SCAN_ADDED | SCAN_DUPLICATE | SCAN_WRONG, OrderItem ที่ตรง หรือ None)"""
+    item = session.expected_item(barcode)
+    if item is None: return SCAN_WRONG, None
+    return (SCAN_ADDED if session.add(item) else SCAN_DUPLICATE), item
+
+# --- RIDER BATCH (Tracking ที่สแกนขึ้นรถในรอบนี้) ---
+class RiderBatch:
+    __slots__ = ('orders', '_ids')
+
+    def __init__(self):
+        self.orders = []; self._ids = set()
+
+    def add(self, order_id):
+        if order_id in self._ids: return False
+        self.orders.append(order_id); self._ids.add(order_id)
+        return True
+
+    def remove_at(self, idx):
+        self._ids.discard(self.orders.pop(idx))
+
+    def __contains__(self, order_id):
+        return order_id in self._ids
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self):
+        return iter(self.orders)
+
+    def ids(self):
+        return list(self.orders)
+
+class SavedOrders:
+    """Order ที่บันทึกแล้ว = ประวัติใน Sheet (frozenset) + ที่ค้างในคิว (set) เช็คด้วย `in` โดยไม่ต้องต่อ list ใหม่ทุกครั้งที่สแกน
+    available=False: โหลดประวัติไม่ได้และไม่มี snapshot (รู้แค่ที่ค้างในคิว) ตรวจซ้ำไม่ได้"""
+    __slots__ = ('history', 'pending', 'available')
+
+    def __init__(self, history=frozenset(), pending=frozenset(), available=True):
+        self.history = history; self.pending = pending; self.available = available
+
+    def __contains__(self, order_id):
+        return order_id in self.history or order_id in self.pending
+
+    def __len__(self):
+        return len(self.history) + len(self.pending - self.history)
+
+RIDER_ADDED = 'added'
+RIDER_UNKNOWN = 'not_found'
+RIDER_DUPLICATE = 'duplicate'
+RIDER_SAVED = 'saved'
+RIDER_NO_HISTORY = 'no_history'
+
+def verify_rider_scan(batch, order_id, history, known=None):
+    """คืนค่า RIDER_ADDED (เพิ่มเข้า batch แล้ว) | RIDER_UNKNOWN | RIDER_DUPLICATE | RIDER_SAVED | RIDER_NO_HISTORY
+    history: ฟังก์ชันคืน Order ที่เคยบันทึกแล้ว เช่น SavedOrders (เรียกเฉพาะตอนต้องเช็ค), known: ฟังก์ชันเช็คว่ามี Tracking ใน Order_Data (None = ไม่เช็ค)
+    ประวัติโหลดไม่ได้ (SavedOrders.available=False) ไม่เพิ่มเข้า batch: ไม่รู้ว่าเคยบันทึกแล้วหรือยัง"""
+    if known is not None and not known(order_id): return RIDER_UNKNOWN
+    if order_id in batch: return RIDER_DUPLICATE
+    saved = history()
+    if order_id in saved: return RIDER_SAVED
+    if not getattr(saved, 'available', True): return RIDER_NO_HISTORY
+    batch.add(order_id)
+    return RIDER_ADDED
@@ -0,0 +1,239 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from mkp_storage import data_dir, data_path
+from mkp_metrics import timed, increment
+
+# --- CONFIGURATION ---
+BREAKER_FAILURE_THRESHOLD = 3      # ล้มเหลวติดกันกี่ครั้งถึงตัดวงจร
+BREAKER_COOLDOWN_SECONDS = 60      # ตัดวงจรแล้วพักกี่วินาทีก่อนลองใหม่
+DRIVE_NUM_RETRIES = 2
+# สร้าง Folder / File ซ้ำไม่ได้ผลเดิม (timeout หลัง Drive สร้างไปแล้ว retry = Folder/รูปซ้ำ) ไม่ retry ให้คิว offline ส่งใหม่แทน
+NON_IDEMPOTENT_DRIVE_METHODS = {'drive.files.create', 'drive.files.copy'}
+
+class BackendUnavailable(Exception):
+    pass
+
+def is_outage(exc):
+    # ตัดวงจรเฉพาะ error ที่แปลว่าระบบ Google มีปัญหา (ไม่นับ 404 / permission / 429 ที่แค่โดนจำกัด quota)
+    from mkp_sheets import error_status, is_retryable
+    return isinstance(exc, BackendUnavailable) or (is_retryable(exc) and error_status(exc) != 429)
+
+# --- CIRCUIT BREAKER ---
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.name = name; self.failure_threshold = failure_threshold; self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = 'closed'; self._failures = 0; self._opened_at = 0.0; self._trial_running = False
+        self.last_error = ""
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == 'open' and time.monotonic() - self._opened_at >= self.cooldown: return 'half_open'
+            return self._state
+
+    @property
+    def is_open(self):
+        return self.state == 'open'
+
+    def retry_in(self):
+        with self._lock:
+            if self._state != 'open': return 0
+            return max(0, int(self.cooldown - (time.monotonic() - self._opened_at)))
+
+    def allow(self):
+        with self._lock:
+            if self._state == 'closed': return True
+            if self._state == 'open' and time.monotonic() - self._opened_at < self.cooldown: return False
+            # ครบเวลาพักแล้ว ปล่อยให้ลองได้ทีละ 1 request (half-open)
+            if self._trial_running: return False
+            self._state = 'half_open'; self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'; self._failures = 0; self._trial_running = False; self.last_error = ""
+
+    def record_failure(self, exc=None):
+        with self._lock:
+            self._failures += 1; self._trial_running = False
+            if exc is not None: self.last_error = str(exc)[:200]
+            if self._state == 'half_open' or self._failures >= self.failure_threshold:
+                self._state = 'open'; self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        # trial จบโดยไม่รู้ผล (error ที่ไม่ใช่ล่ม / ถูกขัดด้วย st.rerun, st.stop) ให้ request ถัดไปลองแทน
+        with self._lock: self._trial_running = False
+
+    def guard(self):
+        if not self.allow(): raise BackendUnavailable(f"{self.name} offline (ลองใหม่ใน {self.retry_in()} วินาที)")
+
+    def record(self, exc):
+        # error ที่ไม่ใช่ล่ม (429 / 404 / permission) ไม่บอกอะไรเรื่องสถานะระบบ: ไม่เปิด/ปิดวงจร ไม่ล้างจำนวนครั้งที่ล้มเหลว
+        if is_outage(exc): self.record_failure(exc)
+        else: self.release_trial()
+
+    def call(self, fn, *args, **kwargs):
+        self.guard()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self.record(e); raise
+        except BaseException:
+            self.release_trial(); raise
+        self.record_success()
+        return result
+
+sheets_breaker = CircuitBreaker("Google Sheets")
+drive_breaker = CircuitBreaker("Google Drive")
+
+def is_offline():
+    return sheets_breaker.is_open or drive_breaker.is_open
+
+def drive_call(request, idempotent=None):
+    # methodId เช่น drive.files.create ใช้แยกเวลาต่อชนิด request
+    method = getattr(request, 'methodId', None) or "drive.request"
+    if idempotent is None: idempotent = method not in NON_IDEMPOTENT_DRIVE_METHODS
+    with timed(method): return drive_breaker.call(request.execute, num_retries=DRIVE_NUM_RETRIES if idempotent else 0)
+
+# --- WRITE OUTBOX (แถว Log ที่ยังเขียนลง Sheet ไม่สำเร็จ) ---
+class WriteOutbox:
+    def __init__(self, path):
+        self.path = path; self._lock = threading.Lock(); self._rows = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f: self._rows = [json.loads(line) for line in f if line.strip()]
+
+    def _save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for r in self._rows: f.write(json.dumps(r, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def add(self, spreadsheet_key, tab, row, header=None):
+        with self._lock:
+            self._rows.append({'key': spreadsheet_key, 'tab': tab, 'row': row, 'header': header, 'queued_at': time.time()})
+            self._save()
+
+    def pending(self, spreadsheet_key=None, tab=None):
+        with self._lock:
+            return [r['row'] for r in self._rows if (spreadsheet_key is None or r['key'] == spreadsheet_key) and (tab is None or r['tab'] == tab)]
+
+    def __len__(self):
+        with self._lock: return len(self._rows)
+
+    def drain(self, write_rows):
+        # write_rows(spreadsheet_key, tab, rows, header) ต้อง raise ถ้าเขียนไม่สำเร็จ
+        with self._lock: batch = list(self._rows)
+        groups = {}
+        for r in batch: groups.setdefault((r['key'], r['tab']), []).append(r)
+        for (key, tab), items in groups.items():
+            try: write_rows(key, tab, [r['row'] for r in items], items[0].get('header'))
+            except Exception as e:
+                # Tab นี้เขียนไม่ได้ (เช่นไม่มีสิทธิ์) ไม่ให้ขวาง Tab อื่น แต่ถ้าระบบล่ม Tab ถัดไปก็ไม่ผ่าน หยุดรอรอบหน้า
+                record_background_error('outbox', e)
+                if is_outage(e): break
+                continue
+            with self._lock:
+                done = set(map(id, items)); self._rows = [r for r in self._rows if id(r) not in done]; self._save()
+
+# --- UPLOAD SPOOL (รูป + ข้อมูล Log ที่รออัปโหลดขึ้น Drive) ---
+class UploadSpool:
+    def __init__(self, root):
+        self.root = root; self._lock = threading.Lock()
+        self._jobs = None   # job_id -> ข้อมูลงาน (ไม่รวมรูป) อ่านจาก disk ครั้งแรกครั้งเดียว ไม่ต้องเปิด job.json ทุกครั้งที่เช็ค
+
+    def _index(self):
+        if self._jobs is None:
+            self._jobs = {}
+            for job_id in sorted(d for d in os.listdir(self.root) if not d.startswith(".")):
+                with open(os.path.join(self.root, job_id, "job.json"), encoding="utf-8") as f: self._jobs[job_id] = json.load(f)
+        return self._jobs
+
+    def _write_job(self, job_dir, job):
+        tmp = os.path.join(job_dir, "job.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f: json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(job_dir, "job.json"))
+
+    def add(self, job, images):
+        job_id = f"{time.strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        tmp_dir = os.path.join(self.root, f".{job_id}"); os.makedirs(tmp_dir)
+        for i, img in enumerate(images):
+            with open(os.path.join(tmp_dir, f"{i:02d}.jpg"), "wb") as f: f.write(img)
+        self._write_job(tmp_dir, job)
+        with self._lock:
+            os.replace(tmp_dir, os.path.join(self.root, job_id)); self._index()[job_id] = json.loads(json.dumps(job))
+        return job_id
+
+    def job_ids(self):
+        with self._lock: return sorted(self._index())
+
+    def jobs(self):
+        with self._lock: return list(self._index().values())
+
+    def __len__(self):
+        with self._lock: return len(self._index())
+
+    def load(self, job_id, with_images=True):
+        job_dir = os.path.join(self.root, job_id)
+        with open(os.path.join(job_dir, "job.json"), encoding="utf-8") as f: job = json.load(f)
+        images = []
+        if not with_images: return job, images
+        for name in sorted(n for n in os.listdir(job_dir) if n.endswith(".jpg")):
+            with open(os.path.join(job_dir, name), "rb") as f: images.append(f.read())
+        return job, images
+
+    def update(self, job_id, job):
+        # บันทึกความคืบหน้าของงาน (เช่น Folder ปลายทางที่สร้างแล้ว) ไว้ใช้ตอนส่งซ้ำ
+        with self._lock:
+            self._write_job(os.path.join(self.root, job_id), job); self._index()[job_id] = json.loads(json.dumps(job))
+
+    def done(self, job_id):
+        shutil.rmtree(os.path.join(self.root, job_id), ignore_errors=True)
+        with self._lock: self._index().pop(job_id, None)
+
+_outbox = None
+_spool = None
+_queues_lock = threading.Lock()
+
+def get_outbox():
+    global _outbox
+    with _queues_lock:
+        if _outbox is None: _outbox = WriteOutbox(data_path("outbox.jsonl"))
+        return _outbox
+
+def get_upload_spool():
+    global _spool
+    with _queues_lock:
+        if _spool is None: _spool = UploadSpool(data_dir("pending_uploads"))
+        return _spool
+
+# --- BACKGROUND DRAIN ---
+_running = set()
+_running_lock = threading.Lock()
+_errors = {}   # ชื่องาน -> (เวลา, ข้อความ) error ล่าสุดของงานเบื้องหลัง (thread เบื้องหลังแสดง st.warning ไม่ได้ ให้หน้า Performance อ่านแทน)
+
+def record_background_error(name, exc):
+    increment(f"background_error:{name}", user="")
+    with _running_lock: _errors[name] = (time.time(), f"{type(exc).__name__}: {exc}"[:200])
+
+def background_errors():
+    with _running_lock: return dict(_errors)
+
+def run_in_background(name, fn):
+    # งานชื่อเดียวกันรันได้ทีละ 1 thread ต่อ process
+    with _running_lock:
+        if name in _running: return False
+        _running.add(name)
+    def _target():
+        with _running_lock: _errors.pop(name, None)   # แสดงเฉพาะ error ของรอบล่าสุด
+        try: fn()
+        except Exception as e: record_background_error(name, e)
+        finally:
+            with _running_lock: _running.discard(name)
+    threading.Thread(target=_target, name=f"mkp-{name}", daemon=True).start()
+    return True
@@ -0,0 +1,80 @@
+import io
+import os
+import resource
+import sys
+import threading
+import time
+
+from mkp_catalog import sheet_cache
+from mkp_metrics import summary
+from mkp_offline import sheets_breaker, drive_breaker, get_outbox, get_upload_spool, background_errors
+from mkp_sheets import governor, log_writer_stats
+
+# --- CONFIGURATION ---
+SESSION_IDLE_SECONDS = 600      # session ที่ไม่มีการใช้งานเกินนี้ไม่นับว่า active
+GOOGLE_P95_WARN_MS = 2000       # p95 ของ Google call เกินนี้แสดงคำเตือนบนหน้า Performance
+CACHE_AGE_WARN_FACTOR = 2       # snapshot เก่ากว่า TTL กี่เท่าถึงเตือน
+SESSION_SIZE_INTERVAL_SECONDS = 30   # วัดขนาด session ใหม่ไม่เกิน 1 ครั้งต่อช่วงนี้ (ไล่ทั้ง session state แพง ไม่ทำทุกรอบสแกน)
+
+# --- ACTIVE SESSIONS (บันทึกทุกครั้งที่สคริปต์รันจบ) ---
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def estimate_bytes(obj, _depth=0):
+    # ประมาณขนาดข้อมูลใน session (รูปใน gallery เป็นส่วนใหญ่) ไม่ต้องแม่นระดับ byte
+    if isinstance(obj, (bytes, bytearray, str)): return len(obj)
+    if isinstance(obj, io.BytesIO): return obj.getbuffer().nbytes
+    if hasattr(obj, 'memory_usage'):
+        try: return int(obj.memory_usage(deep=True).sum())
+        except Exception: pass
+    if _depth < 4:
+        if isinstance(obj, dict): return sum(estimate_bytes(v, _depth + 1) for v in obj.values())
+        if isinstance(obj, (list, tuple, set, frozenset)): return sum(estimate_bytes(v, _depth + 1) for v in obj)
+        slots = getattr(type(obj), '__slots__', None)
+        if slots: return sum(estimate_bytes(getattr(obj, name, None), _depth + 1) for name in slots)
+    return sys.getsizeof(obj)
+
+def touch_session(session_id, user, state):
+    """state: ฟังก์ชันคืน session state (เช่น st.session_state.to_dict) เรียกเฉพาะรอบที่ถึงเวลาวัดขนาดใหม่"""
+    if not session_id: return
+    now = time.time()
+    with _sessions_lock:
+        s = _sessions.get(session_id)
+        if s is not None and now - s['measured_at'] < SESSION_SIZE_INTERVAL_SECONDS:
+            s['user'] = user or ""; s['last_seen'] = now; return
+    size = estimate_bytes(state())
+    with _sessions_lock: _sessions[session_id] = {'user': user or "", 'last_seen': now, 'bytes': size, 'measured_at': now}
+
+def active_sessions():
+    now = time.time()
+    with _sessions_lock:
+        for sid in [sid for sid, s in _sessions.items() if now - s['last_seen'] > SESSION_IDLE_SECONDS]: del _sessions[sid]
+        return [{'session': sid[:8], 'user': s['user'], 'idle_seconds': round(now - s['last_seen'], 1), 'state_mb': round(s['bytes'] / 1e6, 2)}
+                for sid, s in sorted(_sessions.items(), key=lambda item: -item[1]['last_seen'])]
+
+def process_memory_bytes():
+    # RSS ปัจจุบันจาก /proc (Linux) ถ้าไม่มีใช้ค่าสูงสุดจาก getrusage แทน
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError): return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+# --- SNAPSHOT สำหรับหน้า Performance ---
+def ops_snapshot(tabs=None):
+    """tabs: ชื่อ Tab ที่จะแสดงในตาราง Cache (None = ทุก Tab)"""
+    timings = summary()
+    google = [t for t in timings if t['op'].startswith(('sheets.', 'drive.'))]
+    stages = [t for t in timings if not t['op'].startswith(('sheets.', 'drive.'))]
+    cache = [{key: c[key] for key in ('tab', 'age_seconds', 'ttl_seconds', 'stale', 'hit_rate', 'hits', 'misses', 'rows', 'refreshes', 'failures', 'last_error')}
+             for c in sheet_cache.stats() if tabs is None or c['tab'] in tabs]
+    writer = log_writer_stats()
+    queues = {'upload_jobs': len(get_upload_spool()), 'outbox_rows': len(get_outbox()), 'log_writer_pending': writer['pending']}
+    breakers = [{'service': b.name, 'state': b.state, 'retry_in': b.retry_in(), 'last_error': b.last_error} for b in (sheets_breaker, drive_breaker)]
+    sessions = active_sessions()
+    warnings = [f"{b['service']} ตัดวงจรอยู่ (ลองใหม่ใน {b['retry_in']} วินาที)" for b in breakers if b['state'] == 'open']
+    warnings += [f"{t['op']} p95 {t['p95_ms']:.0f} ms" for t in google if t['p95_ms'] >= GOOGLE_P95_WARN_MS]
+    warnings += [f"Cache {c['tab']} ไม่ได้อัปเดต {c['age_seconds']:.0f} วินาที" for c in cache if c['age_seconds'] is not None and c['age_seconds'] >= c['ttl_seconds'] * CACHE_AGE_WARN_FACTOR]
+    if queues['upload_jobs']: warnings.append(f"งานอัปโหลดค้างในคิว {queues['upload_jobs']} งาน")
+    warnings += [f"งานเบื้องหลัง {name} ล้มเหลว {time.strftime('%H:%M:%S', time.localtime(at))}: {message}" for name, (at, message) in sorted(background_errors().items())]
+    return {'google': google, 'stages': stages, 'cache': cache, 'queues': queues, 'breakers': breakers, 'governor': governor.stats(),
+            'log_writer': writer, 'sessions': sessions, 'session_mb': round(sum(s['state_mb'] for s in sessions), 2),
+            'process_mb': round(process_memory_bytes() / 1e6, 1), 'warnings': warnings}
@@ -0,0 +1,131 @@
+import hashlib
+import io
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+from PIL import Image
+
+from mkp_storage import data_path
+
+# --- CONFIGURATION ---
+# dHash 64 bit: ต่างกันไม่เกินค่านี้ถือว่าเป็นรูปเดียวกัน (ถ่ายซ้ำเฟรมเดิม)
+NEAR_DUPLICATE_DISTANCE = 3
+FINGERPRINT_CACHE_SIZE = 512
+
+# Quality gate: วัดบนรูปย่อ (ด้านยาวไม่เกินค่านี้) ใช้เวลาไม่กี่ ms
+QUALITY_SAMPLE_SIZE = 320
+BLUR_REJECT_VARIANCE = 15.0     # Laplacian variance ต่ำกว่านี้ = เบลอจนอ่านไม่ได้
+BLUR_WARN_VARIANCE = 60.0
+DARK_REJECT_MEAN = 25.0         # ค่าความสว่างเฉลี่ย (0-255) ต่ำกว่านี้ = ภาพดำ
+DARK_WARN_MEAN = 60.0
+OVEREXPOSED_WARN_RATIO = 0.5    # สัดส่วนพิกเซลที่ขาวจนล้น
+
+PhotoFingerprint = namedtuple("PhotoFingerprint", ["sha256", "dhash"])
+
+# --- HASHING ---
+def photo_digest(img_bytes):
+    return hashlib.sha256(img_bytes).hexdigest()
+
+def perceptual_hash(img_pil):
+    # dHash: ย่อเหลือ 9x8 แบบ grayscale แล้วเทียบความสว่างจุดติดกันในแนวนอน
+    small = img_pil.convert("L").resize((9, 8), Image.BILINEAR)
+    px = list(small.getdata()); bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (px[row * 9 + col] > px[row * 9 + col + 1])
+    return bits
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+_fp_cache = OrderedDict()
+_fp_lock = threading.Lock()
+
+def fingerprint(img_bytes, img_pil=None):
+    sha = photo_digest(img_bytes)
+    with _fp_lock:
+        if sha in _fp_cache:
+            _fp_cache.move_to_end(sha); return _fp_cache[sha]
+    if img_pil is None:
+        img_pil = Image.open(io.BytesIO(img_bytes))
+        img_pil.draft("L", (64, 64))  # JPEG decode แบบย่อ เร็วกว่าเปิดเต็มขนาด
+    fp = PhotoFingerprint(sha, perceptual_hash(img_pil))
+    with _fp_lock:
+        _fp_cache[sha] = fp
+        while len(_fp_cache) > FINGERPRINT_CACHE_SIZE: _fp_cache.popitem(last=False)
+    return fp
+
+def find_duplicate(img_bytes, gallery, img_pil=None, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """คืนค่า (index, 'exact' | 'near') ของรูปใน gallery ที่ซ้ำกับรูปใหม่ หรือ None"""
+    new_fp = fingerprint(img_bytes, img_pil)
+    for idx, old_bytes in enumerate(gallery):
+        old_fp = fingerprint(old_bytes)
+        if old_fp.sha256 == new_fp.sha256: return idx, "exact"
+        if hamming_distance(old_fp.dhash, new_fp.dhash) <= max_distance: return idx, "near"
+    return None
+
+# --- QUALITY GATE ---
+def measure_photo_quality(img_pil):
+    w, h = img_pil.size; scale = QUALITY_SAMPLE_SIZE / float(max(w, h))
+    small = img_pil.resize((max(1, int(w * scale)), max(1, int(h * scale))), Image.BOX, reducing_gap=2.0) if scale < 1 else img_pil
+    a = np.asarray(small.convert("L"), dtype=np.float32)
+    if a.shape[0] < 3 or a.shape[1] < 3: return {'sharpness': 0.0, 'brightness': float(a.mean()), 'overexposed': 0.0}
+    lap = a[:-2, 1:-1] + a[2:, 1:-1] + a[1:-1, :-2] + a[1:-1, 2:] - 4.0 * a[1:-1, 1:-1]
+    return {'sharpness': float(lap.var()), 'brightness': float(a.mean()), 'overexposed': float((a >= 250).mean())}
+
+def assess_photo_quality(img_pil):
+    """คืนค่า (level, ข้อความ, metrics) โดย level เป็น 'ok' | 'warn' | 'reject'"""
+    m = measure_photo_quality(img_pil); rejects = []; warns = []
+    if m['brightness'] < DARK_REJECT_MEAN: rejects.append("ภาพมืดเกินไป")
+    elif m['brightness'] < DARK_WARN_MEAN: warns.append("ภาพค่อนข้างมืด")
+    if m['overexposed'] > OVEREXPOSED_WARN_RATIO: warns.append("ภาพสว่างจ้าเกินไป")
+    if m['sharpness'] < BLUR_REJECT_VARIANCE: rejects.append("ภาพเบลอ")
+    elif m['sharpness'] < BLUR_WARN_VARIANCE: warns.append("ภาพไม่ค่อยคมชัด")
+    if rejects: return 'reject', ", ".join(rejects + warns), m
+    if warns: return 'warn', ", ".join(warns), m
+    return 'ok', "", m
+
+# --- GALLERY (ขั้นรับรูปเข้า gallery ของทั้ง 3 แอป และ tools/loadtest.py) ---
+def add_to_gallery(gallery, photo, quality):
+    """photo: file object / bytes จากกล้อง ผ่าน quality gate -> re-encode JPEG -> ตัดรูปซ้ำ แล้วต่อท้าย gallery
+    คืนค่า (added, level, issues, dup) ไม่ได้เพิ่มเมื่อ level == 'reject' หรือ dup = (index, 'exact' | 'near')"""
+    img_pil = Image.open(io.BytesIO(photo) if isinstance(photo, bytes) else photo)
+    if img_pil.mode in ("RGBA", "P"): img_pil = img_pil.convert("RGB")
+    level, issues, _ = assess_photo_quality(img_pil)
+    if level == 'reject': return False, level, issues, None
+    buf = io.BytesIO(); img_pil.save(buf, format='JPEG', quality=quality, optimize=True); img_bytes = buf.getvalue()
+    dup = find_duplicate(img_bytes, gallery, img_pil)
+    if dup: return False, level, issues, dup
+    gallery.append(img_bytes); return True, level, issues, None
+
+# --- UPLOAD INDEX ((Folder, hash) -> Drive File ID) ---
+class UploadIndex:
+    """กันอัปโหลดซ้ำตอนส่งงานเดิมซ้ำ (คิว offline / กดยืนยันซ้ำ) เท่านั้น ไม่ใช่ index รูปทั้งระบบ:
+    รูปเดียวกันที่ส่งไปอีก Folder จะอัปโหลดใหม่เป็นไฟล์ใหม่ ไม่ได้ Link ไปไฟล์เดิม"""
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS folder_uploads (folder_id TEXT NOT NULL, sha256 TEXT NOT NULL, file_id TEXT NOT NULL, uploaded_at REAL NOT NULL, PRIMARY KEY (folder_id, sha256))")
+        self._conn.commit()
+
+    def get(self, folder_id, sha):
+        with self._lock:
+            row = self._conn.execute("SELECT file_id FROM folder_uploads WHERE folder_id = ? AND sha256 = ?", (folder_id, sha)).fetchone()
+        return row[0] if row else None
+
+    def put(self, folder_id, sha, file_id):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO folder_uploads (folder_id, sha256, file_id, uploaded_at) VALUES (?, ?, ?, ?)", (folder_id, sha, file_id, time.time()))
+            self._conn.commit()
+
+_upload_index = None
+_upload_index_lock = threading.Lock()
+
+def get_upload_index():
+    global _upload_index
+    with _upload_index_lock:
+        if _upload_index is None: _upload_index = UploadIndex(data_path("photo_uploads.sqlite3"))
+        return _upload_index
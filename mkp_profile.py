@@ -0,0 +1,97 @@
+import cProfile
+import heapq
+import io
+import itertools
+import json
+import os
+import pstats
+import re
+import runpy
+import threading
+import time
+
+from mkp_storage import data_dir
+
+# --- CONFIGURATION ---
+# MKP_PROFILE=1 เปิด profiler ทุกรอบที่รันทั้งสคริปต์ (fragment rerun ไม่นับ) ปกติปิดไว้เพราะช้าลง
+PROFILE_ENABLED = os.environ.get("MKP_PROFILE", "") not in ("", "0")
+PROFILE_KEEP = int(os.environ.get("MKP_PROFILE_KEEP", "20"))     # เก็บกี่รอบที่ช้าที่สุดต่อ process
+PROFILE_DIR = os.environ.get("MKP_PROFILE_DIR", "")               # ค่าเริ่มต้น: <MKP_DATA_DIR>/profiles
+PROFILE_TOP_FUNCTIONS = 40
+PROFILE_STATE_KEY = '_profile_values'   # ค่าใน session state ของรอบก่อน ใช้หาว่ารอบนี้ widget ไหนเปลี่ยน
+
+_active = threading.local()
+_slowest = []   # min-heap (วินาที, ลำดับ, ชื่อไฟล์ไม่รวมนามสกุล)
+_seq = itertools.count()
+_lock = threading.Lock()
+
+def should_profile():
+    # กันรันซ้อน: รอบที่ถูกรันใหม่ภายใต้ profiler ต้องรันตามปกติ
+    return PROFILE_ENABLED and not getattr(_active, 'running', False)
+
+def profile_dir():
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True); return PROFILE_DIR
+    return data_dir("profiles")
+
+def changed_values(state):
+    """key ใน session state (widget ที่มี key เช่น work_mode / ช่องพิมพ์) ที่ค่าเปลี่ยนจากรอบก่อน อ่านผ่าน st.session_state อย่างเดียว"""
+    now = {k: v for k, v in state.items() if k != PROFILE_STATE_KEY and isinstance(v, (str, int, float, bool))}
+    before = state.get(PROFILE_STATE_KEY) or {}; state[PROFILE_STATE_KEY] = now
+    return sorted(k for k, v in now.items() if k in before and before[k] != v)
+
+def pressed_buttons():
+    """ปุ่มที่ไม่มี key ดูจากข้อมูลภายในของ Streamlit (ไม่ใช่ API สาธารณะ เปลี่ยนตามรุ่น) อ่านไม่ได้คืนค่า []"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        state = get_script_run_ctx().session_state._state
+        out = []
+        for wid in state._new_widget_state.states:
+            if not state._widget_changed(wid): continue
+            try: out.append(state._key_id_mapper.get_key_from_id(wid))
+            except KeyError: out.append(wid)
+        return out
+    except Exception: return []
+
+def triggered_widgets(state=None):
+    # ค่าที่เปลี่ยนใน session state ก่อน แล้วเติมปุ่มจากข้อมูลภายใน (ถ้ายังอ่านได้)
+    out = changed_values(state) if state is not None else []
+    return out + [w for w in pressed_buttons() if w not in out]
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", str(text)).strip("_")[:40] or "run"
+
+def _keep(profiler, seconds, info):
+    # เก็บเฉพาะรอบที่ช้ากว่ารอบที่ช้าน้อยที่สุดในชุด (ครบ PROFILE_KEEP แล้วลบรอบที่เร็วที่สุดออก)
+    with _lock:
+        if len(_slowest) >= PROFILE_KEEP and seconds <= _slowest[0][0]: return None
+        name = f"{time.strftime('%Y%m%d_%H%M%S')}_{int(seconds * 1000)}ms_{_slug(info.get('mode'))}_{next(_seq)}"
+        evicted = heapq.heappushpop(_slowest, (seconds, next(_seq), name)) if len(_slowest) >= PROFILE_KEEP else heapq.heappush(_slowest, (seconds, next(_seq), name))
+    folder = profile_dir(); base = os.path.join(folder, name)
+    profiler.dump_stats(base + ".prof")
+    text = io.StringIO(); pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    with open(base + ".txt", "w", encoding="utf-8") as f: f.write(text.getvalue())
+    with open(base + ".json", "w", encoding="utf-8") as f: json.dump({**info, 'seconds': round(seconds, 4), 'at': time.time(), 'pid': os.getpid()}, f, ensure_ascii=False, indent=1)
+    if evicted:
+        for ext in (".prof", ".txt", ".json"):
+            try: os.remove(os.path.join(folder, evicted[2] + ext))
+            except OSError: pass
+    return base
+
+def run_profiled(path, info=None, state=None):
+    """รันสคริปต์ path ทั้งไฟล์อีกครั้งภายใต้ cProfile (st.rerun / st.stop ส่งต่อออกไปตามปกติ)
+    info: ข้อมูลของรอบ เช่น {'mode': ...} (เติม trigger ให้อัตโนมัติ), state: st.session_state ใช้หา widget ที่เปลี่ยน"""
+    info = {**(info or {}), 'trigger': triggered_widgets(state)}
+    profiler = cProfile.Profile(); _active.running = True; started = time.perf_counter()
+    try:
+        profiler.enable()
+        try: runpy.run_path(path, run_name="__main__")
+        finally: profiler.disable()
+        info['ended'] = 'completed'
+    except BaseException as e:
+        # RerunException / StopException คือรอบที่จบด้วย st.rerun / st.stop
+        info['ended'] = type(e).__name__; raise
+    finally:
+        _active.running = False
+        try: _keep(profiler, time.perf_counter() - started, info)
+        except OSError: pass   # เขียนไฟล์ไม่ได้ ไม่ให้กระทบการทำงานของแอป
@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from mkp_metrics import current_user
+from mkp_storage import data_dir
+
+# --- CONFIGURATION ---
+# บันทึกทุกการสแกน (1 บรรทัด JSON ต่อครั้ง) ไว้วิเคราะห์ย้อนหลัง / replay ด้วย tools/replay_scans.py
+# ไฟล์แยกรายวัน <MKP_DATA_DIR>/scans/YYYYMMDD.jsonl เขียนต่อท้ายอย่างเดียว ปิดได้ด้วย MKP_SCAN_LOG=0
+SCAN_LOG_ENABLED = os.environ.get("MKP_SCAN_LOG", "1") not in ("", "0")
+SCAN_LOG_DIR = os.environ.get("MKP_SCAN_LOG_DIR", "")   # ค่าเริ่มต้น: <MKP_DATA_DIR>/scans
+
+_lock = threading.Lock()
+_file = (None, None)   # (ชื่อไฟล์, file object) ของวันปัจจุบัน
+_app = ""   # แอปที่บันทึก (pack / multi_picture / tracking) แต่ละแอปตัดสินผลต่างกัน replay ต้องรู้ว่ามาจากแอปไหน
+
+def set_scan_app(name):
+    global _app
+    _app = name
+
+def scan_log_dir():
+    if SCAN_LOG_DIR:
+        os.makedirs(SCAN_LOG_DIR, exist_ok=True); return SCAN_LOG_DIR
+    return data_dir("scans")
+
+def _write(event):
+    global _file
+    line = json.dumps(event, ensure_ascii=False) + "\n"
+    path = os.path.join(scan_log_dir(), time.strftime("%Y%m%d", time.localtime(event['ts'])) + ".jsonl")
+    with _lock:
+        if _file[0] != path:
+            if _file[1] is not None: _file[1].close()
+            # append mode + เขียนทีละบรรทัด: หลาย process เขียนไฟล์เดียวกันได้ไม่ปนกัน
+            _file = (path, open(path, "a", encoding="utf-8", buffering=1))
+        _file[1].write(line)
+
+# --- RECORDING ---
+# state = st.session_state (หรือ dict) เก็บเวลาที่เริ่มสแกนข้ามรอบ rerun ได้
+# duration = ตั้งแต่ได้ input (ก่อน decode) จนแอปตัดสินผล รวมเวลารอ rerun ด้วย
+def scan_started(state, source, started=None):
+    """source: 'camera' | 'manual' | 'wedge' (started = เวลาที่รับรหัสจริง ถ้ารับไว้ก่อนรอบนี้)"""
+    state['scan_input'] = {'source': source, 'started': started or time.time()}
+
+def record_scan(state, mode, value, result, source="", duration=0.0, **extra):
+    if not SCAN_LOG_ENABLED: return None
+    if 'scan_station' not in state: state['scan_station'] = uuid.uuid4().hex[:8]   # แยก session สำหรับ replay
+    event = {'ts': round(time.time(), 3), 'app': _app, 'station': state['scan_station'], 'user': current_user(), 'mode': mode, 'input': source,
+             'value': value, 'result': result, 'duration_ms': round(duration * 1000, 1), **extra}
+    try: _write(event)
+    except OSError: return None   # ดิสก์เต็ม/เขียนไม่ได้ ไม่ให้กระทบการสแกน
+    return event
+
+def scan_finished(state, mode, value, result, **extra):
+    """บันทึกผลของการสแกนที่ค้างอยู่ (ไม่มี scan_started ค้าง = rerun ซ้ำของผลเดิม ไม่บันทึก)"""
+    pending = state.get('scan_input')
+    if not pending: return None
+    state['scan_input'] = None
+    return record_scan(state, mode, value, result, pending['source'], time.time() - pending['started'], **extra)
+
+# --- READING ---
+def scan_log_files(paths=None):
+    if not paths: return sorted(glob.glob(os.path.join(scan_log_dir(), "*.jsonl")))
+    out = []
+    for p in paths: out.extend(sorted(glob.glob(os.path.join(p, "*.jsonl"))) if os.path.isdir(p) else sorted(glob.glob(p)) or [p])
+    return out
+
+def read_scans(paths=None):
+    """event ทั้งหมดเรียงตามเวลา (บรรทัดที่เสีย เช่นเขียนไม่ครบตอนเครื่องดับ จะถูกข้าม)"""
+    events = []
+    for path in scan_log_files(paths):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try: events.append(json.loads(line))
+                except ValueError: continue
+    return sorted(events, key=lambda e: e.get('ts', 0))
@@ -0,0 +1,259 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, wait
+
+from mkp_offline import sheets_breaker, get_outbox
+from mkp_metrics import timed, record
+
+# --- CONFIGURATION ---
+# Quota ของ Sheets API คิดต่อ user ต่อ project (ค่าเริ่มต้น 60 ครั้ง/นาที)
+# ทุก session ใน process ใช้ OAuth token เดียวกัน จึงต้องแบ่ง quota ร่วมกัน
+SHEETS_QUOTA_PER_MIN = int(os.environ.get("MKP_SHEETS_QUOTA_PER_MIN", "60"))
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 32.0
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# หน้าจอพนักงานรออยู่: retry น้อยครั้งและไม่เกินเวลาที่กำหนด แล้วให้แอปแจ้ง error / ใช้ข้อมูลใน cache แทน
+INTERACTIVE_MAX_RETRIES = 2
+INTERACTIVE_BUDGET_SECONDS = 5.0
+# เขียนซ้ำไม่ได้ผลเดิม (timeout หลัง Google เขียนไปแล้ว retry = แถวซ้ำ) retry เฉพาะ 429 ที่ Google ยังไม่ได้ทำคำสั่ง
+NON_IDEMPOTENT_CALLS = {'append_row', 'append_rows', 'insert_row', 'insert_rows', 'delete_rows', 'add_worksheet'}
+REQUEST_TIMEOUT_SECONDS = 15       # ไม่ให้ request ค้างนานตอน Google ช้า/ล่ม
+
+# Log writer: รวมแถวจากทุก session แล้วเขียน append_rows ครั้งเดียวต่อ Sheet
+LOG_FLUSH_INTERVAL_MS = int(os.environ.get("MKP_LOG_FLUSH_MS", "500"))
+LOG_FLUSH_MAX_ROWS = int(os.environ.get("MKP_LOG_FLUSH_ROWS", "100"))
+LOG_WRITE_TIMEOUT_SECONDS = 30
+
+# ตัวเลขน้อย = ได้คิวก่อน
+PRIORITY_INTERACTIVE = 0   # อ่านข้อมูลที่หน้าจอพนักงานรออยู่ (login, scan, admin)
+PRIORITY_WRITE = 1         # บันทึก Log
+PRIORITY_BACKGROUND = 2    # งานเบื้องหลัง เช่น refresh cache
+
+def error_status(exc):
+    # gspread.APIError มี .response.status_code / googleapiclient HttpError มี .resp.status
+    code = getattr(getattr(exc, 'response', None), 'status_code', None)
+    if code is None: code = getattr(getattr(exc, 'resp', None), 'status', None)
+    try: return int(code)
+    except (TypeError, ValueError): return None
+
+def is_retryable(exc, idempotent=True):
+    status = error_status(exc)
+    if not idempotent: return status == 429
+    if status is not None: return status in RETRYABLE_STATUS
+    return isinstance(exc, OSError)  # connection reset / timeout (requests.ConnectionError เป็น OSError)
+
+def retry_policy(priority):
+    """คืนค่า (จำนวน retry, เวลารวมสูงสุดเป็นวินาทีหรือ None)"""
+    if priority == PRIORITY_INTERACTIVE: return INTERACTIVE_MAX_RETRIES, INTERACTIVE_BUDGET_SECONDS
+    return MAX_RETRIES, None
+
+# --- REQUEST GOVERNOR (token bucket + priority + retry) ---
+class SheetsGovernor:
+    def __init__(self, per_minute=SHEETS_QUOTA_PER_MIN, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'throttled': 0, 'throttled_seconds': 0.0, 'retried': 0, 'rate_limited': 0, 'failed': 0}
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _count(self, key, amount=1):
+        with self._stats_lock: self._stats[key] += amount
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        ticket = (priority, next(self._seq)); started = time.monotonic(); waited = False
+        with self._cond:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiters[0] == ticket and self._tokens >= 1: break
+                    waited = True
+                    # คิวแรกรอจน token เติมเต็ม 1 ใบ คิวอื่นรอให้คิวก่อนหน้าปลุก
+                    timeout = (1 - self._tokens) / self.rate if self._waiters[0] == ticket else 1.0
+                    self._cond.wait(timeout=max(timeout, 0.01))
+            except BaseException:
+                self._waiters.remove(ticket); heapq.heapify(self._waiters); self._cond.notify_all(); raise
+            heapq.heappop(self._waiters); self._tokens -= 1
+            self._cond.notify_all()
+        if waited:
+            self._count('throttled'); self._count('throttled_seconds', time.monotonic() - started); record("sheets.quota_wait", time.monotonic() - started)
+
+    def penalize(self):
+        # โดน 429 แปลว่า quota จริงหมดแล้ว ให้ทุกคนรอ bucket เติมใหม่
+        with self._cond: self._refill(); self._tokens = min(self._tokens, 0.0)
+
+    def call(self, fn, *args, priority=PRIORITY_INTERACTIVE, breaker=None, idempotent=None, **kwargs):
+        if idempotent is None: idempotent = getattr(fn, '__name__', '') not in NON_IDEMPOTENT_CALLS
+        max_retries, budget = retry_policy(priority); deadline = time.monotonic() + budget if budget is not None else None
+        for attempt in range(max_retries + 1):
+            # circuit breaker นับทุกครั้งที่ลอง ไม่ต้องรอ retry ครบถึงจะรู้ว่าล่ม
+            if breaker is not None: breaker.guard()
+            try:
+                self.acquire(priority)
+                with timed(f"sheets.{getattr(fn, '__name__', 'call')}"): result = fn(*args, **kwargs)
+                if breaker is not None: breaker.record_success()
+                self._count('calls'); return result
+            except BaseException as e:
+                # st.rerun / st.stop ระหว่าง trial ของ breaker: ปล่อยให้ request ถัดไปลองแทน
+                if breaker is not None and not isinstance(e, Exception): breaker.release_trial()
+                if not isinstance(e, Exception): raise
+                if breaker is not None: breaker.record(e)
+                if error_status(e) == 429: self._count('rate_limited'); self.penalize()
+                cap = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)); delay = cap / 2 + random.uniform(0, cap / 2)
+                if not is_retryable(e, idempotent) or attempt == max_retries or (deadline is not None and time.monotonic() + delay > deadline):
+                    self._count('failed'); raise
+                self._count('retried')
+                time.sleep(delay)
+
+    def stats(self):
+        with self._stats_lock: out = dict(self._stats)
+        with self._cond:
+            self._refill(); out['tokens_available'] = round(self._tokens, 2); out['queued'] = len(self._waiters)
+        return out
+
+governor = SheetsGovernor()
+
+def sheets_call(fn, *args, priority=PRIORITY_INTERACTIVE, idempotent=None, **kwargs):
+    return governor.call(fn, *args, priority=priority, breaker=sheets_breaker, idempotent=idempotent, **kwargs)
+
+def authorize_sheets(creds):
+    import gspread
+    gc = gspread.authorize(creds)
+    # gspread 6 ย้าย set_timeout ไปไว้ที่ http_client
+    target = gc.http_client if hasattr(gc, 'http_client') else gc
+    if hasattr(target, 'set_timeout'): target.set_timeout(REQUEST_TIMEOUT_SECONDS)
+    return gc
+
+# --- LOG WRITER (รวมแถว Log จากทุก session เป็น batch เดียว) ---
+class LogWriter:
+    def __init__(self, write_rows, flush_interval_ms=LOG_FLUSH_INTERVAL_MS, max_rows=LOG_FLUSH_MAX_ROWS):
+        # write_rows(spreadsheet_key, tab, rows, header) ต้อง raise ถ้าเขียนไม่สำเร็จ
+        if write_rows is None: raise ValueError("LogWriter ต้องมี write_rows")
+        self.write_rows = write_rows
+        self.flush_interval = flush_interval_ms / 1000.0; self.max_rows = max_rows
+        self._cond = threading.Condition()
+        self._pending = {}; self._count = 0; self._first_at = None
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'rows': 0, 'batches': 0, 'failed_rows': 0}
+
+    def submit(self, spreadsheet_key, tab, row, header=None):
+        future = Future()
+        with self._cond:
+            self._pending.setdefault((spreadsheet_key, tab), []).append((row, header, future)); self._count += 1
+            if self._first_at is None: self._first_at = time.monotonic()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mkp-log-writer", daemon=True); self._thread.start()
+            self._cond.notify_all()
+        return future
+
+    def pending(self, spreadsheet_key=None, tab=None):
+        with self._cond:
+            return [row for (key, t), items in self._pending.items() if (spreadsheet_key is None or key == spreadsheet_key) and (tab is None or t == tab) for row, _, _ in items]
+
+    def _take_batch(self):
+        with self._cond:
+            # flush เมื่อครบ max_rows หรือแถวแรกรอครบ flush_interval
+            while self._count < self.max_rows:
+                if self._first_at is None: self._cond.wait(); continue
+                remaining = self._first_at + self.flush_interval - time.monotonic()
+                if remaining <= 0: break
+                self._cond.wait(remaining)
+            batch = self._pending; self._pending = {}; self._count = 0; self._first_at = None
+        return batch
+
+    def _run(self):
+        while True: self.flush(self._take_batch())
+
+    def flush(self, batch):
+        for (key, tab), items in batch.items():
+            rows = [row for row, _, _ in items]
+            try:
+                self.write_rows(key, tab, rows, items[0][1])
+            except Exception as e:
+                # เขียนไม่สำเร็จ ไม่ทิ้งแถว เก็บเข้า outbox ไว้ส่งใหม่
+                with self._stats_lock: self._stats['failed_rows'] += len(rows)
+                try:
+                    outbox = get_outbox()
+                    for row, header, _ in items: outbox.add(key, tab, row, header)
+                finally:
+                    for _, _, future in items: future.set_exception(e)
+            else:
+                with self._stats_lock: self._stats['rows'] += len(rows); self._stats['batches'] += 1
+                for _, _, future in items: future.set_result(len(rows))
+
+    def stats(self):
+        with self._stats_lock: out = dict(self._stats)
+        with self._cond: out['pending'] = self._count
+        return out
+
+_log_writers = {}   # write_rows -> LogWriter
+_log_writer_lock = threading.Lock()
+
+def get_log_writer(write_rows):
+    # writer 1 ตัวต่อฟังก์ชันเขียน ต่อ process ทุก session ที่ใช้ฟังก์ชันเดียวกัน (Workspace ตัวเดียวกัน) รวม batch กัน
+    with _log_writer_lock:
+        writer = _log_writers.get(write_rows)
+        if writer is None: writer = _log_writers[write_rows] = LogWriter(write_rows)
+        return writer
+
+def log_writer_stats():
+    # รวมทุก writer ใน process (ยังไม่มี writer = ยังไม่เคยบันทึก Log)
+    with _log_writer_lock: writers = list(_log_writers.values())
+    out = {'rows': 0, 'batches': 0, 'failed_rows': 0, 'pending': 0}
+    for w in writers:
+        for key, value in w.stats().items(): out[key] += value
+    return out
+
+def wait_for_writes(futures, timeout=LOG_WRITE_TIMEOUT_SECONDS):
+    """คืนค่า (errors, จำนวนที่ยังเขียนไม่เสร็จ) แถวที่ยังไม่เสร็จยังอยู่ใน writer ไม่ต้องส่งซ้ำ"""
+    done, not_done = wait(futures, timeout=timeout)
+    errors = [f.exception() for f in done if f.exception() is not None]
+    return errors, len(not_done)
+
+# --- PROJECTED READ (ดึงเฉพาะคอลัมน์ที่ใช้ด้วย batch_get ครั้งเดียว) ---
+_headers = {}
+_headers_lock = threading.Lock()
+
+def column_letter(n):
+    # 1 -> A, 27 -> AA
+    letters = ""
+    while n: n, r = divmod(n - 1, 26); letters = chr(65 + r) + letters
+    return letters
+
+def read_projected(worksheet, cache_key, select, priority=PRIORITY_INTERACTIVE):
+    """select(header) -> [(ชื่อคอลัมน์, ตำแหน่ง 0-based), ...]
+    คืนค่า (ชื่อคอลัมน์, rows) เหมือน get_all_values ที่เหลือแค่คอลัมน์ที่เลือก"""
+    with _headers_lock: header = _headers.get(cache_key)
+    for _ in range(2):
+        if header is None: header = sheets_call(worksheet.row_values, 1, priority=priority)
+        picked = select(header)
+        if not picked: return [], []
+        ranges = [f"{column_letter(pos + 1)}1:{column_letter(pos + 1)}" for _, pos in picked]
+        columns = [[row[0] if row else "" for row in values] for values in sheets_call(worksheet.batch_get, ranges, priority=priority)]
+        # แถวแรกของทุกคอลัมน์ต้องตรงกับ header ที่จำไว้ ไม่ตรง = มีคนย้าย/แทรกคอลัมน์ ให้อ่าน header ใหม่
+        if all((col[0] if col else "") == (header[pos] if pos < len(header) else "") for col, (_, pos) in zip(columns, picked)):
+            with _headers_lock: _headers[cache_key] = header
+            n_rows = max(len(col) for col in columns)
+            rows = [[col[i] if i < len(col) else "" for col in columns] for i in range(1, n_rows)]
+            return [name for name, _ in picked], rows
+        header = None
+    # header เปลี่ยนระหว่างอ่านซ้ำ ๆ: อ่านทั้ง Tab ครั้งเดียวแทน
+    with _headers_lock: _headers.pop(cache_key, None)
+    rows = sheets_call(worksheet.get_all_values, priority=priority)
+    picked = select(rows[0]) if rows else []
+    return [name for name, _ in picked], [[row[pos] if pos < len(row) else "" for _, pos in picked] for row in rows[1:]]
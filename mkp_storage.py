@@ -0,0 +1,16 @@
+import os
+
+# --- LOCAL STORAGE ---
+# ไฟล์ข้อมูลฝั่ง server (hash index, snapshot, queue) เก็บไว้ใต้โฟลเดอร์เดียว
+# เปลี่ยนที่เก็บได้ด้วย env MKP_DATA_DIR
+DATA_DIR = os.environ.get("MKP_DATA_DIR", ".mkp_data")
+
+def data_dir(*parts):
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def data_path(*parts):
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
@@ -0,0 +1,59 @@
+import hashlib
+import hmac
+import os
+import threading
+from collections import namedtuple
+
+# Tab User: คอลัมน์ 1 = ID, 2 = Password, 3 = ชื่อ, 4 = Role (ไม่บังคับ)
+# row = เลขแถวใน Sheet (แถว 1 = header) ใช้ลบแถวตรงๆ ไม่ต้องค้นทั้ง Sheet
+UserRecord = namedtuple("UserRecord", ["id", "name", "role", "verifier", "row"])
+FIRST_DATA_ROW = 2
+
+# salt สุ่มใหม่ทุก process: verifier ใช้เทียบรหัสผ่านในหน่วยความจำเท่านั้น ไม่ได้บันทึกลงที่ไหน
+_salt = os.urandom(16)
+
+def normalize_user_id(value):
+    return str(value).strip().lower()
+
+def password_verifier(password):
+    return hashlib.sha256(_salt + str(password).strip().encode("utf-8")).hexdigest()
+
+def check_password(verifier, password):
+    return hmac.compare_digest(verifier, password_verifier(password))
+
+# --- USER INDEX (ID ที่ normalize แล้ว -> UserRecord) ---
+class UserIndex:
+    def __init__(self, users=None):
+        self._users = dict(users or {})
+
+    @classmethod
+    def from_frame(cls, df):
+        users = {}
+        if df is None or df.empty or len(df.columns) < 3: return cls(users)
+        ids = df.iloc[:, 0].astype(str).str.strip(); passwords = df.iloc[:, 1].astype(str)
+        roles = df.iloc[:, 3].astype(str).str.strip().str.lower() if len(df.columns) >= 4 else [''] * len(df)
+        for pos, (user_id, password, name, role) in enumerate(zip(ids, passwords, df.iloc[:, 2], roles)):
+            key = user_id.lower()
+            # ID ซ้ำใน Sheet ใช้แถวแรก (เหมือนเดิมที่ใช้ match.iloc[0])
+            if not key or key in users: continue
+            users[key] = UserRecord(user_id, name, 'admin' if role == 'admin' else 'staff', password_verifier(password), FIRST_DATA_ROW + pos)
+        return cls(users)
+
+    def get(self, user_id):
+        return self._users.get(normalize_user_id(user_id))
+
+    def __contains__(self, user_id):
+        return normalize_user_id(user_id) in self._users
+
+    def __len__(self):
+        return len(self._users)
+
+_index = (None, UserIndex())
+_index_lock = threading.Lock()
+
+def get_user_index(df):
+    # สร้าง index ใหม่เฉพาะตอนตาราง User ใน cache เปลี่ยน (refresh / เพิ่ม / ลบ) ไม่ต้อง normalize ทั้งคอลัมน์ทุกครั้งที่ login
+    global _index
+    with _index_lock:
+        if _index[0] is not df: _index = (df, UserIndex.from_frame(df))
+        return _index[1]
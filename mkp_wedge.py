@@ -0,0 +1,53 @@
+import json
+import os
+import time
+
+# --- CONFIGURATION ---
+# โหมดเครื่องสแกน (keyboard wedge: สแกนเนอร์ USB/Bluetooth พิมพ์รหัสแล้วกด Enter ให้เอง) ใช้แทนกล้อง
+# MKP_WEDGE_MODE=1 เปิดเป็นค่าเริ่มต้นสำหรับเครื่องที่ต่อสแกนเนอร์ไว้ (ปิด/เปิดเองได้ที่ sidebar)
+WEDGE_DEFAULT = os.environ.get("MKP_WEDGE_MODE", "0") not in ("", "0")
+WEDGE_FOCUS_MS = 300   # ตรวจแล้วคืน focus ให้ช่องสแกนทุกกี่ ms
+
+def split_codes(text):
+    """แยกรหัสที่มาติดกันในครั้งเดียว (สแกนรัวระหว่าง rerun / ตั้ง suffix เป็น Tab หรือเว้นวรรค)"""
+    return (text or "").split()
+
+# --- BUFFER (รหัสที่รับแล้วแต่ยังไม่ได้ประมวลผล เก็บใน session ข้ามรอบ rerun) ---
+class WedgeBuffer:
+    __slots__ = ('_codes',)
+
+    def __init__(self):
+        self._codes = []   # [(รหัส, เวลาที่รับ)]
+
+    def push(self, text):
+        codes = split_codes(text); received = time.time()
+        self._codes.extend((code, received) for code in codes)
+        return len(codes)
+
+    def pop(self):
+        return self._codes.pop(0) if self._codes else None
+
+    def drain(self):
+        codes, self._codes = self._codes, []
+        return codes
+
+    def clear(self):
+        self._codes = []
+
+    def __len__(self):
+        return len(self._codes)
+
+# --- FOCUS (HTML สำหรับ components.html: ให้ช่องสแกนได้ focus เสมอ สแกนต่อได้โดยไม่ต้องแตะจอ) ---
+def focus_script(label):
+    # ไม่แย่ง focus จากช่องพิมพ์อื่น แต่แย่งจากปุ่มได้ (Enter ของสแกนเนอร์จะได้ไม่ไปกดปุ่มที่เพิ่งแตะ)
+    return f"""<script>
+    const doc = window.parent.document;
+    const grab = () => {{
+        const box = doc.querySelector('input[aria-label=' + {json.dumps(json.dumps(label, ensure_ascii=False))} + ']');
+        const active = doc.activeElement;
+        if (!box || active === box) return;
+        if (active && ['INPUT', 'TEXTAREA', 'SELECT'].includes(active.tagName)) return;
+        box.focus();
+    }};
+    grab(); setInterval(grab, {WEDGE_FOCUS_MS});
+    </script>"""
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# backend จำลอง + ที่เก็บข้อมูลชั่วคราว ต้องตั้งก่อน import mkp_* (singleton อ่าน env ตอน import)
+os.environ.setdefault("MKP_BACKEND", "fake")
+os.environ.setdefault("MKP_DATA_DIR", tempfile.mkdtemp(prefix="mkp-test-"))
+os.environ.setdefault("MKP_SCAN_LOG", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
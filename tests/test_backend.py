@@ -0,0 +1,13 @@
+import pytest
+
+from mkp_backend import FakeBackend, FaultInjector, worksheet_not_found_type
+
+def backend():
+    b = FakeBackend(faults=FaultInjector(latency_ms=0, jitter_ms=0, error_rate=0, upload_ms_per_mb=0), data_dir=None)
+    b.seed('key', 'Items', [["Barcode"], ["885"]]); return b
+
+def test_missing_worksheet_raises_like_gspread():
+    sh = backend().sheets.open_by_key('key')
+    assert sh.get_worksheet(0).title == 'Items'
+    with pytest.raises(worksheet_not_found_type()): sh.get_worksheet(1)
+    with pytest.raises(worksheet_not_found_type()): sh.worksheet('Logs')
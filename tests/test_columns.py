@@ -0,0 +1,36 @@
+from mkp_columns import ColumnMap, ColumnRule, strip_float_suffix
+
+COLUMNS = ColumnMap([
+    ColumnRule('Tracking', contains=('tracking', ('order', 'id'))),
+    ColumnRule('Barcode', contains=('barcode',), normalize=strip_float_suffix),
+    ColumnRule(None, contains=('id',), normalize=strip_float_suffix),
+], positional={'Brand': 3})
+HEADER = ['Order ID', 'Tracking No', 'barcode', 'Name', 'Name', '', ' Barcode 2']
+
+def test_first_matching_column_claims_the_name():
+    plan = COLUMNS.plan(HEADER)
+    assert plan.names == ('Tracking', 'Tracking No', 'Barcode', 'Name', 'Name_1', 'Untitled', 'Barcode 2')
+
+def test_normalizers_are_planned_per_column():
+    plan = COLUMNS.plan(HEADER)
+    # Order ID: rule ที่ไม่เปลี่ยนชื่อ (id) / barcode: rule Barcode ใส่ครั้งเดียวไม่ซ้ำ
+    assert plan.normalizers[0] == (strip_float_suffix,) and plan.normalizers[2] == (strip_float_suffix,)
+    assert plan.normalizers[1] == () and plan.normalizers[6] == ()
+
+def test_plan_is_cached_per_header():
+    assert COLUMNS.plan(HEADER) is COLUMNS.plan(list(HEADER))
+    assert COLUMNS.plan(HEADER[:3]) is not COLUMNS.plan(HEADER)
+
+def test_pick_prefers_positional_and_skips_missing():
+    plan = COLUMNS.plan(HEADER)
+    assert COLUMNS.pick(plan, ['Brand', 'Barcode', 'Qty']) == [('Brand', 3), ('Barcode', 2)]
+    assert COLUMNS.pick(COLUMNS.plan(HEADER[:2]), ['Brand']) == []
+
+def test_frame_applies_normalizers_and_positional_columns():
+    plan = COLUMNS.plan(HEADER)
+    df = COLUMNS.frame(plan, [['123.0', 'T1', '885.0', 'Shirt', 'x', '', '9.0']])
+    assert df.loc[0, 'Tracking'] == '123' and df.loc[0, 'Barcode'] == '885' and df.loc[0, 'Barcode 2'] == '9.0'
+    assert df.loc[0, 'Brand'] == 'Shirt'
+    picked = COLUMNS.pick(plan, ['Barcode', 'Brand'])
+    df = COLUMNS.frame(plan, [['885.0', 'Shirt']], picked)
+    assert list(df.columns) == ['Barcode', 'Brand'] and df.loc[0, 'Barcode'] == '885'
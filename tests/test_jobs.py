@@ -0,0 +1,88 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import mkp_offline
+from mkp_backend import FakeAPIError, FakeBackend, FaultInjector
+from mkp_jobs import Workspace
+from mkp_models import RIDER_NO_HISTORY, RiderBatch, verify_rider_scan
+from mkp_offline import UploadSpool, background_errors, drive_breaker
+
+PACK_JOB = {'kind': 'pack', 'order_val': 'TH1', 'ts': '20261018_235900', 'timestamp': '2026-10-18 23:59:00', 'user_name': 'Tester', 'user_id': 'tester',
+            'items': [{'Barcode': '885', 'Product Name': 'Shirt', 'Location': 'A-1', 'Qty': 1}]}
+
+class FailingChunk(FaultInjector):
+    """ให้ chunk ที่ fail_at ของการอัปโหลดล้มเหลวด้วย 503 (เหมือน Drive ล่มกลางงาน)"""
+    def __init__(self, fail_at):
+        super().__init__(latency_ms=0, jitter_ms=0, error_rate=0, upload_ms_per_mb=0); self.fail_at = fail_at; self.chunks = 0
+
+    def before(self, op, nbytes=0):
+        if op.endswith(".chunk"):
+            self.chunks += 1
+            if self.chunks == self.fail_at: raise FakeAPIError(503, "backend error")
+        super().before(op, nbytes)
+
+def photo(seed):
+    buf = io.BytesIO(); Image.fromarray(np.random.default_rng(seed).integers(0, 255, (32, 32, 3), dtype=np.uint8)).save(buf, format='JPEG')
+    return buf.getvalue()
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    spool = UploadSpool(str(tmp_path)); monkeypatch.setattr(mkp_offline, '_spool', spool)
+    drive_breaker.record_success(); yield spool; drive_breaker.record_success()
+
+def test_drain_skips_a_bad_job_and_keeps_going(spool):
+    ws = Workspace('drain-log', 'root', lambda: None, lambda: object())
+    first = spool.add({**PACK_JOB, 'order_val': 'BAD'}, []); second = spool.add(PACK_JOB, [])
+    replayed = []
+    def run_job(service, job, images):
+        if job['order_val'] == 'BAD': job['folder_id'] = 'F-BAD'; raise ValueError("folder deleted")
+        replayed.append(job['order_val']); return [], 0
+    ws.run_job = run_job
+    ws.drain_spool()
+    assert replayed == ['TH1'] and spool.job_ids() == [first]
+    assert spool.jobs()[0]['folder_id'] == 'F-BAD'   # รอบหน้าใช้ Folder เดิม
+    assert 'ValueError' in background_errors()['upload_spool'][1]
+
+def test_drain_stops_on_outage(spool):
+    ws = Workspace('drain-log', 'root', lambda: None, lambda: object())
+    spool.add(PACK_JOB, []); spool.add(PACK_JOB, [])
+    calls = []
+    def run_job(service, job, images):
+        calls.append(job['order_val']); raise FakeAPIError(503)
+    ws.run_job = run_job
+    ws.drain_spool()
+    assert len(calls) == 1 and len(spool) == 2
+
+def test_spooled_job_replays_into_its_original_folder(spool):
+    pytest.importorskip("googleapiclient.http")
+    backend = FakeBackend(faults=FailingChunk(fail_at=2), data_dir=None)
+    backend.seed('replay-log', 'Logs', [["Timestamp"]])
+    ws = Workspace('replay-log', 'root', lambda: backend.sheets, lambda: backend.drive)
+    images = [photo(seed) for seed in range(3)]
+    assert ws.submit_job(dict(PACK_JOB), images) == (False, [], 0)
+    assert spool.jobs()[0].get('folder_id')   # Folder สร้างก่อนล่ม ถูกจำไว้ในงาน
+    backend.faults.fail_at = None; drive_breaker.record_success()
+    ws.drain_spool()
+    assert len(spool) == 0
+    files = list(backend.files.values()); folders = {f['id']: f['name'] for f in files if f['mimeType'].endswith('folder')}
+    photos = [f for f in files if not f['mimeType'].endswith('folder')]
+    # วันที่ / Folder ตามเวลาที่ยืนยันงาน ไม่ใช่เวลาที่ส่งซ้ำ และไม่มีรูปซ้ำ
+    assert '18-10-2026' in folders.values() and list(folders.values()).count('TH1_23-59') == 1
+    assert len(photos) == 3 and {folders[p['parents'][0]] for p in photos} == {'TH1_23-59'}
+
+def test_rider_adds_blocked_without_history():
+    # Sheet ล่มและไม่มี snapshot: ห้ามถือว่าทุก Order ใหม่
+    ws = Workspace('no-history-log', 'root', lambda: None, lambda: None)
+    batch = RiderBatch()
+    assert verify_rider_scan(batch, 'TH1', ws.load_rider_history) == RIDER_NO_HISTORY
+    assert len(batch) == 0 and ws.rider_history_missing
+
+def test_drain_without_drive_service_leaves_the_spool(spool):
+    ws = Workspace('drain-log', 'root', lambda: None, lambda: None)
+    spool.add(PACK_JOB, []); spool.add(PACK_JOB, [])
+    ws.run_job = lambda service, job, images: pytest.fail("ไม่มี service ต้องไม่ลองส่งงาน")
+    ws.drain_spool()
+    assert len(spool) == 2 and 'BackendUnavailable' in background_errors()['upload_spool'][1]
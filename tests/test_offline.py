@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from mkp_backend import FakeAPIError
+from mkp_offline import DRIVE_NUM_RETRIES, BackendUnavailable, CircuitBreaker, UploadSpool, WriteOutbox, drive_call
+
+def failing(status):
+    def call(): raise FakeAPIError(status)
+    return call
+
+def tripped(breaker):
+    for _ in range(breaker.failure_threshold): breaker.record(FakeAPIError(503))
+    return breaker
+
+# --- CIRCUIT BREAKER ---
+def test_breaker_opens_after_threshold_outages():
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=60)
+    for _ in range(2): breaker.record(FakeAPIError(503))
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record(FakeAPIError(503))
+    assert breaker.state == 'open' and not breaker.allow() and breaker.retry_in() > 0
+    with pytest.raises(BackendUnavailable): breaker.call(lambda: None)
+
+def test_breaker_ignores_non_outage_errors():
+    breaker = CircuitBreaker("test", failure_threshold=2, cooldown=60)
+    breaker.record(FakeAPIError(503))
+    for status in (404, 403, 429): breaker.record(FakeAPIError(status))
+    assert breaker.state == 'closed'
+    # ไม่ล้างจำนวนครั้งที่ล้มเหลว: ล่มอีกครั้งเดียวก็ครบ threshold
+    breaker.record(FakeAPIError(503))
+    assert breaker.state == 'open'
+
+def test_half_open_allows_one_trial():
+    breaker = tripped(CircuitBreaker("test", failure_threshold=1, cooldown=0.05)); time.sleep(0.06)
+    assert breaker.state == 'half_open'
+    assert breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow()
+
+def test_failed_trial_reopens():
+    breaker = tripped(CircuitBreaker("test", failure_threshold=3, cooldown=0.05)); time.sleep(0.06)
+    with pytest.raises(FakeAPIError): breaker.call(failing(503))
+    assert breaker.state == 'open'
+
+def test_non_outage_trial_releases_without_closing():
+    breaker = tripped(CircuitBreaker("test", failure_threshold=1, cooldown=0.05)); time.sleep(0.06)
+    with pytest.raises(FakeAPIError): breaker.call(failing(404))
+    assert breaker.state == 'half_open' and breaker.allow()
+
+def test_interrupted_trial_is_released():
+    # st.rerun / st.stop เป็น BaseException: ไม่รู้ผล ปล่อยให้ request ถัดไปลองแทน
+    class Rerun(BaseException): pass
+    def interrupted(): raise Rerun()
+    breaker = tripped(CircuitBreaker("test", failure_threshold=1, cooldown=0.05)); time.sleep(0.06)
+    with pytest.raises(Rerun): breaker.call(interrupted)
+    assert breaker.allow()
+
+# --- QUEUES ---
+def test_outbox_keeps_going_past_a_failing_tab(tmp_path):
+    outbox = WriteOutbox(str(tmp_path / "outbox.jsonl"))
+    outbox.add('key', 'Broken', ["a"]); outbox.add('key', 'Logs', ["b"])
+    written = []
+    def write_rows(key, tab, rows, header):
+        if tab == 'Broken': raise ValueError("no permission")
+        written.append((tab, rows))
+    outbox.drain(write_rows)
+    assert written == [('Logs', [["b"]])]
+    assert WriteOutbox(outbox.path).pending() == [["a"]]
+
+def test_outbox_stops_on_outage(tmp_path):
+    outbox = WriteOutbox(str(tmp_path / "outbox.jsonl"))
+    outbox.add('key', 'A', ["a"]); outbox.add('key', 'B', ["b"])
+    calls = []
+    def write_rows(key, tab, rows, header):
+        calls.append(tab); raise FakeAPIError(503)
+    outbox.drain(write_rows)
+    assert calls == ['A'] and len(outbox) == 2
+
+def test_spool_round_trip(tmp_path):
+    spool = UploadSpool(str(tmp_path))
+    job_id = spool.add({'kind': 'pack', 'order_val': 'TH1'}, [b"img1", b"img2"])
+    job, images = spool.load(job_id)
+    assert job['order_val'] == 'TH1' and images == [b"img1", b"img2"]
+    spool.update(job_id, {**job, 'folder_id': 'F1'})
+    # process ใหม่อ่านคิวจาก disk ได้ความคืบหน้าล่าสุด
+    reopened = UploadSpool(str(tmp_path))
+    assert reopened.job_ids() == [job_id] and reopened.jobs()[0]['folder_id'] == 'F1'
+    reopened.done(job_id)
+    assert len(reopened) == 0 and UploadSpool(str(tmp_path)).job_ids() == []
+
+def test_drive_create_is_not_retried():
+    class Request:
+        def __init__(self, method_id): self.methodId = method_id; self.retries = None
+        def execute(self, num_retries=0): self.retries = num_retries; return {}
+    create, listing = Request('drive.files.create'), Request('drive.files.list')
+    drive_call(create); drive_call(listing)
+    assert create.retries == 0 and listing.retries == DRIVE_NUM_RETRIES
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from mkp_catalog import without_row
+from mkp_users import FIRST_DATA_ROW, UserIndex, check_password, get_user_index
+
+def users_frame():
+    return pd.DataFrame([[' Alice ', 'pw1', 'Alice A', 'admin'], ['bob', 'pw2', 'Bob B', ''], ['ALICE', 'dup', 'Alice 2', ''], ['', 'x', 'Nobody', '']],
+                        columns=['ID', 'Password', 'Name', 'Role'])
+
+def test_index_normalizes_ids_and_keeps_first_duplicate():
+    index = UserIndex.from_frame(users_frame())
+    assert len(index) == 2 and 'alice' in index and ' BOB ' in index
+    alice = index.get('ALICE')
+    assert alice.name == 'Alice A' and alice.role == 'admin' and alice.row == FIRST_DATA_ROW
+    assert check_password(alice.verifier, 'pw1') and not check_password(alice.verifier, 'dup')
+    assert index.get('bob').role == 'staff' and index.get('bob').row == FIRST_DATA_ROW + 1
+
+def test_index_without_role_column():
+    index = UserIndex.from_frame(users_frame().iloc[:, :3])
+    assert index.get('alice').role == 'staff'
+    assert len(UserIndex.from_frame(pd.DataFrame())) == 0
+
+def test_index_is_rebuilt_only_when_the_frame_changes():
+    df = users_frame()
+    assert get_user_index(df) is get_user_index(df)
+    assert get_user_index(df.copy()) is not get_user_index(df)
+
+def test_deleted_row_shifts_following_users_up():
+    # ลบแถวตาม UserRecord.row แล้วแถวถัดไปเลื่อนขึ้นมาแทนเหมือน delete_rows ใน Sheet
+    df = users_frame(); bob = UserIndex.from_frame(df).get('bob')
+    after = without_row(df, UserIndex.from_frame(df).get('alice').row - FIRST_DATA_ROW)
+    index = UserIndex.from_frame(after)
+    assert list(after['Name']) == ['Bob B', 'Alice 2', 'Nobody'] and list(after.index) == [0, 1, 2]
+    assert index.get('bob').row == bob.row - 1
+    # ID ซ้ำแถวถัดไปกลายเป็นแถวแรกของ ID นั้น
+    assert index.get('alice').name == 'Alice 2' and index.get('alice').row == FIRST_DATA_ROW + 1
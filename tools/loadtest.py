@@ -0,0 +1,262 @@
+"""จำลองพนักงานแพ็ค/Rider หลายสถานีพร้อมกันบน backend จำลอง (MKP_BACKEND=fake)
+
+    python tools/loadtest.py [--packers 8] [--riders 2] [--duration 60] [--latency-ms 80] [--json loadtest.json]
+
+แต่ละสถานีเป็น thread ทำงานตาม flow ของแอป: login -> สแกน Tracking -> สแกนสินค้า -> ถ่ายรูป -> ยืนยัน
+(Rider: สแกน Tracking ที่แพ็คเสร็จแล้วทีละชุด -> เช็คประวัติซ้ำ -> ถ่ายรูปปิดตู้ -> ยืนยัน)
+ใช้ cache / log writer / governor / breaker / photo gate ตัวเดียวกับแอป รูปเป็น JPEG ขนาดกล้องมือถือ
+รายงาน orders/min, เวลาแต่ละขั้น (p50/p95/p99), CPU และ memory ของ process
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# ต้องตั้งก่อน import โมดูลของแอป (อ่านค่าตอน import)
+os.environ["MKP_BACKEND"] = "fake"
+os.environ.setdefault("MKP_DATA_DIR", tempfile.mkdtemp(prefix="mkp_loadtest_"))
+
+from mkp_backend import get_fake_backend, open_sheets, open_drive  # noqa: E402
+from mkp_jobs import Workspace, RIDER_LOG_HEADER, ORDER_DATA_SCHEMA, ORDER_DATA_INDEX, SHEET_COLUMNS  # noqa: E402
+from mkp_metrics import percentile, set_user, summary  # noqa: E402
+from mkp_models import PackSession, RiderBatch, verify_scan, verify_rider_scan, SCAN_WRONG, RIDER_ADDED  # noqa: E402
+from mkp_ops import process_memory_bytes  # noqa: E402
+from mkp_photo import add_to_gallery  # noqa: E402
+from mkp_sheets import governor, log_writer_stats  # noqa: E402
+from mkp_users import get_user_index, check_password  # noqa: E402
+
+# --- CONFIGURATION (ชื่อ Tab / คอลัมน์ เหมือน MKP_scan_pack.py) ---
+MAIN_FOLDER_ID = 'loadtest-root'
+LOG_SHEET_ID = 'loadtest-log'
+ORDER_CHECK_SHEET_ID = 'loadtest-order-check'
+ORDER_DATA_SHEET_NAME = 'Order_Data'
+LOG_SHEET_NAME = 'Logs'
+RIDER_SHEET_NAME = 'Rider_Logs'
+USER_SHEET_NAME = 'User'
+
+# --- SEED DATA ---
+def seed_backend(backend, n_orders, n_users, rnd):
+    users = [["ID", "Password", "Name", "Role"]] + [[f"U{i:04d}", f"pw{i}", f"Station {i}", "staff"] for i in range(n_users)]
+    orders = [["Tracking", "Barcode", "Name", "Location", "Qty", "Zone"]]; trackings = []
+    for _ in range(n_orders):
+        tracking = f"TH{rnd.randrange(10**11):011d}"; trackings.append(tracking)
+        for _ in range(rnd.randint(1, 4)):
+            orders.append([tracking, f"885{rnd.randrange(10**9):09d}.0", f"Product {rnd.randrange(2000)}", f"A-{rnd.randrange(50):02d}", "1", rnd.choice("ABCD")])
+    backend.seed(ORDER_CHECK_SHEET_ID, USER_SHEET_NAME, users)
+    backend.seed(ORDER_CHECK_SHEET_ID, ORDER_DATA_SHEET_NAME, orders)
+    backend.seed(LOG_SHEET_ID, RIDER_SHEET_NAME, [RIDER_LOG_HEADER])
+    return trackings
+
+def make_photos(n, size, seed):
+    # ลายบล็อกสุ่ม + noise: ผ่าน quality gate, dHash ไม่ซ้ำกัน, ขนาดไฟล์ใกล้รูปกล้องมือถือจริง
+    rng = np.random.default_rng(seed); w, h = size; photos = []
+    for _ in range(n):
+        blocks = rng.integers(50, 210, (h // 40 + 1, w // 40 + 1, 3), dtype=np.uint8).repeat(40, axis=0).repeat(40, axis=1)[:h, :w]
+        arr = np.clip(blocks.astype(np.int16) + rng.integers(-18, 18, (h, w, 3), dtype=np.int16), 0, 255).astype(np.uint8)
+        buf = io.BytesIO(); Image.fromarray(arr).save(buf, format='JPEG', quality=92); photos.append(buf.getvalue())
+    return photos
+
+# --- APP LOGIC (โหลดข้อมูล / ยืนยันงานผ่าน mkp_jobs ตัวเดียวกับแอป ไม่มีส่วน Streamlit) ---
+workspace = Workspace(LOG_SHEET_ID, MAIN_FOLDER_ID, lambda: open_sheets(None), lambda: open_drive(None), log_tab=LOG_SHEET_NAME, rider_tab=RIDER_SHEET_NAME)
+
+def load_sheet_data(sheet_name, spreadsheet_key, index=None, schema=None):
+    return workspace.load_frame(spreadsheet_key, sheet_name, lambda priority: workspace.fetch_frame(spreadsheet_key, sheet_name, SHEET_COLUMNS, list(schema or ()), priority), index=index, schema=schema)
+
+def add_photo_to_gallery(gallery, payload, quality):
+    return add_to_gallery(gallery, payload, quality)[0]
+
+# --- VIRTUAL STATIONS ---
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock(); self.steps = {}; self.counts = {}
+
+    def step(self, name, seconds):
+        with self.lock: self.steps.setdefault(name, []).append(seconds)
+
+    def count(self, name, n=1):
+        with self.lock: self.counts[name] = self.counts.get(name, 0) + n
+
+class Station(threading.Thread):
+    def __init__(self, name, user, run, rnd):
+        super().__init__(name=name, daemon=True)
+        self.user = user; self.run_ctx = run; self.rnd = rnd; self.stats = run.stats
+
+    def timed_step(self, name, fn, *args):
+        started = time.perf_counter()
+        try: return fn(*args)
+        finally: self.stats.step(name, time.perf_counter() - started)
+
+    def think(self):
+        if self.run_ctx.think_ms: time.sleep(self.rnd.uniform(0.5, 1.5) * self.run_ctx.think_ms / 1000)
+
+    def login(self):
+        users = get_user_index(load_sheet_data(USER_SHEET_NAME, ORDER_CHECK_SHEET_ID)); user = users.get(self.user[0])
+        if user is None or not check_password(user.verifier, self.user[1]): raise RuntimeError(f"login failed: {self.user[0]}")
+        return user
+
+    def run(self):
+        set_user(self.user[0])
+        try:
+            self.timed_step("login", self.login)
+            while not self.run_ctx.stop.is_set():
+                self.cycle(); self.think()
+        except Exception as e:
+            self.stats.count(f"error:{type(e).__name__}"); self.run_ctx.errors.append(f"{self.name}: {e!r}")
+
+    def submit(self, job, gallery):
+        uploaded, errors, waiting = workspace.submit_job(job, gallery)
+        if not uploaded: self.stats.count("upload_queued")
+        if errors or waiting: self.stats.count("log_write_failed")
+
+    def capture(self, gallery, n, quality):
+        for payload in self.rnd.sample(self.run_ctx.photos, n):
+            self.think()
+            if not self.timed_step("gallery_capture", add_photo_to_gallery, gallery, payload, quality): self.stats.count("photo_rejected")
+
+class Packer(Station):
+    def cycle(self):
+        tracking = self.run_ctx.next_tracking()
+        session = PackSession()
+        def scan_tracking():
+            matches = load_sheet_data(ORDER_DATA_SHEET_NAME, ORDER_CHECK_SHEET_ID, index=ORDER_DATA_INDEX, schema=ORDER_DATA_SCHEMA).lookup('Tracking', tracking)
+            session.set_expected(matches.to_dict('records'))
+        self.timed_step("tracking_scan", scan_tracking)
+        if not session.expected: self.stats.count("tracking_not_found"); return
+        for item in session.expected:
+            self.think()
+            # สแกนผิดบ้างเป็นครั้งคราว (เหมือนหยิบผิดชิ้น)
+            if self.rnd.random() < self.run_ctx.wrong_rate and self.timed_step("verify_scan", verify_scan, session, "0000000000000")[0] == SCAN_WRONG: self.stats.count("wrong_scan")
+            self.timed_step("verify_scan", verify_scan, session, item.barcode)
+        gallery = []; self.capture(gallery, self.run_ctx.pack_photos, 90)
+        self.timed_step("pack_confirm", self.confirm, tracking, session, gallery)
+        self.stats.count("orders_packed"); self.run_ctx.packed.put(tracking)
+
+    def confirm(self, tracking, session, gallery):
+        now = datetime.utcnow() + timedelta(hours=7)
+        job = {'kind': 'pack', 'order_val': tracking, 'ts': now.strftime("%Y%m%d_%H%M%S"), 'timestamp': now.strftime("%Y-%m-%d %H:%M:%S"),
+               'user_name': self.user[0], 'user_id': self.user[0], 'items': session.records()}
+        self.submit(job, gallery)
+
+class Rider(Station):
+    def cycle(self):
+        batch = RiderBatch()
+        while len(batch) < self.run_ctx.rider_batch and not self.run_ctx.stop.is_set():
+            try: tracking = self.run_ctx.packed.get(timeout=0.5)
+            except queue.Empty:
+                if batch: break
+                continue
+            self.think()
+            def scan():
+                df = load_sheet_data(ORDER_DATA_SHEET_NAME, ORDER_CHECK_SHEET_ID, index=ORDER_DATA_INDEX, schema=ORDER_DATA_SCHEMA)
+                outcome = verify_rider_scan(batch, tracking, workspace.load_rider_history, known=lambda order_id: df.contains('Tracking', order_id))
+                return None if outcome == RIDER_ADDED else outcome
+            rejected = self.timed_step("rider_scan", scan)
+            if rejected: self.stats.count(f"rider_{rejected}")
+        if not batch: return
+        gallery = []; self.capture(gallery, self.run_ctx.rider_photos, 120)
+        self.timed_step("rider_confirm", self.confirm, batch, gallery)
+        self.stats.count("orders_loaded", len(batch))
+
+    def confirm(self, batch, gallery):
+        now = datetime.utcnow() + timedelta(hours=7)
+        job = {'kind': 'rider', 'ts': now.strftime("%Y%m%d_%H%M%S"), 'timestamp': now.strftime("%Y-%m-%d %H:%M:%S"), 'user_name': self.user[0],
+               'license_plate': "NoPlate", 'lp_clean': "NoPlate", 'orders': batch.ids()}
+        self.submit(job, gallery)
+
+class LoadRun:
+    def __init__(self, args, trackings, photos):
+        self.stats = Stats(); self.stop = threading.Event(); self.errors = []; self.packed = queue.Queue()
+        self.think_ms = args.think_ms; self.wrong_rate = args.wrong_rate; self.rider_batch = args.rider_batch
+        self.pack_photos = args.pack_photos; self.rider_photos = args.rider_photos; self.photos = photos
+        self._trackings = trackings; self._next = 0; self._lock = threading.Lock()
+
+    def next_tracking(self):
+        # แต่ละ Tracking แพ็คได้ครั้งเดียว วนกลับต้นรายการถ้าหมด
+        with self._lock: tracking = self._trackings[self._next % len(self._trackings)]; self._next += 1
+        return tracking
+
+# --- REPORT ---
+def step_rows(steps):
+    out = []
+    for name, values in sorted(steps.items()):
+        values = sorted(values)
+        out.append({'step': name, 'count': len(values), 'p50_ms': round(percentile(values, 0.5) * 1000, 1), 'p95_ms': round(percentile(values, 0.95) * 1000, 1),
+                    'p99_ms': round(percentile(values, 0.99) * 1000, 1), 'max_ms': round(values[-1] * 1000, 1)})
+    return out
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF); return usage.ru_utime + usage.ru_stime
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--packers", type=int, default=8)
+    parser.add_argument("--riders", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=60, help="วินาที")
+    parser.add_argument("--orders", type=int, default=20_000, help="จำนวน Tracking ใน Order_Data")
+    parser.add_argument("--think-ms", type=float, default=300, help="เวลาคิดเฉลี่ยระหว่างขั้น (0 = เร็วที่สุด)")
+    parser.add_argument("--wrong-rate", type=float, default=0.05)
+    parser.add_argument("--pack-photos", type=int, default=2)
+    parser.add_argument("--rider-photos", type=int, default=1)
+    parser.add_argument("--rider-batch", type=int, default=5)
+    parser.add_argument("--photo-size", default="1920x1080")
+    parser.add_argument("--latency-ms", type=float, default=None, help="หน่วงทุก request ของ backend จำลอง")
+    parser.add_argument("--jitter-ms", type=float, default=None)
+    parser.add_argument("--error-rate", type=float, default=None)
+    parser.add_argument("--upload-ms-per-mb", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="บันทึกผลเป็น JSON")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed); backend = get_fake_backend()
+    backend.faults.configure(**{name: value for name, value in (('latency_ms', args.latency_ms), ('jitter_ms', args.jitter_ms), ('error_rate', args.error_rate), ('upload_ms_per_mb', args.upload_ms_per_mb)) if value is not None})
+    trackings = seed_backend(backend, args.orders, args.packers + args.riders, rnd); rnd.shuffle(trackings)
+    w, h = (int(v) for v in args.photo_size.lower().split("x"))
+    photos = make_photos(max(8, args.pack_photos + args.rider_photos) * 2, (w, h), args.seed)
+    run = LoadRun(args, trackings, photos)
+    stations = [Packer(f"packer-{i}", (f"U{i:04d}", f"pw{i}"), run, random.Random(args.seed * 1000 + i)) for i in range(args.packers)]
+    stations += [Rider(f"rider-{i}", (f"U{args.packers + i:04d}", f"pw{args.packers + i}"), run, random.Random(args.seed * 1000 + args.packers + i)) for i in range(args.riders)]
+
+    print(f"packers={args.packers} riders={args.riders} duration={args.duration:.0f}s orders={args.orders} photo={w}x{h} ({sum(map(len, photos)) / len(photos) / 1e6:.2f} MB avg)")
+    memory_samples = []; cpu_started = cpu_seconds(); started = time.perf_counter()
+    for s in stations: s.start()
+    while time.perf_counter() - started < args.duration:
+        time.sleep(min(1.0, args.duration)); memory_samples.append(process_memory_bytes())
+    run.stop.set()
+    for s in stations: s.join(timeout=30)
+    elapsed = time.perf_counter() - started; cpu_used = cpu_seconds() - cpu_started
+
+    counts = dict(run.stats.counts)
+    result = {
+        'config': vars(args), 'elapsed_seconds': round(elapsed, 1),
+        'orders_per_min': round(counts.get('orders_packed', 0) / elapsed * 60, 1), 'rider_orders_per_min': round(counts.get('orders_loaded', 0) / elapsed * 60, 1),
+        'steps': step_rows(run.stats.steps), 'google': [t for t in summary() if t['op'].startswith(('sheets.', 'drive.'))], 'counts': counts,
+        'cpu_percent': round(cpu_used / elapsed * 100, 1), 'rss_mb_avg': round(sum(memory_samples) / max(1, len(memory_samples)) / 1e6, 1),
+        'rss_mb_peak': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1), 'governor': governor.stats(), 'log_writer': log_writer_stats(),
+        'backend_calls': dict(backend.faults.calls), 'errors': run.errors[:20],
+    }
+
+    print(f"  orders/min {result['orders_per_min']:.1f} (rider {result['rider_orders_per_min']:.1f})  cpu {result['cpu_percent']:.0f}%  rss avg {result['rss_mb_avg']:.0f} MB peak {result['rss_mb_peak']:.0f} MB")
+    print(f"  {'step':<22} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for row in result['steps']: print(f"  {row['step']:<22} {row['count']:>7} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+    for t in result['google']: print(f"  {t['op']:<22} {t['count']:>7} {t['p50_ms']:>9.1f} {t['p95_ms']:>9.1f} {'-':>9} {t['max_ms']:>9.1f}")
+    print(f"  counts {counts}")
+    for err in run.errors[:5]: print(f"  ! {err}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(result, f, ensure_ascii=False, indent=1)
+        print(f"  -> {args.json}")
+
+if __name__ == "__main__":
+    main()
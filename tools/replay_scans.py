@@ -0,0 +1,142 @@
+"""Replay การสแกนที่บันทึกไว้ (mkp_scanlog) ผ่าน logic ตัดสินผลของโหมดแพ็ค/Rider กับ snapshot ของ Order_Data และ Rider_Logs
+
+    python tools/replay_scans.py --orders Order_Data.csv [--items Items.csv] [--rider-logs Rider_Logs.csv] [scans/20240101.jsonl ...] [--speed 1] [--json replay.json]
+
+- ไม่ระบุไฟล์สแกน = อ่านทุกไฟล์ใน <MKP_DATA_DIR>/scans
+- แต่ละ station (session) มี PackSession / RiderBatch ของตัวเอง ยืนยันแพ็ค/ปิดตู้แล้วเริ่มใหม่ (ปิดตู้แล้ว Order เข้าประวัติ Rider)
+- ตัดสินผลตามแอปที่บันทึก (field app): แอป tracking รับ Tracking ทุกตัว ค้น Barcode ใน Tab สินค้า (--items) และ Scan ปิดตู้ไม่เช็ค Order_Data
+- --speed 0 (ค่าเริ่มต้น) รันเร็วที่สุด, 1 = ตามจังหวะเวลาจริง, 10 = เร็วกว่าจริง 10 เท่า
+รายงานเวลาที่บันทึกไว้ (รวมรอ rerun) เทียบกับเวลาตัดสินผลตอน replay, ผลที่ไม่ตรงกับที่บันทึก และการสแกนที่ช้าที่สุด
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mkp_catalog import SharedTable, compact_frame  # noqa: E402
+from mkp_jobs import ORDER_DATA_SCHEMA, ORDER_DATA_INDEX, SHEET_COLUMNS, ITEM_SCHEMA, ITEM_INDEX, ITEM_COLUMNS, RIDER_LOG_COLUMNS  # noqa: E402
+from mkp_metrics import percentile  # noqa: E402
+from mkp_models import OrderItem, PackSession, RiderBatch, verify_scan, verify_rider_scan  # noqa: E402
+from mkp_scanlog import read_scans  # noqa: E402
+
+TRACKING_MODES = ('pack_order', 'pack_item')   # scan log รุ่นเก่าไม่มี field app: เดาจากโหมดที่มีเฉพาะแอป tracking
+SLOWEST = 10
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8-sig") as f: return list(csv.reader(f))
+
+def load_table(path, column_map, schema, index):
+    # normalize แบบเดียวกับ load_sheet_data -> SharedTable
+    rows = read_csv(path); plan = column_map.plan(rows[0]); picked = column_map.pick(plan, list(schema))
+    df = column_map.frame(plan, [[row[pos] if pos < len(row) else "" for _, pos in picked] for row in rows[1:]], picked)
+    return SharedTable.from_frame(compact_frame(df, schema), index)
+
+def load_orders(path):
+    return load_table(path, SHEET_COLUMNS, ORDER_DATA_SCHEMA, ORDER_DATA_INDEX)
+
+def load_items(path):
+    return load_table(path, ITEM_COLUMNS, ITEM_SCHEMA, ITEM_INDEX) if path else None
+
+def load_rider_history(path):
+    if not path: return set()
+    rows = read_csv(path); df = RIDER_LOG_COLUMNS.frame(RIDER_LOG_COLUMNS.plan(rows[0]), rows[1:])
+    return set(df['Order ID'].astype(str).str.strip().str.upper()) if 'Order ID' in df.columns else set()
+
+class Station:
+    __slots__ = ('session', 'batch', 'app')
+
+    def __init__(self):
+        self.session = PackSession(); self.batch = RiderBatch(); self.app = ""
+
+class Replayer:
+    def __init__(self, orders, history, items=None):
+        self.orders = orders; self.items = items; self.history = history; self.stations = {}
+
+    def decide(self, event):
+        """คืนผลจาก logic ปัจจุบัน (None = event ที่ replay ไม่ได้ เช่น decode ไม่ออก / โหมดที่ไม่มีข้อมูลอ้างอิง)"""
+        station = self.stations.setdefault(event.get('station', ''), Station()); mode = event.get('mode'); value = event.get('value', "")
+        app = station.app = event.get('app') or station.app or ('tracking' if mode in TRACKING_MODES else "")
+        if event.get('result') == 'decode_miss': return None
+        if app == 'tracking': return self.decide_tracking(station, event, mode, value)
+        if mode == 'pack_tracking':
+            station.session = PackSession(); station.session.set_expected(self.orders.lookup('Tracking', value).to_dict('records'))
+            return 'found' if station.session.expected else 'not_found'
+        if mode == 'pack_product': return verify_scan(station.session, value)[0]
+        if mode == 'rider':
+            if event.get('result') == 'load_error': return None
+            return verify_rider_scan(station.batch, value, lambda: self.history, known=lambda order_id: self.orders.contains('Tracking', order_id))
+        if mode == 'pack_confirm':
+            station.session = PackSession(); return event.get('result')
+        if mode == 'rider_confirm':
+            self.history.update(str(o).strip().upper() for o in (event.get('orders') or station.batch.ids())); station.batch = RiderBatch(); return event.get('result')
+        return None
+
+    def decide_tracking(self, station, event, mode, value):
+        # MKP_scan_pack_by_tracking.py: ไม่มี Order_Data, สแกนสินค้าซ้ำได้ (1 สแกน = 1 ชิ้น)
+        if mode == 'pack_order':
+            station.session = PackSession(); return 'accepted'
+        if mode == 'pack_item':
+            if self.items is None: return None
+            if self.items.lookup('Barcode', value).empty: return 'not_found'
+            station.session.add(OrderItem(value), unique=False); return 'added'
+        if mode == 'rider': return verify_rider_scan(station.batch, value, lambda: self.history)
+        if mode == 'pack_confirm':
+            station.session = PackSession(); return event.get('result')
+        if mode == 'rider_confirm':
+            self.history.update(str(o).strip().upper() for o in (event.get('orders') or station.batch.ids())); station.batch = RiderBatch(); return event.get('result')
+        return None
+
+def latency_row(mode, recorded, replayed, mismatches, skipped):
+    recorded = sorted(recorded); replayed = sorted(replayed)
+    pct = lambda values, q: round(percentile(values, q), 2) if values else None
+    return {'mode': mode, 'count': len(recorded), 'skipped': skipped, 'mismatches': mismatches,
+            'recorded_p50_ms': pct(recorded, 0.5), 'recorded_p95_ms': pct(recorded, 0.95), 'recorded_max_ms': recorded[-1] if recorded else None,
+            'replay_p50_us': pct(replayed, 0.5), 'replay_p95_us': pct(replayed, 0.95), 'replay_max_us': round(replayed[-1], 2) if replayed else None}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scans", nargs="*", help="ไฟล์/โฟลเดอร์/glob ของ scan log")
+    parser.add_argument("--orders", required=True, help="Order_Data.csv (export จาก Sheet)")
+    parser.add_argument("--items", help="Tab สินค้าของแอป tracking (export จาก Sheet) ไม่ระบุ = ข้ามการสแกนสินค้าของแอป tracking")
+    parser.add_argument("--rider-logs", help="Rider_Logs.csv (export จาก Sheet)")
+    parser.add_argument("--speed", type=float, default=0)
+    parser.add_argument("--json", help="บันทึกผลเป็น JSON")
+    args = parser.parse_args()
+
+    events = read_scans(args.scans)
+    if not events: sys.exit("ไม่พบ scan log")
+    started = time.perf_counter(); replayer = Replayer(load_orders(args.orders), load_rider_history(args.rider_logs), load_items(args.items))
+    print(f"events={len(events)} stations={len({e.get('station') for e in events})} orders={len(replayer.orders)} rider_history={len(replayer.history)} (load {time.perf_counter() - started:.2f}s)")
+
+    per_mode = {}; mismatches = []; first_ts = events[0].get('ts', 0); replay_started = time.perf_counter()
+    for event in events:
+        if args.speed > 0:
+            wait = (event.get('ts', 0) - first_ts) / args.speed - (time.perf_counter() - replay_started)
+            if wait > 0: time.sleep(wait)
+        t0 = time.perf_counter(); result = replayer.decide(event); elapsed_us = (time.perf_counter() - t0) * 1e6
+        stat = per_mode.setdefault(event.get('mode', '?'), {'recorded': [], 'replayed': [], 'mismatches': 0, 'skipped': 0})
+        stat['recorded'].append(event.get('duration_ms', 0.0))
+        if result is None: stat['skipped'] += 1; continue
+        stat['replayed'].append(elapsed_us)
+        if result != event.get('result'):
+            stat['mismatches'] += 1; mismatches.append({**event, 'replayed': result})
+
+    rows = [latency_row(mode, s['recorded'], s['replayed'], s['mismatches'], s['skipped']) for mode, s in sorted(per_mode.items())]
+    slowest = sorted(events, key=lambda e: -e.get('duration_ms', 0))[:SLOWEST]
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+    print(f"  {'mode':<14} {'count':>6} {'skip':>5} {'diff':>5} {'rec p50 ms':>11} {'rec p95 ms':>11} {'rec max ms':>11} {'replay p95 us':>14}")
+    for r in rows:
+        print(f"  {r['mode']:<14} {r['count']:>6} {r['skipped']:>5} {r['mismatches']:>5} {fmt(r['recorded_p50_ms'], '11.1f')} {fmt(r['recorded_p95_ms'], '11.1f')} {fmt(r['recorded_max_ms'], '11.1f')} {fmt(r['replay_p95_us'], '14.1f')}")
+    print("  slowest recorded scans:")
+    for e in slowest: print(f"    {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(e.get('ts', 0)))} {e.get('user', ''):<10} {e.get('mode', ''):<14} {e.get('input', ''):<7} {e.get('result', ''):<10} {e.get('duration_ms', 0):9.1f} ms  {e.get('value', '')}")
+    for m in mismatches[:SLOWEST]: print(f"  ! {m.get('mode')} {m.get('value')}: recorded {m.get('result')} / replay {m.get('replayed')}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump({'events': len(events), 'modes': rows, 'slowest': slowest, 'mismatches': mismatches}, f, ensure_ascii=False, indent=1)
+        print(f"  -> {args.json}")
+
+if __name__ == "__main__":
+    main()